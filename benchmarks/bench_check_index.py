@@ -0,0 +1,121 @@
+"""Benchmark of the stats queries before and after the (website, date) indexes migration
+
+Fill a temporary database with synthetic checks (10M by default) with the schema before the indexes,
+time the queries of the stats and of the alerts, apply the migrations and time them again.
+
+From the root directory:
+python3 -m benchmarks.bench_check_index --rows 10000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from monitor.models import db, Website, Check, Alert
+from monitor.migrations import migrate_schema
+from monitor.rollups import get_checks_aggregate
+
+INSERT_CHUNK = 100000
+
+
+def create_schema_before_indexes():
+    """The tables of the schema version 1: all the columns, but only the foreign key indexes"""
+    db.create_tables([Website, Check, Alert])
+    db.execute_sql('DROP INDEX "check_website_id_date"')
+    db.execute_sql('DROP INDEX "alert_website_id_date"')
+    db.execute_sql('DROP INDEX "alert_date"')
+    db.execute_sql('CREATE INDEX "check_website_id" ON "check" ("website_id")')
+    db.pragma("user_version", 1)
+
+
+def fill(nb_rows, nb_websites, nb_days):
+    """Insert {nb_rows} checks spread over {nb_websites} websites and the last {nb_days} days"""
+    with db.atomic():
+        websites = [Website.create(url="http://site%d.test/" % i, check_interval=10) for i in range(nb_websites)]
+    ids = [website.id for website in websites]
+
+    now = time.time()
+    start = now - nb_days * 24 * 3600
+    step = (now - start) / (nb_rows / nb_websites)
+    sql = ('INSERT INTO "check" (website_id, date, full_resp_time, resp_time, status_code, dns_time, '
+           'connect_time, tls_time, ttfb_time, body_time, outcome) VALUES (?, ?, ?, ?, ?, 0, 0, 0, ?, ?, ?)')
+
+    inserted = 0
+    while inserted < nb_rows:
+        rows = []
+        for i in range(inserted, min(inserted + INSERT_CHUNK, nb_rows)):
+            rt = random.uniform(0.01, 0.5)
+            full_rt = rt + random.uniform(0, 0.2)
+            code = 200 if random.random() < 0.95 else random.choice((301, 404, 500))
+            rows.append((ids[i % nb_websites], int(start + (i // nb_websites) * step), full_rt, rt, code,
+                         rt, full_rt - rt, Check.OK))
+        with db.atomic():
+            db.cursor().executemany(sql, rows)
+        inserted += len(rows)
+        print("\rInserted %d/%d checks" % (inserted, nb_rows), end="", flush=True)
+    print()
+    return websites
+
+
+def time_queries(websites, repeat):
+    """Return {query name: median duration in ms} over the websites
+
+    The stats of the checks saved in the database (the live stats of a monitor come from its rolling window)
+    """
+    queries = {
+        "checks of 2 min": 2,
+        "checks of 10 min": 10,
+        "checks of 60 min": 60,
+    }
+    results = {}
+    for name, timeframe in queries.items():
+        durations = []
+        for _ in range(repeat):
+            for website in websites:
+                start = time.perf_counter()
+                get_checks_aggregate(website, time.time() - timeframe * 60)
+                durations.append(1000 * (time.perf_counter() - start))
+        results[name] = statistics.median(durations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000000, help="number of synthetic checks")
+    parser.add_argument("--websites", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30, help="the checks are spread over the last days")
+    parser.add_argument("--sample", type=int, default=10, help="number of websites whose stats are timed")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.init(path)
+
+    try:
+        create_schema_before_indexes()
+        websites = fill(args.rows, args.websites, args.days)
+        sample = random.sample(websites, args.sample)
+
+        before = time_queries(sample, args.repeat)
+
+        start = time.perf_counter()
+        migrate_schema()
+        migration_time = time.perf_counter() - start
+
+        after = time_queries(sample, args.repeat)
+
+        print("Migration: %.1f s" % migration_time)
+        print("%-22s %12s %12s" % ("Median (ms)", "before", "after"))
+        for name in before:
+            print("%-22s %12.2f %12.2f" % (name, before[name], after[name]))
+    finally:
+        db.close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
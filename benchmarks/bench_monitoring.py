@@ -0,0 +1,261 @@
+"""Benchmark of the monitoring of many websites, on a local farm of stub HTTP servers
+
+For each number of websites, fill a temporary database with stub websites (see benchmarks.stub_farm), run their
+WebsiteMonitor with the CheckWriter and the CheckEngine (or the shards) of the TUI for {duration} seconds, then
+measure the stats queries. The results are printed as JSON (or saved with --output), and compared
+with the results of a previous run with --compare.
+
+From the root directory:
+python3 -m benchmarks.bench_monitoring --sites 1000 10000 50000 --duration 60 --output results.json
+python3 -m benchmarks.bench_monitoring --sites 1000 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from peewee import fn
+
+from benchmarks.stub_farm import StubFarm, site_urls
+from monitor.models import db, Website, Check
+from monitor.monitor import db_init
+from monitor.website_monitor import WebsiteMonitor, get_monitors_stats
+from monitor.check_engine import CheckEngine
+from monitor.check_writer import CheckWriter
+from monitor.sharding import ShardedEngine
+from monitor.instrumentation import instruments
+from monitor.segments import SegmentStore
+from monitor import storage
+
+INSERT_CHUNK = 1000
+
+
+class BenchController:
+    """Count the alerts of the monitors"""
+
+    def __init__(self):
+        self.nb_alerts = 0
+
+    def update_alert_history(self, alert):
+        self.nb_alerts += 1
+
+
+def current_rss():
+    """The resident memory of the process in MB (None when /proc is not there)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """The peak resident memory of the process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In KB on Linux, in bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def median_duration(function, repeat):
+    """The median duration of function() in ms"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(1000 * (time.perf_counter() - start))
+    return statistics.median(durations)
+
+
+def histogram_stats(name):
+    histogram = instruments.get_histograms().get(name)
+    return histogram.get_stats() if histogram else None
+
+
+def disk_usage(*paths):
+    """The space taken on the disk by the files (and the files of the directories) in MB"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names)
+        elif os.path.exists(path):
+            files.append(path)
+    # The segment files are sparse: their last chunk is not allocated until it is written
+    return sum(os.stat(file).st_blocks * 512 for file in files) / 2 ** 20
+
+
+def run(nb_sites, ports, args):
+    """Monitor {nb_sites} stub websites for args.duration seconds, and return the results"""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.init(path)
+    store = None
+    if args.check_store == "segments":
+        store = SegmentStore(tempfile.mkdtemp(suffix="_segments"))
+        storage.set_check_store(store)
+    instruments.reset()
+    rss_before = current_rss()
+
+    try:
+        db_init()
+        urls = site_urls(ports, nb_sites, args.latency, args.error_rate, args.failure_rate, args.body_size,
+                         args.seed)
+        with db.atomic():
+            for i in range(0, nb_sites, INSERT_CHUNK):
+                Website.insert_many([{"url": url, "check_interval": args.interval, "timing": args.timing}
+                                     for url in urls[i:i + INSERT_CHUNK]]).execute()
+
+        start = time.perf_counter()
+        controller = BenchController()
+        writer = CheckWriter()
+        monitors = [WebsiteMonitor(website, controller, writer=writer, samples_capacity=args.samples_capacity)
+                    for website in Website.select()]
+        setup_time = time.perf_counter() - start
+
+        if args.shards:
+            engine = ShardedEngine(args.shards, args.concurrency)
+        else:
+            engine = CheckEngine(args.concurrency)
+
+        # The peak memory while the monitors run
+        rss_peak = [current_rss()]
+        stopped = threading.Event()
+
+        def sample_rss():
+            while not stopped.wait(1):
+                rss_peak.append(current_rss())
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+        writer.start()
+        engine.start(monitors)
+        time.sleep(args.duration)
+        start = time.perf_counter()
+        engine.stop()
+        writer.stop()
+        stop_time = time.perf_counter() - start
+        # After the stop: the shards send their last stats when they stop
+        lag = engine.get_lag_stats()
+        stopped.set()
+        sampler.join()
+
+        if store:
+            counts = Counter(row[4] for website_id in store.website_ids() for row in store.rows(website_id, 0))
+        else:
+            counts = dict(Check.select(Check.outcome, fn.COUNT(Check.id)).group_by(Check.outcome).tuples())
+        nb_checks = sum(count for outcome, count in counts.items() if outcome != Check.OVERRUN)
+        flush = histogram_stats("writer_flush_seconds")
+        batches = histogram_stats("writer_batch_size")
+
+        return {
+            "sites": nb_sites,
+            "setup_s": setup_time,
+            "stop_s": stop_time,
+            "checks": nb_checks,
+            "checks_per_s": nb_checks / args.duration,
+            # The part of the checks due during the run that have been done
+            "completion": nb_checks / (nb_sites * args.duration / args.interval),
+            "outcomes": counts,
+            "alerts": controller.nb_alerts,
+            "lag": lag,
+            "scheduler_lag_s": histogram_stats("scheduler_lag_seconds"),
+            "check_duration_s": histogram_stats("check_duration_seconds"),
+            "db_flush_s": flush,
+            "db_rows_per_s": batches["sum"] / flush["sum"] if flush and flush["sum"] else None,
+            "db_batch_size": batches,
+            # The live stats come from the windows of the monitors, the older ones from the rollups
+            "stats_window_ms": median_duration(lambda: get_monitors_stats(monitors, 10), args.repeat),
+            "stats_history_ms": median_duration(lambda: get_monitors_stats(monitors, 120), args.repeat),
+            "rss_before_mb": rss_before,
+            "rss_mb": max(rss for rss in rss_peak if rss is not None) if rss_before is not None else None,
+            "rss_peak_mb": peak_rss(),
+            "db_mb": disk_usage(path, path + "-wal"),
+            "segments_mb": disk_usage(store.directory) if store else None,
+        }
+    finally:
+        db.close()
+        os.remove(path)
+        if store:
+            storage.set_check_store(None)
+            store.close()
+            shutil.rmtree(store.directory)
+
+
+def flatten(results, prefix=""):
+    """The numbers of the results {"key.subkey": value}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + str(key) + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + str(key)] = value
+    return flat
+
+
+def compare(previous, current):
+    """Print the change of each number between the runs of the same number of websites"""
+    previous_runs = {run["sites"]: run for run in previous["runs"]}
+    for current_run in current["runs"]:
+        previous_run = previous_runs.get(current_run["sites"])
+        if not previous_run:
+            continue
+        print("%d websites: %-32s %14s %14s %8s" % (current_run["sites"], "", "previous", "current", "change"))
+        before, after = flatten(previous_run), flatten(current_run)
+        for key in sorted(after):
+            if key in before:
+                change = "%+.1f%%" % (100 * (after[key] - before[key]) / before[key]) if before[key] else ""
+                print("  %-45s %14.4g %14.4g %8s" % (key, before[key], after[key], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, nargs="+", default=[1000], help="numbers of websites, one run each")
+    parser.add_argument("--duration", type=float, default=30, help="of each run, in seconds")
+    parser.add_argument("--interval", type=int, default=10, help="check interval of the websites, in seconds")
+    parser.add_argument("--timing", choices=(Website.COLD, Website.WARM), default=Website.COLD)
+    parser.add_argument("--concurrency", type=int, default=CheckEngine.MAX_CONCURRENCY)
+    parser.add_argument("--shards", type=int, default=0, help="number of worker processes running the checks")
+    parser.add_argument("--check-store", choices=("sqlite", "segments"), default="sqlite",
+                        help="where the checks are saved")
+    parser.add_argument("--samples-capacity", type=int, default=WebsiteMonitor.SAMPLES_CAPACITY)
+    parser.add_argument("--servers", type=int, default=2, help="number of stub servers (processes and origins)")
+    parser.add_argument("--latency", type=float, default=0.02, help="of the stub websites, in seconds")
+    parser.add_argument("--body-size", type=int, default=2048, help="of the stub websites, in bytes")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="part of the websites answering an error")
+    parser.add_argument("--failure-rate", type=float, default=0.01,
+                        help="part of the websites failing without response (reset, close, hang)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times the stats queries are timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results in this JSON file")
+    parser.add_argument("--compare", help="compare with the results of a previous run (JSON file)")
+    args = parser.parse_args()
+
+    with StubFarm(args.servers) as farm:
+        runs = []
+        for nb_sites in args.sites:
+            print("Monitoring %d websites for %g s" % (nb_sites, args.duration), file=sys.stderr, flush=True)
+            runs.append(run(nb_sites, farm.ports, args))
+
+    results = {"benchmark": "monitoring", "date": time.time(), "python": platform.python_version(),
+               "platform": platform.platform(), "cpus": os.cpu_count(), "config": vars(args), "runs": runs}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark of the alerts and of the stats on days of simulated monitoring (see monitor.simulation)
+
+Fill a temporary database with websites, replay {days} of their checks (the models of the websites have random
+latencies, errors and outages), calculating the stats every {stats-interval} seconds like the TUI does.
+The results are printed as JSON (or saved with --output).
+
+From the root directory:
+python3 -m benchmarks.bench_simulation --sites 100 --days 1
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from monitor.models import db, Website
+from monitor.monitor import db_init
+from monitor.simulation import Simulation, SiteModel, Outage
+from monitor.instrumentation import instruments
+
+DAY = 24 * 3600
+
+
+def site_models(websites, duration, rand):
+    """A SiteModel for each website, with about one outage a day"""
+    models = {}
+    for website in websites:
+        outages = []
+        for _ in range(max(1, int(duration / DAY))):
+            start = rand.uniform(0, duration)
+            outages.append(Outage(start, start + rand.uniform(60, 1800), rand.choice((500, 503))))
+        models[website.id] = SiteModel(latency=rand.uniform(0.02, 0.5), error_rate=rand.uniform(0, 0.02),
+                                       failure_rate=rand.uniform(0, 0.01), outages=outages)
+    return models
+
+
+def run(args):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.init(path)
+    instruments.reset()
+    try:
+        db_init()
+        Website.insert_many([{"url": "http://site%d.test/" % i, "check_interval": args.interval}
+                             for i in range(args.sites)]).execute()
+        websites = list(Website.select())
+        duration = args.days * DAY
+        simulation = Simulation(websites, site_models(websites, duration, random.Random(args.seed)),
+                                stats_interval=args.stats_interval, timeframes=(10, 60, 120), seed=args.seed)
+        report = simulation.run(duration)
+        stats_query = instruments.get_histograms().get("stats_query_seconds")
+        return dict(report, simulated_s=duration, checks_per_s=report["checks"] / report["wall_time"],
+                    speedup=duration / report["wall_time"],
+                    stats_query_s=stats_query.get_stats() if stats_query else None)
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=20)
+    parser.add_argument("--days", type=float, default=1, help="of simulated monitoring")
+    parser.add_argument("--interval", type=int, default=10, help="check interval of the websites, in seconds")
+    parser.add_argument("--stats-interval", type=float, default=60, help="in simulated seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the results in this JSON file")
+    args = parser.parse_args()
+
+    print("Simulating %g days of %d websites" % (args.days, args.sites), file=sys.stderr, flush=True)
+    results = {"benchmark": "simulation", "date": time.time(), "python": platform.python_version(),
+               "platform": platform.platform(), "config": vars(args), "run": run(args)}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
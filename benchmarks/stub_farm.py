@@ -0,0 +1,151 @@
+"""A farm of local stub HTTP servers for the benchmarks
+
+Each server is an asyncio server in its own process (so that it does not take the GIL of the benchmarked program),
+listening on its own port: the websites of a benchmark are spread over the servers, which are as many origins.
+The servers are stateless: what a website answers is in the query of its url (see site_url):
+- l: the latency before the response, in seconds (the actual one is between 0.5 and 1.5 times it)
+- s: the status code
+- b: the size of the content, in bytes
+- f: a failure instead of the response: "reset" (the connection is reset), "close" (closed without response)
+  or "hang" (no response for HANG seconds: the checks time out)
+
+The connections are kept alive unless the request has "Connection: close".
+"""
+
+import asyncio
+import multiprocessing
+import random
+import signal
+import socket
+import struct
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+FAILURES = ("reset", "close", "hang")
+HANG = 3600  # in seconds
+
+REASONS = {200: b"OK", 301: b"Moved Permanently", 404: b"Not Found", 500: b"Internal Server Error",
+           503: b"Service Unavailable"}
+
+
+def site_url(port, site, latency=0, status=200, size=0, failure=None, host="127.0.0.1"):
+    """The url of a stub website on the server listening on port"""
+    params = {"l": latency, "s": status, "b": size}
+    if failure:
+        params["f"] = failure
+    return "http://%s:%d/site/%d?%s" % (host, port, site, urlencode(params))
+
+
+def site_urls(ports, nb_sites, latency=0.0, error_rate=0.0, failure_rate=0.0, size=0, seed=0):
+    """The urls of {nb_sites} stub websites spread over the servers (ports)
+
+    - error_rate: the part of the websites answering a 5xx or 404 status code
+    - failure_rate: the part of the websites failing (reset, close or hang) instead of answering
+    """
+    rand = random.Random(seed)
+    urls = []
+    for site in range(nb_sites):
+        status, failure = 200, None
+        draw = rand.random()
+        if draw < failure_rate:
+            failure = rand.choice(FAILURES)
+        elif draw < failure_rate + error_rate:
+            status = rand.choice((404, 500, 503))
+        urls.append(site_url(ports[site % len(ports)], site, latency, status, size, failure))
+    return urls
+
+
+class _Server:
+
+    def __init__(self):
+        self.bodies = {}  # {size: content}
+
+    def body(self, size):
+        content = self.bodies.get(size)
+        if content is None:
+            content = self.bodies[size] = b"x" * size
+        return content
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                target = request.split(b" ", 2)[1].decode()
+                params = {name: values[0] for name, values in parse_qs(urlsplit(target).query).items()}
+                keep_alive = b"connection: close" not in request.lower()
+
+                failure = params.get("f")
+                if failure == "reset":
+                    # SO_LINGER 0: the close sends a RST
+                    writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                                               struct.pack("ii", 1, 0))
+                    writer.transport.abort()
+                    return
+                if failure == "close":
+                    return
+                if failure == "hang":
+                    await asyncio.sleep(HANG)
+                    return
+
+                latency = float(params.get("l", 0))
+                if latency:
+                    await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+
+                status = int(params.get("s", 200))
+                content = self.body(int(params.get("b", 0)))
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Length: %d\r\nContent-Type: text/plain\r\n%s\r\n"
+                             % (status, REASONS.get(status, b"Unknown"), len(content),
+                                b"" if keep_alive else b"Connection: close\r\n"))
+                writer.write(content)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def run_server(connection, host):
+    """The main function of a server process: send its port through the connection, then serve forever"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def serve():
+        server = await asyncio.start_server(_Server().handle, host, 0, backlog=4096)
+        connection.send(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+class StubFarm:
+    """Start {nb_servers} stub servers, each one in its own process (see the module)"""
+
+    def __init__(self, nb_servers=1, host="127.0.0.1"):
+        self.nb_servers = nb_servers
+        self.host = host
+        self.ports = []
+        self._processes = []
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        for _ in range(self.nb_servers):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(target=run_server, args=(writer, self.host), daemon=True)
+            process.start()
+            self.ports.append(reader.recv())
+            self._processes.append(process)
+        return self
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        self._processes = []
+        self.ports = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
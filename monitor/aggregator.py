@@ -0,0 +1,191 @@
+import threading
+
+from monitor.sketch import LatencySketch
+
+# The phases of a check whose average is given in the stats
+PHASES = ("dns", "connect", "tls", "ttfb", "body")
+# The percentiles of the response times given in the stats
+PERCENTILES = (50, 95, 99)
+# The status code of the checks that got no response (timeout...): they count for the availability only,
+# and by failure (the outcome of the check: "dns", "timeout"...)
+NO_RESPONSE = 0
+
+
+class Aggregate:
+    """Aggregated checks of a website: what is needed to compute their stats, and to merge them with others"""
+
+    __slots__ = ("count", "nb_2xx", "codes_count", "sum_rt", "max_rt", "sum_full_rt", "max_full_rt", "sum_phases",
+                 "rt_sketch", "full_rt_sketch", "failures")
+
+    def __init__(self):
+        self.count = 0
+        self.nb_2xx = 0
+        self.codes_count = {}
+        self.sum_rt = 0.0
+        self.max_rt = 0.0
+        self.sum_full_rt = 0.0
+        self.max_full_rt = 0.0
+        self.sum_phases = [0.0] * len(PHASES)
+        # The distributions of the response times, for their percentiles
+        self.rt_sketch = LatencySketch()
+        self.full_rt_sketch = LatencySketch()
+        self.failures = {}  # {outcome: number of checks} of the checks without response
+
+    def add(self, full_resp_time, resp_time, status_code, phases=None, outcome="error"):
+        """Aggregate a check (phases: the duration of each phase, in the order of PHASES,
+        outcome: why there is no response when the status code is NO_RESPONSE)
+        """
+        self.count += 1
+        self.codes_count[status_code] = self.codes_count.get(status_code, 0) + 1
+        if status_code == NO_RESPONSE:
+            self.failures[outcome] = self.failures.get(outcome, 0) + 1
+            return
+        if 200 <= status_code <= 299:
+            self.nb_2xx += 1
+        self.sum_rt += resp_time
+        self.max_rt = max(self.max_rt, resp_time)
+        self.sum_full_rt += full_resp_time
+        self.max_full_rt = max(self.max_full_rt, full_resp_time)
+        self.rt_sketch.add(resp_time)
+        self.full_rt_sketch.add(full_resp_time)
+        if phases:
+            sum_phases = self.sum_phases
+            for i, phase in enumerate(phases):
+                sum_phases[i] += phase
+
+    def merge(self, other):
+        """Add the checks of another aggregate to this one"""
+        if not other.count:
+            return
+        self.count += other.count
+        self.nb_2xx += other.nb_2xx
+        for code, nb in other.codes_count.items():
+            self.codes_count[code] = self.codes_count.get(code, 0) + nb
+        for outcome, nb in other.failures.items():
+            self.failures[outcome] = self.failures.get(outcome, 0) + nb
+        self.sum_rt += other.sum_rt
+        self.max_rt = max(self.max_rt, other.max_rt)
+        self.sum_full_rt += other.sum_full_rt
+        self.max_full_rt = max(self.max_full_rt, other.max_full_rt)
+        for i, phase in enumerate(other.sum_phases):
+            self.sum_phases[i] += phase
+        self.rt_sketch.merge(other.rt_sketch)
+        self.full_rt_sketch.merge(other.full_rt_sketch)
+
+    def get_availability(self):
+        """Availability in percentage: the part of 2xx status codes"""
+        return 100 * self.nb_2xx // self.count if self.count > 0 else 0
+
+    def get_stats(self):
+        """The same dict as WebsiteMonitor.get_stats (None for the times when there is no response)"""
+        # The times are the ones of the checks that got a response
+        count = self.count - self.codes_count.get(NO_RESPONSE, 0)
+        stats = {"max_rt": self.max_rt if count else None, "avg_rt": self.sum_rt / count if count else None,
+                 "max_full_rt": self.max_full_rt if count else None,
+                 "avg_full_rt": self.sum_full_rt / count if count else None,
+                 "availability": self.get_availability(), "codes_count": dict(self.codes_count),
+                 "failures": dict(self.failures)}
+        for phase, total in zip(PHASES, self.sum_phases):
+            stats["avg_" + phase] = total / count if count else None
+        for percentile in PERCENTILES:
+            stats["p%d_rt" % percentile] = self.rt_sketch.quantile(percentile / 100)
+            stats["p%d_full_rt" % percentile] = self.full_rt_sketch.quantile(percentile / 100)
+
+        return stats
+
+
+class Bucket(Aggregate):
+    """The aggregated checks of a website during {bucket_duration} seconds"""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index  # the start date of the bucket is index * bucket_duration
+
+
+class RollingWindow:
+    """Stats of the last checks of a website, kept in memory
+
+    The checks of the last {duration} seconds are aggregated in time buckets of {bucket_duration} seconds, in a ring
+    buffer: a bucket is reused when it becomes too old. Adding a check is O(1) and the stats over a timeframe
+    are O(number of buckets of the timeframe), whatever the number of checks.
+    The timeframe is rounded to the buckets: it can include up to {bucket_duration} seconds of older checks.
+    """
+
+    DURATION = 3600  # in seconds
+    BUCKET_DURATION = 5  # in seconds
+
+    def __init__(self, duration=DURATION, bucket_duration=BUCKET_DURATION):
+        self.duration = duration
+        self.bucket_duration = bucket_duration
+        # One more bucket: the current one is not full
+        self.nb_buckets = -(-duration // bucket_duration) + 1
+        # The buckets are created when a check falls into them
+        self.buckets = [None] * self.nb_buckets
+        self._lock = threading.Lock()
+
+    def covers(self, timeframe):
+        """Return True if the window has the checks of the whole timeframe (in min)"""
+        return timeframe * 60 <= self.duration
+
+    def add(self, date, full_resp_time, resp_time, status_code, phases=None, outcome="error"):
+        """Aggregate a check (phases: the duration of each phase, in the order of PHASES,
+        outcome: why there is no response when the status code is NO_RESPONSE)
+        """
+        index = int(date // self.bucket_duration)
+
+        with self._lock:
+            position = index % self.nb_buckets
+            bucket = self.buckets[position]
+            if bucket is None or bucket.index != index:
+                if bucket is not None and bucket.index > index:
+                    # Older than the window
+                    return
+                bucket = Bucket(index)
+                self.buckets[position] = bucket
+
+            bucket.add(full_resp_time, resp_time, status_code, phases, outcome)
+
+    def load(self, checks):
+        """Aggregate checks given as tuples (date, full_resp_time, resp_time, status_code, outcome, *phases),
+        used to fill the window with the saved checks at start
+        """
+        for date, full_resp_time, resp_time, status_code, outcome, *phases in checks:
+            # A TimestampField gives a datetime
+            if hasattr(date, "timestamp"):
+                date = date.timestamp()
+            self.add(date, full_resp_time, resp_time, status_code, phases, outcome)
+
+    def _buckets_since(self, min_date, now):
+        """Return the buckets of the checks between min_date and now, without going through the others"""
+        first = max(int(min_date // self.bucket_duration), int(now // self.bucket_duration) - self.nb_buckets + 1)
+        last = int(now // self.bucket_duration)
+        buckets = []
+        for index in range(first, last + 1):
+            bucket = self.buckets[index % self.nb_buckets]
+            # Skip the empty buckets and the old ones not reused yet
+            if bucket is not None and bucket.index == index:
+                buckets.append(bucket)
+        return buckets
+
+    def get_aggregate(self, timeframe, now):
+        """Return an Aggregate of the checks over the timeframe (in min)"""
+        aggregate = Aggregate()
+        with self._lock:
+            for bucket in self._buckets_since(now - timeframe * 60, now):
+                aggregate.merge(bucket)
+        return aggregate
+
+    def get_availability(self, timeframe, now):
+        """Availability (in percentage) over the timeframe (in min), the same as WebsiteMonitor.get_availability"""
+        with self._lock:
+            buckets = self._buckets_since(now - timeframe * 60, now)
+            nb_2xx_codes = sum(bucket.nb_2xx for bucket in buckets)
+            nb_codes = sum(bucket.count for bucket in buckets)
+
+        return 100 * nb_2xx_codes // nb_codes if nb_codes > 0 else 0
+
+    def get_stats(self, timeframe, now):
+        """Stats over the timeframe (in min), the same dict as WebsiteMonitor.get_stats"""
+        return self.get_aggregate(timeframe, now).get_stats()
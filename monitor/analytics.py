@@ -0,0 +1,249 @@
+"""Stats computed from the saved checks themselves (webmo --raw-stats), with exact percentiles
+
+The checks of all the websites over the timeframe are loaded at once as columns (see load_check_arrays):
+one query per {WEBSITES_PER_QUERY} websites in the Check table, or the columns of the segment files copied
+chunk by chunk. The stats of all the websites are then computed together over the columns (see compute_stats):
+with NumPy (pip install WebMo[numpy]) the checks are grouped by website with bincount and sort, without loop
+over the checks in Python. Without NumPy, the same stats are computed check by check.
+
+The stats are the same dict as WebsiteMonitor.get_stats, but the percentiles are the exact response times
+(the nearest rank, like LatencySketch.quantile) instead of the ones of the sketches. The RollingWindow and the
+rollups stay the fast path: the raw stats read all the checks of the timeframe.
+"""
+
+from array import array
+
+from monitor import storage
+from monitor.models import db, Check
+from monitor.aggregator import Aggregate, PHASES, PERCENTILES, NO_RESPONSE
+from monitor.rollups import WEBSITES_PER_QUERY
+from monitor.segments import OVERRUN_CODE, ERROR_CODE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# (name, array typecode) of the columns of CheckArrays. The times are float64, even from the segment files
+COLUMNS = (("website_id", "q"), ("date", "d"), ("full_resp_time", "d"), ("resp_time", "d"),
+           *[(phase + "_time", "d") for phase in PHASES], ("status_code", "H"), ("outcome", "B"))
+
+
+class CheckArrays:
+    """Checks of several websites as columns {name: NumPy array, or array.array without NumPy} (see COLUMNS),
+    without the skipped ones (OVERRUN). The outcomes are their index in Check.OUTCOMES
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["website_id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def from_lists(cls, columns, use_numpy=True):
+        """CheckArrays from {name: sequence of the values} (all the names of COLUMNS)"""
+        if use_numpy and np is not None:
+            return cls({name: np.asarray(columns[name], dtype=typecode) for name, typecode in COLUMNS})
+        return cls({name: array(typecode, columns[name]) for name, typecode in COLUMNS})
+
+
+def load_check_arrays(websites, min_date, max_date=None, use_numpy=True):
+    """CheckArrays of the checks of the websites (Website or id) between min_date (included)
+    and max_date (excluded, None: no limit), from the check store or the Check table
+    """
+    website_ids = [getattr(website, "id", website) for website in websites]
+    store = storage.check_store
+    if store:
+        columns = load_segment_columns(store, website_ids, min_date, max_date)
+    else:
+        columns = load_table_columns(website_ids, min_date, max_date)
+    return CheckArrays.from_lists(columns, use_numpy)
+
+
+def load_table_columns(website_ids, min_date, max_date=None):
+    """The columns of the checks from the Check table: one query per {WEBSITES_PER_QUERY} websites,
+    without the conversion of the values by peewee
+    """
+    names = [name for name, _ in COLUMNS]
+    columns = {name: [] for name in names}
+    for start in range(0, len(website_ids), WEBSITES_PER_QUERY):
+        ids = website_ids[start:start + WEBSITES_PER_QUERY]
+        sql = 'SELECT %s FROM "check" WHERE "website_id" IN (%s) AND "date" >= ? AND "outcome" != ?' % (
+            ", ".join('"%s"' % name for name in names), ", ".join("?" * len(ids)))
+        params = [*ids, min_date, Check.OVERRUN]
+        if max_date is not None:
+            sql += ' AND "date" < ?'
+            params.append(max_date)
+        rows = db.execute_sql(sql, params).fetchall()
+        if not rows:
+            continue
+        for name, values in zip(names, zip(*rows)):
+            if name == "outcome":
+                values = [Check.OUTCOME_CODES.get(outcome, ERROR_CODE) for outcome in values]
+            columns[name].extend(values)
+    return columns
+
+
+def load_segment_columns(store, website_ids, min_date, max_date=None):
+    """The columns of the checks from the segment files of the store (the columns of SegmentStore.scan,
+    copied out of the memory maps)
+    """
+    names = [name for name, _ in COLUMNS]
+    columns = {name: [] for name in names}
+
+    for website_id in website_ids:
+        def add(*segment_columns):
+            outcomes = segment_columns[-1]
+            selected = [i for i, outcome in enumerate(outcomes) if outcome != OVERRUN_CODE]
+            if len(selected) == len(outcomes):
+                # The usual case: no skipped check in the chunk
+                for name, column in zip(names[1:], segment_columns):
+                    columns[name].extend(column)
+            else:
+                for name, column in zip(names[1:], segment_columns):
+                    columns[name].extend(column[i] for i in selected)
+            columns["website_id"].extend([website_id] * len(selected))
+
+        store.scan(website_id, min_date, max_date, add)
+    return columns
+
+
+def nearest_rank(sorted_values, q):
+    """The value below which are the part q of sorted values (the same rank as LatencySketch.quantile)"""
+    if not sorted_values:
+        return None
+    return sorted_values[round(q * (len(sorted_values) - 1))]
+
+
+def compute_stats(checks, website_ids=()):
+    """Stats {website id: dict of stats (the same as WebsiteMonitor.get_stats)} of the CheckArrays,
+    with the exact percentiles. The websites of website_ids without checks get the stats of no check
+    """
+    if np is not None and isinstance(checks["website_id"], np.ndarray):
+        stats = compute_stats_numpy(checks)
+    else:
+        stats = compute_stats_python(checks)
+    for website_id in website_ids:
+        if website_id not in stats:
+            stats[website_id] = Aggregate().get_stats()
+    return stats
+
+
+def compute_stats_python(checks):
+    """compute_stats check by check, without NumPy: an Aggregate and the sorted response times per website"""
+    aggregates = {}
+    times = {}  # {website id: (response times, full response times)}
+    phase_columns = [checks[phase + "_time"] for phase in PHASES]
+    for i, (website_id, full_rt, rt, status_code, outcome) in enumerate(zip(
+            checks["website_id"], checks["full_resp_time"], checks["resp_time"], checks["status_code"],
+            checks["outcome"])):
+        aggregate = aggregates.get(website_id)
+        if aggregate is None:
+            aggregate = aggregates[website_id] = Aggregate()
+            times[website_id] = ([], [])
+        aggregate.add(full_rt, rt, status_code, [column[i] for column in phase_columns],
+                      Check.OUTCOMES[outcome])
+        if status_code != NO_RESPONSE:
+            times[website_id][0].append(rt)
+            times[website_id][1].append(full_rt)
+
+    stats = {}
+    for website_id, aggregate in aggregates.items():
+        stats[website_id] = website_stats = aggregate.get_stats()
+        resp_times, full_resp_times = (sorted(values) for values in times[website_id])
+        for percentile in PERCENTILES:
+            website_stats["p%d_rt" % percentile] = nearest_rank(resp_times, percentile / 100)
+            website_stats["p%d_full_rt" % percentile] = nearest_rank(full_resp_times, percentile / 100)
+    return stats
+
+
+def compute_stats_numpy(checks):
+    """compute_stats with NumPy: each stat of all the websites at once
+
+    The checks are numbered by website (the index of their website in the sorted website ids): the counts and the
+    sums are bincounts, the maxima maximum.at, and the percentiles are read in the times sorted by website then
+    by value, at the nearest rank from the start of each website
+    """
+    if not len(checks):
+        return {}
+    website_ids, groups = np.unique(checks["website_id"], return_inverse=True)
+    nb_websites = len(website_ids)
+    status_codes = checks["status_code"]
+
+    counts = np.bincount(groups, minlength=nb_websites)
+    nb_2xx = np.bincount(groups[(status_codes >= 200) & (status_codes <= 299)], minlength=nb_websites)
+    # The times are the ones of the checks that got a response
+    responses = status_codes != NO_RESPONSE
+    response_groups = groups[responses]
+    nb_responses = np.bincount(response_groups, minlength=nb_websites)
+    # The first check of each website in the sorted times
+    starts = np.concatenate(([0], np.cumsum(nb_responses)[:-1]))
+
+    def sums(values):
+        return np.bincount(response_groups, weights=values[responses], minlength=nb_websites)
+
+    def maxima(values):
+        result = np.zeros(nb_websites)
+        np.maximum.at(result, response_groups, values[responses])
+        return result
+
+    def percentiles(values):
+        values = values[responses]
+        if not len(values):
+            return {percentile: [None] * nb_websites for percentile in PERCENTILES}
+        sorted_values = values[np.lexsort((values, response_groups))]
+        result = {}
+        for percentile in PERCENTILES:
+            # rint rounds half to even, like round
+            ranks = starts + np.rint(percentile / 100 * np.maximum(nb_responses - 1, 0)).astype(np.int64)
+            result[percentile] = sorted_values[np.minimum(ranks, len(sorted_values) - 1)].tolist()
+        return result
+
+    # The histograms of the status codes and of the failures: the counts of the (website, value) pairs
+    def histograms(keys, mask, width):
+        pairs, nb = np.unique(groups[mask].astype(np.int64) * width + keys[mask], return_counts=True)
+        result = [{} for _ in range(nb_websites)]
+        for pair, pair_count in zip(pairs.tolist(), nb.tolist()):
+            result[pair // width][pair % width] = pair_count
+        return result
+
+    codes_counts = histograms(status_codes.astype(np.int64), np.ones(len(groups), dtype=bool), 1 << 16)
+    failures = histograms(checks["outcome"].astype(np.int64), ~responses, len(Check.OUTCOMES))
+
+    sum_rt, sum_full_rt = sums(checks["resp_time"]), sums(checks["full_resp_time"])
+    max_rt, max_full_rt = maxima(checks["resp_time"]), maxima(checks["full_resp_time"])
+    sum_phases = [sums(checks[phase + "_time"]) for phase in PHASES]
+    rt_percentiles, full_rt_percentiles = percentiles(checks["resp_time"]), percentiles(checks["full_resp_time"])
+
+    stats = {}
+    for i, website_id in enumerate(website_ids.tolist()):
+        count, nb = int(counts[i]), int(nb_responses[i])
+        website_stats = {"max_rt": float(max_rt[i]) if nb else None, "avg_rt": sum_rt[i] / nb if nb else None,
+                         "max_full_rt": float(max_full_rt[i]) if nb else None,
+                         "avg_full_rt": sum_full_rt[i] / nb if nb else None,
+                         "availability": 100 * int(nb_2xx[i]) // count, "codes_count": codes_counts[i],
+                         "failures": {Check.OUTCOMES[outcome]: nb_failures
+                                      for outcome, nb_failures in failures[i].items()}}
+        for phase, total in zip(PHASES, sum_phases):
+            website_stats["avg_" + phase] = total[i] / nb if nb else None
+        for percentile in PERCENTILES:
+            website_stats["p%d_rt" % percentile] = rt_percentiles[percentile][i] if nb else None
+            website_stats["p%d_full_rt" % percentile] = full_rt_percentiles[percentile][i] if nb else None
+        # Python floats, like the stats of an Aggregate
+        for name, value in website_stats.items():
+            if isinstance(value, np.floating):
+                website_stats[name] = float(value)
+        stats[website_id] = website_stats
+    return stats
+
+
+def get_raw_stats(websites, min_date, max_date=None, use_numpy=True):
+    """Stats {website id: dict of stats} of the saved checks of the websites between min_date (included)
+    and max_date (excluded, None: no limit), with the exact percentiles (see the module)
+    """
+    checks = load_check_arrays(websites, min_date, max_date, use_numpy)
+    return compute_stats(checks, [getattr(website, "id", website) for website in websites])
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from monitor.scheduler import Scheduler
+from monitor.instrumentation import instruments
+
+scheduler_lag = instruments.histogram("scheduler_lag_seconds", "Delay of the checks after their deadline")
+check_duration = instruments.histogram("check_duration_seconds", "Duration of the checks in their thread")
+
+
+class CheckEngine:
+    """Run the check jobs of every WebsiteMonitor on a single asyncio event loop
+
+    One Scheduler holds the next deadline of every website, and a single timer of the event loop is set
+    at the earliest one. A website never has two checks at the same time: when its check is due while the previous
+    one is still waiting or running, it is skipped and the monitor records an overrun. The deadlines missed because
+    the event loop itself was late are only counted in the skipped ticks: no check was running. The websites start
+    at a fixed offset in their check_interval (from their id), so the ones with the same interval do not all check
+    at the same instant. The checks themselves use the blocking requests library, so they are handed over
+    to a bounded pool of threads that is reused from one tick to another, like the recording of the overruns.
+
+    - max_concurrency: the maximum number of checks running at the same time, for all the websites
+    """
+
+    MAX_CONCURRENCY = 64
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.loop = None
+        self.is_running = False  # Flag to avoid starting several time the same engine
+
+        self._thread = None
+        self._executor = None
+        self._semaphore = None
+        # The deadlines of the monitors, the timer of the earliest one,
+        # and the checks that are currently waiting or running
+        self.scheduler = Scheduler()
+        self._timer = None
+        self._checks = set()
+        self._in_flight = set()  # the monitors whose check is waiting or running
+
+    def start(self, monitors=()):
+        """Start the event loop in its own thread (the urwid main loop stays free) and schedule the monitors"""
+        if self.is_running:
+            return
+
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="check")
+        self.loop.set_default_executor(self._executor)
+
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(started,), name="check-engine", daemon=True)
+        self._thread.start()
+        started.wait()
+        self.is_running = True
+        instruments.gauge("checks_in_flight", self.nb_in_flight, "Checks waiting for a slot or running")
+
+        for monitor in monitors:
+            self.add(monitor)
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self.loop)
+        # The semaphore has to be created inside the loop that will use it
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def add(self, monitor):
+        """Schedule the check jobs of a monitor (thread safe)"""
+        self.loop.call_soon_threadsafe(self._add, monitor)
+
+    def remove(self, monitor):
+        """Stop scheduling the check jobs of a monitor (thread safe)"""
+        self.loop.call_soon_threadsafe(self._remove, monitor)
+
+    def _add(self, monitor):
+        website = monitor.website
+        self.scheduler.add(monitor, website.check_interval, self.loop.time(),
+                           key=getattr(website, "id", None) or website.url)
+        self._set_timer()
+
+    def _remove(self, monitor):
+        self.scheduler.remove(monitor)
+        self._set_timer()
+
+    def _set_timer(self):
+        """Wake up at the earliest deadline"""
+        if self._timer:
+            self._timer.cancel()
+        deadline = self.scheduler.next_deadline()
+        self._timer = self.loop.call_at(deadline, self._dispatch) if deadline is not None else None
+
+    def _dispatch(self):
+        """Start the checks whose deadline has come"""
+        # The deadlines missed while the loop was late are already counted in the skipped ticks by the scheduler
+        for monitor, deadline, _ in self.scheduler.pop_due(self.loop.time()):
+            if monitor in self._in_flight:
+                self.scheduler.lag.skipped += 1
+                # Saved in the pool of threads like the checks: a burst of overruns does not hold the other deadlines
+                self.loop.run_in_executor(None, monitor.record_overrun)
+                continue
+
+            self._in_flight.add(monitor)
+            check = self.loop.create_task(self._check(monitor, deadline))
+            self._checks.add(check)
+            check.add_done_callback(self._checks.discard)
+        self._set_timer()
+
+    async def _check(self, monitor, deadline):
+        try:
+            # Wait for a free slot: never more than max_concurrency checks at the same time
+            async with self._semaphore:
+                lag = self.loop.time() - deadline
+                self.scheduler.lag.add(lag)
+                scheduler_lag.observe(lag)
+                await self.loop.run_in_executor(None, self._run_check, monitor)
+        finally:
+            self._in_flight.discard(monitor)
+
+    @staticmethod
+    def _run_check(monitor):
+        with check_duration.time():
+            monitor.check()
+
+    def nb_in_flight(self):
+        """The number of checks waiting for a slot or running"""
+        return len(self._in_flight)
+
+    def get_lag_stats(self):
+        """How late the checks started after their deadline (in seconds), waiting for the event loop
+        or a free slot: a dict {ticks, skipped_ticks, avg_lag, max_lag, last_lag}
+        """
+        return self.scheduler.lag.get_stats()
+
+    def stop(self):
+        """Cancel the scheduled checks, wait for the running ones and stop the event loop"""
+        if not self.is_running:
+            return
+
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        # The checks already handed over to a thread finish normally (and are saved)
+        self._executor.shutdown(wait=True)
+        self.is_running = False
+
+    async def _shutdown(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.scheduler.clear()
+        tasks = list(self._checks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+import time
+
+from peewee import IntegrityError
+
+from monitor.models import db
+from monitor import storage
+from monitor.rollups import save_checks
+from monitor.instrumentation import instruments
+
+flush_duration = instruments.histogram("writer_flush_seconds", "Duration of the insertion of a batch of checks")
+batch_sizes = instruments.histogram("writer_batch_size", "Number of checks inserted in a batch")
+
+logger = logging.getLogger(__name__)
+
+
+class CheckWriter:
+    """The single writer of the Check rows of all the monitors
+
+    The monitors put their checks in a queue instead of writing them one by one (one transaction each)
+    from their own thread. The writer thread inserts them in bulk, in one transaction, when {batch_size}
+    checks are waiting or when the oldest waiting check is {flush_interval} seconds old, and updates the rollups.
+    The monitors do not wait for their checks to be saved: their alerts and live stats come from their RollingWindow.
+    The writer thread also checkpoints the WAL every checkpoint_interval seconds of the storage profile,
+    and empties it when it stops (see monitor.storage).
+
+    A batch that cannot be saved (database locked for too long, disk full...) is tried again {FLUSH_ATTEMPTS} times,
+    then dropped: the error is logged and the writer goes on with the next checks. At most {max_queued} checks
+    wait in the queue, the next ones are dropped until the writer catches up. The dropped checks are counted
+    in {dropped} (and in the writer_dropped_checks gauge).
+    """
+
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1  # in seconds
+    MAX_QUEUED = 100000
+    FLUSH_ATTEMPTS = 3
+    RETRY_DELAY = 1  # in seconds, between the attempts to save a batch
+
+    # Put in the queue to stop the writer thread
+    _STOP = object()
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queued=MAX_QUEUED):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queued)
+        self.dropped = 0
+        self.is_running = False  # Flag to avoid starting several time the same writer
+        self._thread = None
+
+    def start(self):
+        if not self.is_running:
+            self._thread = threading.Thread(target=self._run, name="check-writer", daemon=True)
+            self._thread.start()
+            self.is_running = True
+            instruments.gauge("writer_queue_depth", self.queue.qsize, "Checks waiting to be saved")
+            instruments.gauge("writer_dropped_checks", lambda: self.dropped,
+                              "Checks dropped: queue full, or batch that could not be saved")
+
+    def put(self, monitor, row):
+        """Queue a check (a dict of Check fields) done by the monitor, without waiting:
+        the check is dropped when the queue is full
+        """
+        try:
+            self.queue.put_nowait((monitor, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Stop the writer thread once everything that is queued has been saved"""
+        if self.is_running:
+            # Waits for a place in a full queue: the writer thread is emptying it
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self.is_running = False
+
+    def _run(self):
+        try:
+            self._write()
+            self.checkpoint("TRUNCATE")
+        finally:
+            # The connection and the segment files of the writer thread
+            db.close()
+            if storage.check_store:
+                storage.check_store.close()
+
+    def _write(self):
+        batch = []
+        stopping = False
+        last_checkpoint = time.monotonic()
+
+        while not stopping:
+            # Wait for the first check of the batch, then for the others until the batch is full or too old
+            checkpoint_interval = storage.profile.checkpoint_interval
+            timeout = last_checkpoint + checkpoint_interval - time.monotonic() if checkpoint_interval else None
+            try:
+                item = self.queue.get(timeout=max(timeout, 0) if timeout is not None else None)
+            except queue.Empty:
+                item = None
+            if checkpoint_interval and time.monotonic() >= last_checkpoint + checkpoint_interval:
+                # Never waits for the readers
+                self.checkpoint("PASSIVE")
+                last_checkpoint = time.monotonic()
+            if item is None:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+
+            while item is not self._STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            else:
+                # Everything queued before the stop has been taken
+                stopping = True
+
+            if batch:
+                self.flush(batch)
+                batch = []
+
+    def checkpoint(self, mode):
+        """Checkpoint the WAL (see storage.checkpoint), an error is only logged: the next checkpoint will do"""
+        try:
+            storage.checkpoint(mode)
+        except Exception:
+            logger.warning("The %s checkpoint of the WAL failed", mode, exc_info=True)
+
+    def flush(self, batch):
+        """Insert the checks of the batch, and add them to the rollups, in one transaction
+
+        Tried {FLUSH_ATTEMPTS} times, the batch is then dropped
+        """
+        rows = [row for _, row in batch]
+        batch_sizes.observe(len(rows))
+
+        for attempt in range(1, self.FLUSH_ATTEMPTS + 1):
+            try:
+                with flush_duration.time():
+                    self._save(rows)
+                return
+            except Exception:
+                logger.warning("Saving %d checks failed (attempt %d of %d)", len(rows), attempt, self.FLUSH_ATTEMPTS,
+                               exc_info=True)
+            if attempt < self.FLUSH_ATTEMPTS:
+                time.sleep(self.RETRY_DELAY)
+
+        self.dropped += len(rows)
+        logger.error("%d checks have been dropped: they could not be saved", len(rows))
+
+    def _save(self, rows):
+        try:
+            with db.atomic():
+                save_checks(rows)
+        except IntegrityError:
+            # A website has been deleted while being checked: save the others checks one by one
+            for row in rows:
+                try:
+                    with db.atomic():
+                        save_checks([row])
+                except IntegrityError:
+                    pass
@@ -0,0 +1,46 @@
+"""The clock of the monitoring: the real one, or a virtual one for the simulations and the tests
+
+The monitors, the alerts and the stats read the date from their clock instead of calling time.time(), so that
+a simulation (see monitor.simulation) can replay hours of checks in a few seconds. The checks themselves
+(probe) and the engines always run in real time.
+"""
+
+import time
+
+
+class Clock:
+    """The real time"""
+
+    def time(self):
+        """The current date, a timestamp like time.time()"""
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """A clock that only moves when it is told to (advance or set): sleep returns at once
+
+    - start: the first date of the clock (the current date by default)
+    """
+
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def set(self, date):
+        """Move to the date, never backwards"""
+        self.now = max(self.now, date)
+
+
+# The clock of the monitors by default
+real_clock = Clock()
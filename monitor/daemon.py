@@ -0,0 +1,230 @@
+"""Headless mode: the monitoring without the TUI (webmo --headless), for the servers
+
+The monitors, the writer and the alerts are the same as with the TerminalController, but nothing imports urwid.
+The alerts are printed, and the current stats of each website are served over HTTP in the Prometheus text format
+(GET /metrics), with the instruments of the program. The metrics come from the RollingWindow of the monitors,
+their alert state and the instruments, in memory: a scrape never reads the database. With --raw-stats, the
+percentiles of the response times are the exact ones of the saved checks instead (see monitor.analytics).
+"""
+
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import strftime, localtime
+
+from monitor.models import db, Website
+from monitor.website_monitor import WebsiteMonitor
+from monitor.analytics import get_raw_stats
+from monitor.aggregator import PHASES, PERCENTILES, NO_RESPONSE
+from monitor.check_engine import CheckEngine
+from monitor.check_writer import CheckWriter
+from monitor.sharding import ShardedEngine
+from monitor.instrumentation import instruments
+from monitor.clock import real_clock
+from monitor.retention import RetentionJob
+
+date_format = "%d/%m/%Y %H:%M:%S"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def labels(**values):
+    return "{" + ",".join('%s="%s"' % (name, escape_label(value)) for name, value in values.items()) + "}"
+
+
+def format_metrics(monitors, timeframe, now, lag_stats=None, websites_stats=None):
+    """The stats of the monitors over the timeframe (in min) from their RollingWindow, and the lag stats
+    of the engine, in the Prometheus text format
+
+    websites_stats: stats {website id: stats} from get_raw_stats, whose exact percentiles replace the ones
+    of the sketches of the windows
+    """
+    families = {}  # {name: (type, help, [lines])}, in the order of the first sample
+
+    def sample(name, kind, help_text, value, suffix="", **label_values):
+        if value is None:
+            return
+        lines = families.setdefault(name, (kind, help_text, []))[2]
+        lines.append("%s%s%s %s" % (name, suffix, labels(**label_values) if label_values else "", repr(value)))
+
+    window = "over the last %d min" % timeframe
+    for monitor in monitors:
+        website = monitor.website
+        site = {"website_id": website.id, "url": website.url}
+        aggregate = monitor.window.get_aggregate(timeframe, now)
+        # The checks that got a response
+        count = aggregate.count - aggregate.codes_count.get(NO_RESPONSE, 0)
+
+        sample("webmo_alert", "gauge", "1 when the website is down (availability below the threshold)",
+               int(monitor.on_alert), **site)
+        sample("webmo_availability_ratio", "gauge", "Part of the checks with a 2xx status code " + window,
+               aggregate.nb_2xx / aggregate.count if aggregate.count else None, **site)
+        for code, nb in sorted(aggregate.codes_count.items()):
+            sample("webmo_checks", "gauge", "Checks by status code (0: no response) " + window, nb,
+                   code=code, **site)
+        for outcome, nb in sorted(aggregate.failures.items()):
+            sample("webmo_failures", "gauge", "Checks without response by failure " + window, nb,
+                   outcome=outcome, **site)
+
+        raw_stats = websites_stats.get(website.id) if websites_stats else None
+        for name, key, sketch, total, help_text in (
+                ("webmo_response_time_seconds", "rt", aggregate.rt_sketch, aggregate.sum_rt,
+                 "Time until the headers of the response are parsed " + window),
+                ("webmo_full_response_time_seconds", "full_rt", aggregate.full_rt_sketch, aggregate.sum_full_rt,
+                 "Time until the content of the response is read " + window)):
+            for percentile in PERCENTILES:
+                if raw_stats:
+                    value = raw_stats["p%d_%s" % (percentile, key)]
+                else:
+                    value = sketch.quantile(percentile / 100)
+                sample(name, "summary", help_text, value, quantile=percentile / 100, **site)
+            sample(name, "summary", help_text, total, suffix="_sum", **site)
+            sample(name, "summary", help_text, count, suffix="_count", **site)
+
+        for phase, total in zip(PHASES, aggregate.sum_phases):
+            sample("webmo_phase_avg_seconds", "gauge", "Average duration of each phase of the checks " + window,
+                   total / count if count else None, phase=phase, **site)
+
+    if lag_stats:
+        sample("webmo_check_ticks_total", "counter", "Checks started by the engine", lag_stats["ticks"])
+        sample("webmo_check_skipped_ticks_total", "counter", "Checks skipped: missed or overrun",
+               lag_stats["skipped_ticks"])
+        sample("webmo_check_lag_avg_seconds", "gauge", "Average delay of the checks after their deadline",
+               lag_stats["avg_lag"])
+        sample("webmo_check_lag_max_seconds", "gauge", "Maximum delay of the checks after their deadline",
+               lag_stats["max_lag"])
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics on /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            content = self.server.get_metrics().encode()
+        finally:
+            # Each request has its own thread, and its own connection if the stats need the database
+            db.close()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """HTTP server of the metrics returned by get_metrics(), in its own thread (see start)"""
+
+    daemon_threads = True
+
+    def __init__(self, address, get_metrics):
+        super().__init__(address, MetricsHandler)
+        self.get_metrics = get_metrics
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class HeadlessController:
+    """Run the monitoring of all the websites without TUI, until exit_program is called
+
+    - host, port: the address of the metrics endpoint (local only by default)
+    - shards: the number of worker processes running the checks, 0 to run them in this process
+    - clock: the clock of the monitors and of the metrics
+    - retention_days: the checks older than this are deleted (for the websites without their own retention)
+    - raw_stats: the percentiles of the metrics are the exact ones of the saved checks (see monitor.analytics)
+    """
+
+    TIMEFRAME = 10  # in min, the timeframe of the stats in the metrics
+    MAX_CONCURRENT_CHECKS = CheckEngine.MAX_CONCURRENCY  # for all the websites
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9470
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, shards=0, clock=real_clock,
+                 retention_days=RetentionJob.RETENTION_DAYS, raw_stats=False):
+        self.clock = clock
+        self.raw_stats = raw_stats
+        self.monitors = []
+        if shards:
+            self.engine = ShardedEngine(shards, self.MAX_CONCURRENT_CHECKS)
+        else:
+            self.engine = CheckEngine(self.MAX_CONCURRENT_CHECKS)
+        self.writer = CheckWriter()
+        self.retention = RetentionJob(retention_days, clock=clock)
+        self.retention.on_report = self.print_retention_report
+        self.metrics_server = MetricsServer((host, port), self.get_metrics)
+        self._exit = threading.Event()
+
+    def main(self):
+        """Run until exit_program is called (by the SIGINT or SIGTERM handler)"""
+        self.start_monitoring()
+        host, port = self.metrics_server.server_address[:2]
+        print("Monitoring %d websites, metrics on http://%s:%d/metrics" % (len(self.monitors), host, port),
+              flush=True)
+        try:
+            self._exit.wait()
+        finally:
+            self.stop_monitoring()
+        print("Goodbye !")
+
+    def start_monitoring(self):
+        self.monitors = [WebsiteMonitor(website, self, writer=self.writer, clock=self.clock)
+                         for website in Website.select()]
+        self.writer.start()
+        self.engine.start(self.monitors)
+        self.metrics_server.start()
+        self.retention.start()
+
+    def stop_monitoring(self):
+        # Shut down the check engine, then save the checks that are still queued
+        self.metrics_server.stop()
+        self.retention.stop()
+        self.engine.stop()
+        self.writer.stop()
+
+    def get_metrics(self):
+        now = self.clock.time()
+        websites_stats = None
+        if self.raw_stats:
+            websites_stats = get_raw_stats([monitor.website for monitor in self.monitors], now - self.TIMEFRAME * 60)
+        metrics = format_metrics(self.monitors, self.TIMEFRAME, now, self.engine.get_lag_stats(), websites_stats)
+        return metrics + instruments.to_prometheus()
+
+    def update_alert_history(self, alert):
+        """Print the new alert (called by the monitors, from the threads of the checks)"""
+        state = "is down" if alert.availability < WebsiteMonitor.THRESHOLD else "has recovered"
+        print("Website %s %s. Availability = %d%%, since %s"
+              % (alert.website.url, state, alert.availability, strftime(date_format, localtime(alert.date))),
+              flush=True)
+
+    def print_retention_report(self, report):
+        """Print what a run of the retention job has deleted (called from its thread)"""
+        if report["checks"] or report["minute_rollups"] or report["pages"]:
+            print("Retention: %d checks and %d minute rollups deleted, %s freed, in %.1f s"
+                  % (report["checks"], report["minute_rollups"],
+                     "%.1f MB" % (report["bytes"] / 2 ** 20) if report["bytes"] is not None else "no space",
+                     report["duration"]), flush=True)
+
+    def exit_program(self):
+        self._exit.set()
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+
+from monitor.phase_timing import TimedHTTPAdapter
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def get_origin(url):
+    """Return the origin of an url: scheme://host:port (the port is always given)"""
+    parsed_url = urlparse(url)
+    port = parsed_url.port or DEFAULT_PORTS.get(parsed_url.scheme, 80)
+    return parsed_url.scheme + "://" + (parsed_url.hostname or "") + ":" + str(port)
+
+
+def new_session(pool_size=1):
+    """Return a requests Session keeping alive at most {pool_size} connections per host"""
+    session = requests.Session()
+    # pool_block=False: a check never waits for a free connection (it would be counted in the response time),
+    # an extra connection is opened and then discarded instead of being kept alive
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class SessionPool:
+    """Keep-alive HTTP sessions shared by all the monitors, one session per origin
+
+    - max_origins: number of origins kept, the least recently used session is closed beyond it
+    - pool_size: number of connections kept alive for each origin
+    - host_pool_sizes: dict {hostname: pool size} to override pool_size for some hosts
+    """
+
+    MAX_ORIGINS = 1000
+    POOL_SIZE = 2
+
+    def __init__(self, max_origins=MAX_ORIGINS, pool_size=POOL_SIZE, host_pool_sizes=None):
+        self.max_origins = max_origins
+        self.pool_size = pool_size
+        self.host_pool_sizes = host_pool_sizes or {}
+
+        # origin -> Session, ordered from the least to the most recently used
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_pool_size(self, url):
+        return self.host_pool_sizes.get(urlparse(url).hostname, self.pool_size)
+
+    def get(self, url):
+        """Return the session (and so the warm connections) associated to the origin of the url"""
+        origin = get_origin(url)
+
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session:
+                self._sessions.move_to_end(origin)
+                return session
+
+            session = new_session(self.get_pool_size(url))
+            self._sessions[origin] = session
+
+            if len(self._sessions) > self.max_origins:
+                _, oldest_session = self._sessions.popitem(last=False)
+                oldest_session.close()
+
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def close(self):
+        """Close all the kept alive connections"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# The pool shared by all the monitors
+session_pool = SessionPool()
@@ -0,0 +1,193 @@
+"""Instrumentation of the hot paths of WebMo: how late the checks start, how long they, the database
+and the display take, and how full the queues are
+
+A Histogram counts durations in a LatencySketch, with their sum and their max: observing a duration is a lock,
+a logarithm and a few additions, cheap enough to stay on in production. A gauge is a function called only when
+the instruments are read (the depth of a queue...).
+
+The instruments shared by the whole program are in `instruments`. In sharded mode the workers have their own:
+they send them with their lag stats, and they are merged with the ones of the coordinator when read (see sources).
+"""
+
+import json
+import threading
+from time import perf_counter, time
+
+from monitor.sketch import LatencySketch
+
+# The percentiles of the durations given in the stats
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    """The distribution of the observed durations (in seconds) or sizes"""
+
+    __slots__ = ("sketch", "sum", "max", "_lock")
+
+    def __init__(self):
+        self.sketch = LatencySketch()
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return self.sketch.count
+
+    def observe(self, value):
+        with self._lock:
+            self.sketch.add(value)
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    def merge(self, other):
+        with self._lock:
+            self.sketch.merge(other.sketch)
+            self.sum += other.sum
+            self.max = max(self.max, other.max)
+
+    def reset(self):
+        with self._lock:
+            self.sketch = LatencySketch()
+            self.sum = 0.0
+            self.max = 0.0
+
+    def get_stats(self):
+        """dict {count, sum, avg, max, p50, p95, p99}"""
+        with self._lock:
+            count = self.sketch.count
+            stats = {"count": count, "sum": self.sum, "avg": self.sum / count if count else None,
+                     "max": self.max if count else None}
+            for percentile in PERCENTILES:
+                stats["p%d" % percentile] = self.sketch.quantile(percentile / 100)
+        return stats
+
+    def to_state(self):
+        """A picklable copy, to send the histogram to another process"""
+        with self._lock:
+            return self.sketch.to_bytes(), self.sum, self.max
+
+    @classmethod
+    def from_state(cls, state):
+        histogram = cls()
+        data, histogram.sum, histogram.max = state
+        histogram.sketch = LatencySketch.from_bytes(data)
+        return histogram
+
+
+class _Timer:
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+class Instruments:
+    """The histograms and gauges of the program, by name
+
+    - sources: functions returning other histograms {name: Histogram} (the ones of the shards)
+      to merge with these ones when they are read
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self.descriptions = {}
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description=""):
+        """Return the histogram of this name, created the first time"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+                self.descriptions.setdefault(name, description)
+        return histogram
+
+    def gauge(self, name, function, description=""):
+        """Read function() as the gauge of this name (it replaces the previous function of the name)"""
+        with self._lock:
+            self.gauges[name] = function
+            self.descriptions[name] = description
+
+    def reset(self):
+        """Forget what the histograms have observed (they stay the same objects)"""
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+
+    def get_histograms(self):
+        """The histograms {name: Histogram}, merged with the ones of the sources"""
+        histograms = dict(self.histograms)
+        for source in list(self.sources.values()):
+            for name, other in source().items():
+                merged = Histogram()
+                if name in histograms:
+                    merged.merge(histograms[name])
+                merged.merge(other)
+                histograms[name] = merged
+        return histograms
+
+    def get_states(self):
+        """The states of the histograms {name: state}, see Histogram.to_state"""
+        return {name: histogram.to_state() for name, histogram in list(self.histograms.items())}
+
+    def get_stats(self):
+        """dict {"histograms": {name: stats of the histogram}, "gauges": {name: value}}"""
+        gauges = {}
+        for name, function in sorted(self.gauges.items()):
+            try:
+                gauges[name] = function()
+            except Exception:
+                # The gauge of a stopped component
+                gauges[name] = None
+        return {"histograms": {name: histogram.get_stats()
+                               for name, histogram in sorted(self.get_histograms().items())},
+                "gauges": gauges}
+
+    def to_prometheus(self, prefix="webmo_"):
+        """The instruments in the Prometheus text format (the histograms as summaries)"""
+        stats = self.get_stats()
+        lines = []
+        for name, histogram in stats["histograms"].items():
+            metric = prefix + name
+            lines.append("# HELP %s %s" % (metric, self.descriptions.get(name) or metric))
+            lines.append("# TYPE %s summary" % metric)
+            for percentile in PERCENTILES:
+                value = histogram["p%d" % percentile]
+                if value is not None:
+                    lines.append('%s{quantile="%s"} %r' % (metric, percentile / 100, value))
+            lines.append("%s_sum %r" % (metric, histogram["sum"]))
+            lines.append("%s_count %d" % (metric, histogram["count"]))
+        for name, value in stats["gauges"].items():
+            if value is None:
+                continue
+            metric = prefix + name
+            lines.append("# HELP %s %s" % (metric, self.descriptions.get(name) or metric))
+            lines.append("# TYPE %s gauge" % metric)
+            lines.append("%s %r" % (metric, value))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def export(self, path):
+        """Write the stats of the instruments in a JSON file, and return them"""
+        stats = self.get_stats()
+        with open(path, "w") as file:
+            json.dump(dict(stats, date=time()), file, indent=2)
+        return stats
+
+
+# The instruments shared by the whole program
+instruments = Instruments()
@@ -0,0 +1,123 @@
+"""Versioned migrations of the database schema
+
+The version of the schema of a database file is kept in its user_version (PRAGMA user_version, 0 for a file
+created before the migrations). migrate_schema applies, in order and each one in its own transaction,
+the migrations the file has not had yet. A migration must also work on a database whose tables have just been
+created from the current models (the indexes and columns can already exist).
+"""
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from monitor.models import db, Website, Check, Alert, MinuteRollup, HourRollup
+from monitor.rollups import backfill_rollups
+from monitor.aggregator import NO_RESPONSE
+
+
+def add_missing_columns(models=(Website, Check, Alert)):
+    """Add to the tables the columns of the fields they do not have yet (timing, phases of the checks)"""
+    migrator = SqliteMigrator(db)
+
+    for model in models:
+        table = model._meta.table_name
+        columns = [column.name for column in db.get_columns(table)]
+        operations = [migrator.add_column(table, field.column_name, field)
+                      for field in model._meta.sorted_fields if field.column_name not in columns]
+        if operations:
+            migrate(*operations)
+
+
+def add_range_indexes():
+    """Index the checks and alerts on (website, date): the stats and the alerts select a website and a range of dates
+
+    The index on the website alone is dropped for the checks: (website, date) is also used to find the checks
+    of a website, and each index slows down the inserts
+    """
+    add_index(Check, ("website_id", "date"))
+    add_index(Alert, ("website_id", "date"))
+    # The alert history is ordered by date for all the websites
+    add_index(Alert, ("date",))
+
+    db.execute_sql('DROP INDEX IF EXISTS "check_website_id"')
+
+
+def add_rollups():
+    """Create the minute and hour rollups of the checks and fill them with the checks already saved"""
+    db.create_tables([MinuteRollup, HourRollup], safe=True)
+    backfill_rollups()
+
+
+def add_rollup_sketches():
+    """Add the sketches of the response times to the rollups, and compute them again from the checks
+    (unless the rollups have just been filled by add_rollups)
+    """
+    add_missing_columns((MinuteRollup, HourRollup))
+    if MinuteRollup.select().where(MinuteRollup.full_rt_sketch.is_null()).exists():
+        backfill_rollups()
+
+
+def add_check_outcome():
+    """Add the outcome of the checks (the existing ones got a response)"""
+    add_missing_columns((Check,))
+
+
+def add_failures_count():
+    """Add the failures by outcome to the rollups, computed again if checks without response have been saved"""
+    add_missing_columns((MinuteRollup, HourRollup))
+    if Check.select().where(Check.status_code == NO_RESPONSE, Check.outcome != Check.OVERRUN).exists():
+        backfill_rollups()
+
+
+def add_retention_days():
+    """Add the retention of the checks of the websites (NULL: the default one)"""
+    add_missing_columns((Website,))
+
+
+# The migrations, in order: the version of the schema is the number of migrations applied
+MIGRATIONS = [
+    add_missing_columns,
+    add_range_indexes,
+    add_rollups,
+    add_rollup_sketches,
+    add_check_outcome,
+    add_failures_count,
+    add_retention_days,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def add_index(model, columns):
+    """Create an index named like the ones peewee creates, if it does not already exist"""
+    table = model._meta.table_name
+    name = "_".join((table,) + columns)
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' %
+                   (name, table, ", ".join('"%s"' % column for column in columns)))
+
+
+def get_schema_version():
+    return db.pragma("user_version")
+
+
+def migrate_schema():
+    """Apply the migrations the database has not had yet
+
+    Return: the list of the names of the migrations that have been applied
+    """
+    applied = []
+    version = get_schema_version()
+    if version >= SCHEMA_VERSION:
+        return applied
+
+    # SQLite rebuilds a table to change a column: with the foreign keys on, dropping the old website table
+    # would delete all the checks and alerts (on_delete='CASCADE'). It cannot be changed inside a transaction
+    db.pragma("foreign_keys", "off")
+    try:
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            with db.atomic():
+                migration()
+                db.pragma("user_version", number)
+            applied.append(migration.__name__)
+    finally:
+        db.pragma("foreign_keys", "on")
+
+    return applied
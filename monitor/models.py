@@ -1,14 +1,24 @@
+import sqlite3
+
 from peewee import *
 
-# pragmas on: the on_delete has a real effect on the SQLite db
-db = SqliteDatabase('website_monitor.db', pragmas=(('foreign_keys', 'on'),))
+# The database and the settings of its connections are in monitor.storage
+from monitor.storage import db
 
 
 class Website(Model):
 
+    # Timing modes: "cold" opens a new connection for each check (what a first visitor sees),
+    # "warm" reuses a kept alive connection (the DNS lookup, TCP connection and TLS handshake are not measured)
+    COLD = "cold"
+    WARM = "warm"
+
     url = CharField(default="")
     check_interval = IntegerField(default=10)
     display = BooleanField(default=True)
+    timing = CharField(default=COLD)
+    # The checks older than this number of days are deleted (see monitor.retention), NULL: the default retention
+    retention_days = IntegerField(null=True)
 
     class Meta:
         database = db
@@ -16,14 +26,46 @@ class Website(Model):
 
 class Check(Model):
 
-    website = ForeignKeyField(Website, related_name="checks", on_delete='CASCADE')
+    # Outcomes of a check: OK for a response (whatever its status code), OVERRUN when the check has been skipped
+    # because the previous one of the website was still running (not counted in the stats).
+    # The others are the failures, without response (the status code is then 0): the response was not complete
+    # before the deadline of the check (TIMEOUT), the host name was not found (DNS_ERROR), the TCP connection
+    # was refused or failed (CONNECT_ERROR), the TLS handshake failed (TLS_ERROR), the server closed or reset the
+    # connection (RESET) or the request failed in another way (ERROR)
+    OK = "ok"
+    OVERRUN = "overrun"
+    TIMEOUT = "timeout"
+    DNS_ERROR = "dns"
+    CONNECT_ERROR = "connect"
+    TLS_ERROR = "tls"
+    RESET = "reset"
+    ERROR = "error"
+    # The outcomes as their index in OUTCOMES, in the results sent by the shards and in the segment files:
+    # a new outcome goes at the end, the codes already saved keep their meaning
+    OUTCOMES = (OK, OVERRUN, TIMEOUT, DNS_ERROR, CONNECT_ERROR, TLS_ERROR, RESET, ERROR)
+    OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+    # No index on the website alone: the index on (website, date) is used instead
+    website = ForeignKeyField(Website, related_name="checks", on_delete='CASCADE', index=False)
     date = TimestampField()
     full_resp_time = FloatField()  # in seconds
     resp_time = FloatField()  # in seconds
     status_code = SmallIntegerField()
+    # Breakdown of the response times (in seconds): DNS lookup, TCP connection and TLS handshake (0 when the
+    # connection is kept alive), wait for the headers (ttfb) and transfer of the content (body)
+    dns_time = FloatField(default=0)
+    connect_time = FloatField(default=0)
+    tls_time = FloatField(default=0)
+    ttfb_time = FloatField(default=0)
+    body_time = FloatField(default=0)
+    outcome = CharField(default=OK)
 
     class Meta:
         database = db
+        # The stats select the checks of a website over a range of dates
+        indexes = (
+            (('website', 'date'), False),
+        )
 
 
 class Alert(Model):
@@ -34,3 +76,70 @@ class Alert(Model):
 
     class Meta:
         database = db
+        indexes = (
+            (('website', 'date'), False),
+            (('date',), False),
+        )
+
+
+class Rollup(Model):
+    """The checks of a website aggregated over a period of {RESOLUTION} seconds starting at date,
+    updated as the checks are saved. Only its subclasses have a table
+    """
+
+    RESOLUTION = None  # in seconds
+
+    # No backref: the Website has several rollup tables
+    website = ForeignKeyField(Website, backref='+', on_delete='CASCADE', index=False)
+    date = TimestampField()  # the start of the period
+    count = IntegerField(default=0)
+    nb_2xx = IntegerField(default=0)
+    sum_rt = FloatField(default=0)  # in seconds
+    max_rt = FloatField(default=0)
+    sum_full_rt = FloatField(default=0)
+    max_full_rt = FloatField(default=0)
+    sum_dns = FloatField(default=0)
+    sum_connect = FloatField(default=0)
+    sum_tls = FloatField(default=0)
+    sum_ttfb = FloatField(default=0)
+    sum_body = FloatField(default=0)
+    codes_count = TextField(default="{}")  # JSON histogram {status code: number of checks}
+    # LatencySketch.to_bytes of the response times, for their percentiles (NULL for the rollups saved before)
+    rt_sketch = BlobField(null=True)
+    full_rt_sketch = BlobField(null=True)
+    failures_count = TextField(default="{}")  # JSON {outcome: number of checks} of the checks without response
+
+    class Meta:
+        database = db
+        indexes = (
+            (('website', 'date'), True),
+        )
+
+
+class MinuteRollup(Rollup):
+    RESOLUTION = 60
+
+
+class HourRollup(Rollup):
+    RESOLUTION = 3600
+
+
+def bulk_insert(model, rows, replace=False):
+    """Insert rows (dicts {field name: value}) in the table of the model with one prepared statement
+
+    Much faster than insert_many for big batches: peewee builds the SQL of insert_many value by value.
+    The missing fields take their default value. To call inside a transaction.
+    """
+    fields = [field for field in model._meta.sorted_fields if field is not model._meta.primary_key]
+    defaults = [field.default() if callable(field.default) else field.default for field in fields]
+    sql = 'INSERT %sINTO "%s" (%s) VALUES (%s)' % ("OR REPLACE " if replace else "", model._meta.table_name,
+                                                    ", ".join('"%s"' % field.column_name for field in fields),
+                                                    ", ".join("?" * len(fields)))
+
+    values = [tuple(field.db_value(row.get(field.name, default)) for field, default in zip(fields, defaults))
+              for row in rows]
+    try:
+        model._meta.database.connection().executemany(sql, values)
+    except sqlite3.IntegrityError as e:
+        # The same exception as the peewee queries
+        raise IntegrityError(*e.args) from e
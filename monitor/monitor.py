@@ -1,9 +1,14 @@
 from peewee import OperationalError
+import argparse
 import signal
 import sys
 
-from monitor.models import Website, Check, Alert
-from monitor.monitor_tui import TerminalController
+from monitor.models import Website, Check, Alert, MinuteRollup, HourRollup
+from monitor.storage import DEFAULT_PATH, PROFILES, DEFAULT_PROFILE, configure_storage, set_check_store, \
+    segments_directory
+from monitor.segments import SegmentStore
+from monitor.retention import RetentionJob, full_vacuum
+from monitor.migrations import migrate_schema
 
 # Keep a reference in order to properly exit the program
 terminal_controller = None
@@ -13,17 +18,71 @@ def main():
     """Main function of the monitoring program"""
     global terminal_controller
 
+    parser = argparse.ArgumentParser(prog="webmo", description="Website availability and performance monitoring")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="run the checks in this number of worker processes (for very large lists of websites)")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the terminal interface, the stats are served in the Prometheus format")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address of the metrics endpoint (headless)")
+    parser.add_argument("--metrics-port", type=int, default=9470, help="port of the metrics endpoint (headless)")
+    parser.add_argument("--db", default=DEFAULT_PATH,
+                        help="path of the SQLite database (default: $WEBMO_DB or website_monitor.db)")
+    parser.add_argument("--storage", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="settings of the database: fast (WAL, the default), durable (WAL, each commit synced) "
+                             "or compat (rollback journal, like the previous versions)")
+    parser.add_argument("--check-store", choices=("sqlite", "segments"), default="sqlite",
+                        help="where the checks are saved: in the database (the default), or in columnar segment "
+                             "files (smaller and faster to read, the websites, alerts and rollups stay in the "
+                             "database)")
+    parser.add_argument("--segments-dir", help="directory of the segment files (default: next to the database)")
+    parser.add_argument("--retention-days", type=int, default=RetentionJob.RETENTION_DAYS,
+                        help="the checks older than this are deleted, unless the website has its own retention "
+                             "(default: %(default)s, the stats over longer timeframes come from the hour rollups)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the database file, so that the space freed by the retention is given back "
+                             "to the file system (needed once for the databases created by the previous versions), "
+                             "then exit")
+    parser.add_argument("--raw-stats", action="store_true",
+                        help="compute the stats from the saved checks themselves, with the exact percentiles "
+                             "(vectorized with NumPy when it is installed) instead of the in-memory windows "
+                             "and the rollups")
+    args = parser.parse_args()
+
     # Start by initiate our sqlite database:
+    configure_storage(args.db, PROFILES[args.storage])
+    if args.check_store == "segments":
+        set_check_store(SegmentStore(args.segments_dir or segments_directory(args.db)))
     db_init()
+
+    if args.vacuum:
+        full_vacuum(PROFILES[args.storage].auto_vacuum)
+        return
+
+    if args.headless:
+        # Imported here: the headless mode does not import urwid
+        from monitor.daemon import HeadlessController
+
+        controller = HeadlessController(args.metrics_host, args.metrics_port, shards=args.shards,
+                                        retention_days=args.retention_days, raw_stats=args.raw_stats)
+        # Stop the monitoring properly on Ctrl+C and when the service is stopped
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda signal_number, frame: controller.exit_program())
+        controller.main()
+        return
+
+    from monitor.monitor_tui import TerminalController
+
     # Then initiate the urwid/TUI loop to render our terminal
-    terminal_controller = TerminalController()
+    terminal_controller = TerminalController(shards=args.shards, retention_days=args.retention_days,
+                                             raw_stats=args.raw_stats)
     terminal_controller.main()
 
 
 def db_init():
     """Init the database
 
-    Create the tables associated to our Website and Check models
+    Create the tables associated to our Website, Check, Alert and rollups models,
+    then upgrade the schema of a database created by a previous version of the program
     """
 
     # Create the tables only if they don't already exist
@@ -36,6 +95,14 @@ def db_init():
     if not Alert.table_exists():
         Alert.create_table()
 
+    if not MinuteRollup.table_exists():
+        MinuteRollup.create_table()
+
+    if not HourRollup.table_exists():
+        HourRollup.create_table()
+
+    migrate_schema()
+
 
 def exit_program(signal, frame):
     """Terminate the program by calling exit_program from the instance of TerminalController
@@ -1,12 +1,29 @@
 """Terminal User Interface classes"""
 
+import os
+import queue
 import urwid
-from time import time, strftime, localtime
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import strftime, localtime
 import math
+from peewee import fn
 
 from .websites_settings import SettingsPopUp, DisplaySettings
 from .models import Website, Alert
-from .website_monitor import WebsiteMonitor
+from .website_monitor import WebsiteMonitor, get_monitors_stats
+from .check_engine import CheckEngine
+from .check_writer import CheckWriter
+from .sharding import ShardedEngine
+from .aggregator import PERCENTILES
+from .instrumentation import instruments
+from .clock import real_clock
+from .retention import RetentionJob
+
+display_stats_duration = instruments.histogram("ui_display_stats_seconds", "Duration of MainView.display_stats")
+stats_widgets_duration = instruments.histogram("ui_stats_widgets_seconds",
+                                               "Duration of the building of the widgets of the stats, when displayed")
+draw_duration = instruments.histogram("ui_draw_seconds", "Duration of the drawing of the screen")
 
 blank = urwid.Divider()  # A blank line
 vline = urwid.AttrWrap(urwid.SolidFill(u'\u2502'), 'line')
@@ -56,6 +73,212 @@ class ExtendedListBox(urwid.ListBox):
         self.set_focus(len(self.body) - 1)
 
 
+class StatsSnapshot:
+    """The stats of the displayed websites at a given date: what the stats panel keeps instead of their widgets"""
+
+    __slots__ = ("date", "timeframe", "websites_stats")
+
+    def __init__(self, date, timeframe, websites_stats):
+        self.date = date
+        self.timeframe = timeframe  # in min
+        self.websites_stats = websites_stats  # list of (url, dict of stats)
+
+
+class StatsWalker(urwid.ListWalker):
+    """The rows of the stats panel: the StatsSnapshots from the newest to the oldest, then an end widget
+
+    Each snapshot is displayed in two rows, its date and its table (they are separated to keep the focus on the
+    date of the stats the user is going through). Only the last {retention} snapshots are kept, and their widgets
+    are built by make_widgets(snapshot) -> (label, table) when the ListBox asks for them: only the visible rows
+    and the ones next to them. The widgets of the last {CACHE_SIZE} snapshots asked for are kept.
+    """
+
+    CACHE_SIZE = 32
+
+    def __init__(self, make_widgets, retention, end_widget):
+        self.make_widgets = make_widgets
+        self.snapshots = deque(maxlen=retention)
+        self.end_widget = end_widget
+        self.focus = 0
+        self._widgets = OrderedDict()  # {snapshot: (label, table)}, the least recently used first
+
+    def __len__(self):
+        return 2 * len(self.snapshots) + 1
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if position == len(self) - 1:
+            return self.end_widget
+
+        snapshot = self.snapshots[position // 2]
+        widgets = self._widgets.get(snapshot)
+        if widgets is None:
+            widgets = self._widgets[snapshot] = self.make_widgets(snapshot)
+            if len(self._widgets) > self.CACHE_SIZE:
+                self._widgets.popitem(last=False)
+        else:
+            self._widgets.move_to_end(snapshot)
+        return widgets[position % 2]
+
+    def next_position(self, position):
+        return position + 1
+
+    def prev_position(self, position):
+        return position - 1
+
+    def positions(self, reverse=False):
+        return range(len(self) - 1, -1, -1) if reverse else range(len(self))
+
+    def set_focus(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        self.focus = position
+        self._modified()
+
+    def add(self, snapshot):
+        """Insert the newest stats at the top, the oldest ones are dropped beyond the retention"""
+        self.snapshots.appendleft(snapshot)
+        # Stay on the same stats if the user is going through the previous ones
+        if self.focus > 0:
+            self.focus = min(self.focus + 2, len(self) - 1)
+        self._modified()
+
+
+class AlertWalker(urwid.ListWalker):
+    """The rows of the alert history: the alerts from the newest to the oldest, then an end widget
+
+    The alerts already saved when the walker is created are read from the Alert table when the ListBox asks for
+    them, by pages of {PAGE_SIZE} alerts: a page is found from the one before or after it by keyset pagination on
+    (date, id), which uses the index on the date, so a big history is not loaded at start. Only the last
+    {CACHE_PAGES} pages used are kept. The alerts raised afterwards are added at the top by add, without query.
+    The widgets are built by make_widget(alert), the ones of the last {CACHE_SIZE} alerts used are kept.
+    Deleting a website also deletes its alerts: reload counts the alerts again.
+    """
+
+    PAGE_SIZE = 50
+    CACHE_PAGES = 20
+    CACHE_SIZE = 64
+
+    def __init__(self, make_widget, end_widget):
+        self.make_widget = make_widget
+        self.end_widget = end_widget
+        self.focus = 0
+        self.reload()
+
+    def reload(self):
+        """Read the saved alerts again (the alerts added until now are then saved ones), from the newest"""
+        self.new_alerts = []  # the alerts added, the oldest first
+        self._pages = OrderedDict()  # {page number: [Alert]}, the least recently used first
+        self._widgets = OrderedDict()  # {alert id: widget}, the least recently used first
+
+        # The saved alerts are the ones up to this id: the alerts added later are not counted twice
+        self.last_saved_id = Alert.select(fn.MAX(Alert.id)).scalar() or 0
+        self.nb_saved = self._saved_alerts().count() if self.last_saved_id else 0
+        self.focus = min(self.focus, len(self) - 1)
+        self._modified()
+
+    def _saved_alerts(self):
+        return Alert.select(Alert, Website).join(Website).where(Alert.id <= self.last_saved_id)
+
+    @staticmethod
+    def _before(query, alert):
+        """The alerts of the query older than the alert, the newest first"""
+        # date <= so that the index on the date is used
+        return (query.where(Alert.date <= alert.date, ~((Alert.date == alert.date) & (Alert.id >= alert.id)))
+                .order_by(Alert.date.desc(), Alert.id.desc()))
+
+    @staticmethod
+    def _after(query, alert):
+        """The alerts of the query newer than the alert, the oldest first"""
+        return (query.where(Alert.date >= alert.date, ~((Alert.date == alert.date) & (Alert.id <= alert.id)))
+                .order_by(Alert.date, Alert.id))
+
+    def _page(self, number):
+        """The saved alerts of the page {number}, the newest first (the page 0 has the newest alerts)"""
+        page = self._pages.get(number)
+        if page is not None:
+            self._pages.move_to_end(number)
+            return page
+
+        size = min(self.PAGE_SIZE, self.nb_saved - number * self.PAGE_SIZE)
+        if size <= 0:
+            return []
+        previous, following = self._pages.get(number - 1), self._pages.get(number + 1)
+        if previous:
+            page = list(self._before(self._saved_alerts(), previous[-1]).limit(size))
+        elif following:
+            page = list(self._after(self._saved_alerts(), following[0]).limit(size))[::-1]
+        elif number * self.PAGE_SIZE < self.nb_saved / 2:
+            # A jump: counted from the closest end (bottom and top are the usual ones)
+            page = list(self._saved_alerts().order_by(Alert.date.desc(), Alert.id.desc())
+                        .offset(number * self.PAGE_SIZE).limit(size))
+        else:
+            page = list(self._saved_alerts().order_by(Alert.date, Alert.id)
+                        .offset(self.nb_saved - number * self.PAGE_SIZE - size).limit(size))[::-1]
+
+        self._pages[number] = page
+        if len(self._pages) > self.CACHE_PAGES:
+            self._pages.popitem(last=False)
+        return page
+
+    def __len__(self):
+        return len(self.new_alerts) + self.nb_saved + 1
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if position == len(self) - 1:
+            return self.end_widget
+
+        if position < len(self.new_alerts):
+            alert = self.new_alerts[-1 - position]
+        else:
+            number, index = divmod(position - len(self.new_alerts), self.PAGE_SIZE)
+            page = self._page(number)
+            if index >= len(page):
+                # Alerts deleted (with their website) since they have been counted: the list ends with this page
+                self.nb_saved = number * self.PAGE_SIZE + len(page)
+                self.focus = min(self.focus, len(self) - 1)
+                return self.end_widget
+            alert = page[index]
+
+        widget = self._widgets.get(alert.id)
+        if widget is None:
+            widget = self._widgets[alert.id] = self.make_widget(alert)
+            if len(self._widgets) > self.CACHE_SIZE:
+                self._widgets.popitem(last=False)
+        else:
+            self._widgets.move_to_end(alert.id)
+        return widget
+
+    def next_position(self, position):
+        return position + 1
+
+    def prev_position(self, position):
+        return position - 1
+
+    def positions(self, reverse=False):
+        return range(len(self) - 1, -1, -1) if reverse else range(len(self))
+
+    def set_focus(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        self.focus = position
+        self._modified()
+
+    def add(self, alert):
+        """Insert a new alert at the top"""
+        if alert.id <= self.last_saved_id:
+            # Already read from the table
+            return
+        self.new_alerts.append(alert)
+        # Stay on the same alert if the user is going through the previous ones
+        if self.focus > 0:
+            self.focus += 1
+        self._modified()
+
+
 class MainView(urwid.WidgetWrap):
     """The frame view that will wrap all the widget of the program"""
 
@@ -92,22 +315,24 @@ class MainView(urwid.WidgetWrap):
 
     DIGITS = 1  # number of digits to display for the stats
     ARRAY_WIDTH = 8  # number of unit columns representing the width of 1 column of the array status codes count
+    STATS_RETENTION = 500  # number of stats kept in the stats panel (more than one hour)
 
-    def __init__(self, controller, monitors):
+    def __init__(self, controller, monitors, stats_retention=STATS_RETENTION):
         # The TerminalController instance and its monitors
         self.controller = controller
         self.monitors = monitors  # at init, monitors is None
+        self.stats_retention = stats_retention
 
         # The widget containing the real-time stats
         self.stats_w = None
         # The widget containing the alerts history
         self.history_w = None
+        # The widget containing the instrumentation of the program
+        self.instruments_w = None
         # The widget containing the button for the settings menu
         self.menu_w = None
         # The SettingsPopUp instance
         self.pop_up_settings = None
-        # The date of the last alert in order to now from which alert to update the history
-        self.date_last_alert = 0
         # The settings widget displayed to enable and disable websites
         self.display_settings = DisplaySettings(self.monitors)
 
@@ -118,62 +343,67 @@ class MainView(urwid.WidgetWrap):
         (a frame around the widget) that will be displayed
 
         """
-        self.history_w = ExtendedListBox(urwid.SimpleListWalker([
-            SelectableText("Beginning of the alerts")
-        ]))
-        self.update_alert_history()
+        self.history_w = ExtendedListBox(AlertWalker(self.display_alert, SelectableText("Beginning of the alerts")))
 
         return urwid.Frame(self.history_w, footer=self.shortcuts_footer())
 
+    def instruments_window(self):
+        """Set up the widget of the instruments (how the program itself performs) and return the "window"
+        that will be displayed
+        """
+        self.instruments_w = ExtendedListBox(urwid.SimpleFocusListWalker([SelectableText("Instruments")]))
+
+        return urwid.Frame(self.instruments_w, footer=urwid.AttrMap(urwid.Text("e = export"), 'footer'))
+
+    def display_instruments(self, stats, message=None):
+        """Display the stats of the instruments (from Instruments.get_stats), and a message under their title"""
+        content = [SelectableText("Instruments" + (" (" + message + ")" if message else ""))]
+
+        for name, histogram in stats["histograms"].items():
+            # The durations in ms, the other values as they are
+            if name.endswith("_seconds"):
+                name, convert, unit = name[:-len("_seconds")], self.to_microseconds, " ms"
+            else:
+                convert, unit = lambda value: round(value or 0, self.DIGITS), ""
+            content += [blank, urwid.Text(name + " (" + str(histogram["count"]) + ")")]
+            if not histogram["count"]:
+                continue
+            content += [urwid.Text("  p50/p95/p99: " + " / ".join(str(convert(histogram["p%d" % percentile]))
+                                                                  for percentile in PERCENTILES) + unit),
+                        urwid.Text("  avg/max: " + str(convert(histogram["avg"])) + " / " +
+                                   str(convert(histogram["max"])) + unit)]
+
+        if stats["gauges"]:
+            content.append(blank)
+        for name, value in stats["gauges"].items():
+            content.append(urwid.Text(name + ": " + str(value)))
+
+        self.instruments_w.body[:] = content
+
     def display_alert(self, alert):
         """Return a urwid.Pile displaying the alert (down or recovered)"""
+        # The date of a saved alert is a datetime, the one of a new alert a timestamp
+        date = alert.date.timestamp() if hasattr(alert.date, "timestamp") else alert.date
+        since = strftime(date_format, localtime(date))
+
         content = []
         if alert.availability < 80:
             content.append(urwid.AttrMap(
                 SelectableText("Website " + alert.website.url + " is down. Availability = " +
-                               str(alert.availability) + "%, since " +
-                               self.date_last_alert.strftime(date_format)
+                               str(alert.availability) + "%, since " + since
                                ), "alert_down", "alert_down_f"))
         elif alert.availability >= 80:
             content.append(urwid.AttrMap(
                 SelectableText("Website " + alert.website.url + " has recovered. Availability = " +
-                               str(alert.availability) + "%, since " +
-                               self.date_last_alert.strftime(date_format)
+                               str(alert.availability) + "%, since " + since
                                ), "alert_recovered", "alert_recovered_f"))
 
         content.append(blank)
         return urwid.Pile(content)
 
-    def get_alert_history(self):
-        """Different from update because the query order is desc and the alert is appended"""
-
-        # Keep the where, if decide to change self.date_last_alert later to take only some alerts
-        query = Alert.select(Alert, Website).join(Website).where(Alert.date > self.date_last_alert).order_by(
-            Alert.date.desc())
-
-        content = []
-
-        if query.exists():
-            for alert in query:
-                # The last alert in order to now from which alert to update the history
-                self.date_last_alert = alert.date
-                content.append(self.display_alert(alert))
-
-        self.history_w.body.extend(content)
-
-    def update_alert_history(self):
-        """The new alerts are insert at the beginning. Normally it is called just for one more alert"""
-
-        # Join to not do a extra query when we want the url of the website associated to the current alert
-        query = Alert.select(Alert, Website).join(Website).where(Alert.date > self.date_last_alert).order_by(
-            Alert.date)
-        body = self.history_w.body
-
-        if query.exists():
-            for alert in query:
-                # The last alert in order to now from which alert to update the history
-                self.date_last_alert = alert.date
-                body.insert(0, self.display_alert(alert))
+    def update_alert_history(self, alert):
+        """The new alert is inserted at the beginning"""
+        self.history_w.body.add(alert)
 
     @staticmethod
     def shortcuts_footer():
@@ -187,9 +417,8 @@ class MainView(urwid.WidgetWrap):
 
         """
         # Keep a reference to the ExtendedListBox to update content
-        self.stats_w = ExtendedListBox(body=urwid.SimpleFocusListWalker([
-            SelectableText("Beginning ot the stats")
-        ]))
+        self.stats_w = ExtendedListBox(body=StatsWalker(self.stats_widgets, self.stats_retention,
+                                                        SelectableText("Beginning ot the stats")))
 
         return urwid.Frame(self.stats_w, footer=self.shortcuts_footer())
 
@@ -277,66 +506,103 @@ class MainView(urwid.WidgetWrap):
             return 0
         return round((1000 * in_seconds), MainView.DIGITS)
 
-    def display_stats(self, timeframe):
+    @staticmethod
+    def percentiles(data, name):
+        """The percentiles of the stats {name} (rt or full_rt) in ms, separated by slashes"""
+        return " / ".join(str(MainView.to_microseconds(data["p%d_%s" % (percentile, name)]))
+                          for percentile in PERCENTILES)
+
+    def display_stats(self, timeframe, websites_stats=None, date=None):
         """Display the stats calculated from the previous checks for each website
 
-        Used by the alarm in the controller
+        Used by the controller, which calculates the stats in another thread
+        - websites_stats: the stats {website id: stats} from get_monitors_stats, calculated here if not given
+        - date: when the stats have been calculated (now by default)
         """
 
-        body = self.stats_w.body  # .contents
-        label = urwid.AttrMap(SelectableText("At time: " + strftime(date_format)), "stats_date",
-                              focus_map="stats_date_f")
+        with display_stats_duration.time():
+            self._display_stats(timeframe, websites_stats, date)
 
-        stats = [
-            urwid.Columns([urwid.Text("For the past " + str(timeframe) + " min: ")])]
-
-        for monitor in self.monitors:
-            if monitor.website.display:
-                data = monitor.get_stats(timeframe)
-                website_stats = urwid.LineBox(
-                    urwid.Columns([
-                        ('weight', 2, urwid.AttrMap(SelectableText(monitor.website.url), "url", "url_f")),
-                        ('weight', 2, urwid.Pile([
-                            urwid.Text("Response time max: " + str(self.to_microseconds(data["max_rt"])) + " ms"),
-                            urwid.Text("Response time avg: " + str(self.to_microseconds(data["avg_rt"])) + " ms"),
-                            urwid.Text("Content loaded in max: " + str(self.to_microseconds(data["max_full_rt"])) + " ms"),
-                            urwid.Text("Content loaded in avg: " + str(self.to_microseconds(data["avg_full_rt"])) + " ms"),
-                            urwid.Text("Availability: " + str(data["availability"]) + "%"),
-                        ])),
-                        ('fixed', self.ARRAY_WIDTH*3, self.array_status_codes(data["codes_count"])),
-                    ], dividechars=2)
-                )
-
-                stats.append(website_stats)
-
-        table = urwid.Pile(stats)
+    def _display_stats(self, timeframe, websites_stats, date):
+        if date is None:
+            date = self.controller.clock.time()
+        if websites_stats is None:
+            websites_stats = get_monitors_stats([monitor for monitor in self.monitors if monitor.website.display],
+                                                timeframe, date, raw=self.controller.raw_stats)
+
+        # A website can have been enabled or added while the stats were calculated
+        snapshot = StatsSnapshot(date, timeframe,
+                                 [(monitor.website.url, websites_stats[monitor.website.id]) for monitor in self.monitors
+                                  if monitor.website.display and monitor.website.id in websites_stats])
 
         # Check if the user is currently going through the different stats
         # If it is the case, it does not switch the focus to the new widget
-        set_focus = True
-        if len(body) > 0 and self.stats_w.focus_position > 0:
-            set_focus = False
-
-        # body.insert(0, urwid.Pile([label, table]))
-        # If we don't separate label and table the focus will be on the same element:
-        # in the stats window, if the user goes through the websites of the last stats, and does not go to
-        # previous stats, when the next stats arrives the focus will shift to the new stats (while we want to don't
-        # change the focus if the user is going through previous info/stats)
-        body.insert(0, table)
-        body.insert(0, label)
+        set_focus = self.stats_w.focus_position == 0
+
+        self.stats_w.body.add(snapshot)
 
         if set_focus:
             self.stats_w.set_focus(0, "below")
 
+    def stats_widgets(self, snapshot):
+        """Return the widgets of the stats of a StatsSnapshot: its date label and its table
+
+        If the label and the table were in the same widget the focus would be on both:
+        in the stats window, if the user goes through the websites of the last stats, and does not go to
+        previous stats, when the next stats arrives the focus would shift to the new stats (while we want to don't
+        change the focus if the user is going through previous info/stats)
+        Called by the StatsWalker when urwid draws the stats: this is the render of display_stats
+        """
+        with stats_widgets_duration.time():
+            return self._stats_widgets(snapshot)
+
+    def _stats_widgets(self, snapshot):
+        label = urwid.AttrMap(SelectableText("At time: " + strftime(date_format, localtime(snapshot.date))),
+                              "stats_date", focus_map="stats_date_f")
+
+        stats = [
+            urwid.Columns([urwid.Text("For the past " + str(snapshot.timeframe) + " min: ")])]
+
+        for url, data in snapshot.websites_stats:
+            website_stats = urwid.LineBox(
+                urwid.Columns([
+                    ('weight', 2, urwid.AttrMap(SelectableText(url), "url", "url_f")),
+                    ('weight', 2, urwid.Pile([
+                        urwid.Text("Response time max: " + str(self.to_microseconds(data["max_rt"])) + " ms"),
+                        urwid.Text("Response time avg: " + str(self.to_microseconds(data["avg_rt"])) + " ms"),
+                        urwid.Text("Response time p50/p95/p99: " + self.percentiles(data, "rt") + " ms"),
+                        urwid.Text("Content loaded in max: " + str(self.to_microseconds(data["max_full_rt"])) + " ms"),
+                        urwid.Text("Content loaded in avg: " + str(self.to_microseconds(data["avg_full_rt"])) + " ms"),
+                        urwid.Text("Content loaded in p50/p95/p99: " + self.percentiles(data, "full_rt") + " ms"),
+                        urwid.Text("DNS/connect/TLS avg: " + str(self.to_microseconds(data["avg_dns"])) + " / " +
+                                   str(self.to_microseconds(data["avg_connect"])) + " / " +
+                                   str(self.to_microseconds(data["avg_tls"])) + " ms"),
+                        urwid.Text("TTFB/body avg: " + str(self.to_microseconds(data["avg_ttfb"])) + " / " +
+                                   str(self.to_microseconds(data["avg_body"])) + " ms"),
+                        urwid.Text("Availability: " + str(data["availability"]) + "%"),
+                        urwid.Text("No response: " + (", ".join("%s %d" % failure for failure in
+                                                                sorted(data["failures"].items())) or "0")),
+                    ])),
+                    ('fixed', self.ARRAY_WIDTH*3, self.array_status_codes(data["codes_count"])),
+                ], dividechars=2)
+            )
+
+            stats.append(website_stats)
+
+        return label, urwid.Pile(stats)
+
     def update_monitors(self, monitors):
         """Set the monitors (WebsiteMonitor instances) and transfer them to the DisplaySettings instance"""
         self.monitors = monitors
         self.display_settings.update_monitors(monitors)
+        # The alerts of the websites deleted in the settings have been deleted with them
+        self.history_w.body.reload()
 
     def main_window(self):
         """Set up and return the widget/frame that will be displayed as the main window"""
 
         history_window = self.history_window()
+        instruments_window = self.instruments_window()
         stats_window = self.stats_window()
         menu_window = self.menu_window()
 
@@ -345,8 +611,10 @@ class MainView(urwid.WidgetWrap):
         # - ('weight', weight, widget): give this column a relative weight (number) to calculate
         # its width from the screen columns remaining
         # - ('fixed', nb_columns, widget): give this column a width of nb_columns of unit column
+        top_right_window = urwid.Columns([('weight', 3, history_window), ('fixed', 1, vline),
+                                          ('weight', 2, instruments_window)], dividechars=1)
         right_window = urwid.Pile(
-            [('weight', 4, history_window), ('fixed', 1, hline), ('weight', 3, menu_window)])
+            [('weight', 4, top_right_window), ('fixed', 1, hline), ('weight', 3, menu_window)])
         w = urwid.Columns([('weight', 4, stats_window),
                            ('fixed', 2, vline), ('weight', 3, right_window)],
                           dividechars=1, focus_column=2)
@@ -367,6 +635,14 @@ class MainView(urwid.WidgetWrap):
         return frame
 
 
+class InstrumentedMainLoop(urwid.MainLoop):
+    """MainLoop timing the drawing of the screen"""
+
+    def draw_screen(self):
+        with draw_duration.time():
+            super().draw_screen()
+
+
 class TerminalController:
     """A class responsible for setting up the views and running the application."""
 
@@ -374,19 +650,47 @@ class TerminalController:
     DISPLAY_LONG_INTERVAL = DISPLAY_INTERVAL * 6  # in seconds
     TIMEFRAME = 10  # in min
     LONG_TIMEFRAME = TIMEFRAME * 6  # in min
-
-    def __init__(self):
+    MAX_CONCURRENT_CHECKS = CheckEngine.MAX_CONCURRENCY  # for all the websites
+    INSTRUMENTS_PATH = "webmo_instruments.json"  # where the instruments are exported
+
+    def __init__(self, shards=0, clock=real_clock, retention_days=RetentionJob.RETENTION_DAYS, raw_stats=False):
+        """shards: the number of worker processes running the checks, 0 to run them in this process
+        clock: the clock of the monitors and of the stats
+        retention_days: the checks older than this are deleted (for the websites without their own retention)
+        raw_stats: compute the displayed stats from the saved checks, with the exact percentiles
+        (see monitor.analytics)
+        """
+        self.clock = clock
+        self.raw_stats = raw_stats
         self.loop = None
         self.monitors = None
         self.nb_websites = 0
         self.display_alarm = None
+        # Run the checks of all the monitors on one event loop, or on one event loop in each shard
+        self.sharded = bool(shards)
+        if shards:
+            self.engine = ShardedEngine(shards, self.MAX_CONCURRENT_CHECKS)
+        else:
+            self.engine = CheckEngine(self.MAX_CONCURRENT_CHECKS)
+        # Save the checks of all the monitors in batches
+        self.writer = CheckWriter()
+        # Delete the old checks in the background
+        self.retention = RetentionJob(retention_days, clock=clock)
+        # Calculate the stats outside of the urwid main loop, so that the TUI stays responsive
+        self.stats_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats")
+        # Functions sent by the other threads to be run in the urwid main loop, and the pipe waking it up
+        self.ui_calls = queue.Queue()
+        self.ui_pipe = None
 
         self.view = MainView(self, self.monitors)
 
     def main(self):
         # pop_ups=True: wrap widget with a PopUpTarget instance to allow any widget
         # to open a pop-up anywhere on the screen
-        self.loop = urwid.MainLoop(self.view, self.view.palette, pop_ups=True, unhandled_input=self.handle_input)
+        self.loop = InstrumentedMainLoop(self.view, self.view.palette, pop_ups=True,
+                                         unhandled_input=self.handle_input)
+        self.ui_pipe = self.loop.watch_pipe(self.run_ui_calls)
+        instruments.gauge("ui_calls_depth", self.ui_calls.qsize, "Functions waiting for the urwid main loop")
 
         urwid.connect_signal(self.view, 'exit_settings', lambda element: self.start_monitoring())
 
@@ -397,10 +701,12 @@ class TerminalController:
 
     def setup_monitors(self):
 
-        # Check and stop if the monitor is already running
-        if self.monitors:
-            for monitor in self.monitors:
-                monitor.stop()
+        # Check and stop if the monitors are already running,
+        # and save their last checks: the new monitors start with the saved checks.
+        # The shards keep running (with their warm connections), they get the new monitors in start_monitoring
+        if not self.sharded:
+            self.engine.stop()
+        self.writer.stop()
 
         # Get the websites from the db
         self.monitors = []
@@ -408,7 +714,7 @@ class TerminalController:
         if websites_query.exists():
             self.nb_websites = websites_query.count()
             for website in websites_query:
-                self.monitors.append(WebsiteMonitor(website, self))
+                self.monitors.append(WebsiteMonitor(website, self, writer=self.writer, clock=self.clock))
 
         # Transfer the monitors to the MainView instance
         self.view.update_monitors(self.monitors)
@@ -419,14 +725,36 @@ class TerminalController:
         self.setup_monitors()
 
         # Start the repeated checks
-        for monitor in self.monitors:
-            monitor.run()
+        self.writer.start()
+        self.retention.start()
+        if self.engine.is_running:
+            self.engine.update(self.monitors)
+        else:
+            self.engine.start(self.monitors)
 
         self.schedule_display()
 
-    def update_alert_history(self):
-        """Trigger the update_alert_history from the MainView instance"""
-        self.view.update_alert_history()
+    def call_in_ui(self, function, *args):
+        """Run function(*args) in the urwid main loop, the only thread that can change the widgets (thread safe)"""
+        self.ui_calls.put((function, args))
+        # Wake up the main loop, which calls run_ui_calls
+        os.write(self.ui_pipe, b"c")
+
+    def run_ui_calls(self, data):
+        """Called in the urwid main loop when the pipe has been written"""
+        while True:
+            try:
+                function, args = self.ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            function(*args)
+
+        # Keep the pipe open
+        return True
+
+    def update_alert_history(self, alert):
+        """Trigger the update_alert_history from the MainView instance, with a new alert"""
+        self.call_in_ui(self.view.update_alert_history, alert)
 
     def schedule_display(self):
         """Display new stats every every DISPLAY_INTERVAL seconds
@@ -449,23 +777,50 @@ class TerminalController:
             timeframe = self.LONG_TIMEFRAME
             chronometer = 0
 
-        self.view.display_stats(timeframe)
+        self.refresh_stats(timeframe)
         self.display_alarm = self.loop.set_alarm_in(self.DISPLAY_INTERVAL, self.loop_display,
                                                     user_data={"chronometer": chronometer + self.DISPLAY_INTERVAL})
 
+    def refresh_stats(self, timeframe):
+        """Calculate the stats of the displayed websites in another thread, then display them in the main loop"""
+        monitors = [monitor for monitor in self.monitors if monitor.website.display]
+        date = self.clock.time()
+
+        def get_stats():
+            return get_monitors_stats(monitors, timeframe, date, self.raw_stats), instruments.get_stats()
+
+        def display(future):
+            websites_stats, instruments_stats = future.result()
+            self.call_in_ui(self.view.display_stats, timeframe, websites_stats, date)
+            self.call_in_ui(self.view.display_instruments, instruments_stats)
+
+        self.stats_executor.submit(get_stats).add_done_callback(display)
+
+    def export_instruments(self):
+        """Save the stats of the instruments in INSTRUMENTS_PATH, and display them"""
+        try:
+            stats = instruments.export(self.INSTRUMENTS_PATH)
+        except OSError as e:
+            self.view.display_instruments(instruments.get_stats(), "export failed: " + str(e))
+            return
+        self.view.display_instruments(stats, "exported to " + self.INSTRUMENTS_PATH)
+
     def handle_input(self, key):
         if key in ('q', 'Q'):
             self.exit_program()
         elif key in ('s', 'S'):
             self.view.pop_up_settings.open_pop_up()
+        elif key in ('e', 'E'):
+            self.export_instruments()
 
     def exit_program(self):
-        # Shut down the threads/schedulers before exiting
-        if self.monitors:
-            for monitor in self.monitors:
-                monitor.stop()
+        # Shut down the check engine before exiting, then save the checks that are still queued
+        self.engine.stop()
+        self.writer.stop()
+        self.retention.stop()
 
         self.loop.remove_alarm(self.display_alarm)
+        self.stats_executor.shutdown(wait=False)
 
         # And then quit the urwid main loop
         raise urwid.ExitMainLoop()
@@ -0,0 +1,219 @@
+"""Timing of the phases of a check: DNS lookup, TCP connection and TLS handshake, and its deadline
+
+The requests library only gives the time until the headers are parsed (elapsed). The connection classes below
+time the DNS lookup, the TCP connection and the TLS handshake when urllib3 opens a new connection, and keep
+the durations in a thread local object: a check runs entirely in one thread. It only costs a few perf_counter
+calls per new connection, and nothing at all for a kept alive one.
+
+The same object holds the deadline of the check (see start_timing): the timeouts of requests only bound each
+socket operation, a server sending its headers byte by byte would hold the check for as long as it wants.
+With a deadline, the DNS lookup is abandoned when it is reached (see resolve), each connection attempt waits at most
+the time left, and the time left is the socket timeout of each read of the response (headers and content).
+"""
+
+import concurrent.futures
+import http.client
+import io
+import socket
+import threading
+from time import perf_counter, monotonic
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.ssl_ import is_ipaddress
+
+_local = threading.local()
+
+# The threads of the DNS lookups with a timeout, and their free ones (see resolve)
+DNS_LOOKUP_WORKERS = 16
+_lookup_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DNS_LOOKUP_WORKERS,
+                                                         thread_name_prefix="dns-lookup")
+_lookup_slots = threading.BoundedSemaphore(DNS_LOOKUP_WORKERS)
+
+
+class PhaseTimings:
+    """The durations (in seconds) of the connection phases of the current check,
+    and its deadline (a time.monotonic() date, None: no deadline)
+    """
+
+    __slots__ = ("dns", "connect", "tls", "deadline")
+
+    def __init__(self, deadline=None):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.deadline = deadline
+
+    def connection_time(self):
+        return self.dns + self.connect + self.tls
+
+    def time_left(self):
+        """The seconds left before the deadline (0 when it has passed), None without deadline"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - monotonic(), 0)
+
+
+def start_timing(deadline=None):
+    """Reset and return the phase timings of the current thread, to call just before sending a request
+
+    deadline: when the whole response has to be read (a time.monotonic() date)
+    """
+    _local.timings = PhaseTimings(deadline)
+    return _local.timings
+
+
+def current_timings():
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        timings = start_timing()
+    return timings
+
+
+def _lookup(host, port):
+    try:
+        return socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+    finally:
+        _lookup_slots.release()
+
+
+def resolve(host, port, timeout=None):
+    """The addresses of the host, in the order of getaddrinfo, for the address families urllib3 allows
+    (IPv4 only when the host has no IPv6)
+
+    timeout: the lookup is abandoned after this (in seconds), with socket.timeout. getaddrinfo cannot be
+    interrupted: it is run by one of the {DNS_LOOKUP_WORKERS} threads of the lookups, where an abandoned lookup
+    ends on its own. When they are all busy (a resolver that does not answer), the lookup fails at once
+    with socket.gaierror instead of waiting for one of them
+    """
+    if host.startswith("["):
+        host = host.strip("[]")
+    if timeout is None or is_ipaddress(host):
+        infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+    else:
+        if not _lookup_slots.acquire(blocking=False):
+            raise socket.gaierror(socket.EAI_AGAIN, "All the DNS lookup threads are busy")
+        try:
+            infos = _lookup_executor.submit(_lookup, host, port).result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise socket.timeout("The DNS lookup of %s timed out" % host) from None
+    return [info[4][0] for info in infos]
+
+
+class DeadlineReader(io.RawIOBase):
+    """The socket reader of a response (a socket.SocketIO) whose reads all end before the deadline:
+    the socket timeout is the time left before each read
+    """
+
+    def __init__(self, raw, sock, deadline):
+        super().__init__()
+        self.raw = raw
+        self.sock = sock
+        self.deadline = deadline
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        left = self.deadline - monotonic()
+        if left <= 0:
+            raise socket.timeout("The deadline of the check has been reached")
+        self.sock.settimeout(left)
+        return self.raw.readinto(buffer)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class DeadlineHTTPResponse(http.client.HTTPResponse):
+    """http.client response reading its headers and content before the deadline of the current check"""
+
+    def __init__(self, sock, *args, **kwargs):
+        super().__init__(sock, *args, **kwargs)
+        deadline = current_timings().deadline
+        if deadline is not None:
+            self.fp = io.BufferedReader(DeadlineReader(self.fp.detach(), sock, deadline))
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTPConnection timing the DNS lookup and the TCP connection when a new connection is opened,
+    within the deadline of the check
+    """
+
+    response_class = DeadlineHTTPResponse
+
+    def _new_conn(self):
+        timings = current_timings()
+        dns_host, timeout = self._dns_host, self.timeout
+
+        start = perf_counter()
+        try:
+            addresses = resolve(dns_host, self.port, timings.time_left())
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        except socket.timeout as e:
+            raise ConnectTimeoutError(self, "The DNS lookup of %s timed out" % self.host) from e
+        resolved = perf_counter()
+        # The lookup is already done: urllib3 connects directly to each address in turn, until one accepts
+        # the connection (like urllib3.util.connection.create_connection does with all the resolved addresses)
+        sock = error = None
+        try:
+            for address in addresses:
+                left = timings.time_left()
+                if left is not None:
+                    if left <= 0:
+                        error = ConnectTimeoutError(self, "Connection to %s timed out: the deadline of the check "
+                                                          "has been reached" % self.host)
+                        break
+                    self.timeout = min(timeout, left) if isinstance(timeout, (int, float)) else left
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except ConnectTimeoutError as e:
+                    # Also the NewConnectionError: refused, unreachable...
+                    error = e
+            if sock is None:
+                raise error or NewConnectionError(self, "getaddrinfo returned no address for %s" % self.host)
+        finally:
+            self._dns_host, self.timeout = dns_host, timeout
+
+        # += because a redirection can open several connections during the same check
+        timings.dns += resolved - start
+        timings.connect += perf_counter() - resolved
+        return sock
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    """HTTPSConnection also timing the TLS handshake: the connect time minus the DNS lookup and TCP connection"""
+
+    def connect(self):
+        timings = current_timings()
+        before = timings.dns + timings.connect
+
+        start = perf_counter()
+        super().connect()
+        timings.tls += perf_counter() - start - (timings.dns + timings.connect - before)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections time their phases"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
@@ -0,0 +1,172 @@
+"""Retention of the saved checks: the database does not grow forever
+
+The checks older than the retention of their website (retention_days, or the default one) are deleted,
+and so are the minute rollups older than MINUTE_ROLLUPS_DAYS. The hour rollups are kept: the stats over
+long timeframes come from them anyway (see monitor.rollups), only the first minutes of such a timeframe,
+when they are older than the retention, are missing.
+
+The rows are deleted by batches of {batch_size}, each one in its own short transaction: the CheckWriter
+waits for at most one batch. The pages freed by the deletions are then given back to the file system by
+an incremental vacuum (the database must be in auto_vacuum incremental mode: the new ones are, the older ones
+once converted by `webmo --vacuum`).
+
+With the segment files (see monitor.segments), the segments whose checks are all older than the retention are
+deleted whole, and so are the segments of the websites that have been deleted.
+
+The RetentionJob runs in its own thread every {interval} seconds, each run returns (and keeps in last_report)
+how long it took and how many rows and pages it reclaimed. Stopping it waits for the batch being deleted only.
+"""
+
+import threading
+from time import perf_counter
+
+from monitor import storage
+from monitor.models import db, Website, Check, MinuteRollup
+from monitor.instrumentation import instruments
+from monitor.clock import real_clock
+
+DAY = 24 * 3600
+
+retention_duration = instruments.histogram("retention_run_seconds", "Duration of the runs of the retention job")
+deleted_rows = instruments.histogram("retention_deleted_rows", "Number of rows deleted by a run of the retention")
+
+
+def delete_in_batches(model, where, batch_size, stop=None):
+    """Delete the rows of the model matching the where clause, {batch_size} rows per transaction
+
+    stop: a threading.Event, checked between the batches: the deletion ends early when it is set
+    Return: the number of rows deleted
+    """
+    total = 0
+    while not (stop and stop.is_set()):
+        with db.atomic():
+            ids = model.select(model.id).where(where).limit(batch_size)
+            deleted = model.delete().where(model.id.in_(ids)).execute()
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
+
+
+def incremental_vacuum(max_pages=None):
+    """Give the free pages of the database back to the file system (at most max_pages, all by default)
+
+    Return: the number of pages freed, None if the database is not in auto_vacuum incremental mode
+    """
+    # 2: INCREMENTAL
+    if db.pragma("auto_vacuum") != 2:
+        return None
+    free_pages = db.pragma("freelist_count")
+    # Each freed page is a row of the result: they are only freed as they are fetched
+    db.execute_sql("PRAGMA incremental_vacuum(%d)" % (max_pages or 0)).fetchall()
+    return free_pages - db.pragma("freelist_count")
+
+
+def full_vacuum(auto_vacuum="incremental"):
+    """Rebuild the database file in the auto_vacuum mode (converting a database created before the retention):
+    it takes as long as copying the database, and blocks the other connections meanwhile
+    """
+    db.pragma("auto_vacuum", auto_vacuum)
+    db.execute_sql("VACUUM")
+
+
+class RetentionJob:
+    """Delete the old checks and minute rollups every {interval} seconds, in its own thread (see the module)
+
+    - retention_days: the retention of the checks of the websites without their own retention_days
+    - minute_rollups_days: the retention of the minute rollups, for all the websites
+    - batch_size: the number of rows deleted per transaction
+    - vacuum_pages: the number of pages freed by the incremental vacuum of a run (None: all of them)
+    - clock: the date of the runs
+    """
+
+    RETENTION_DAYS = 30
+    MINUTE_ROLLUPS_DAYS = 90
+    BATCH_SIZE = 2000
+    INTERVAL = 3600  # in seconds
+    # The first run waits for the monitors to start
+    FIRST_RUN_DELAY = 60
+
+    def __init__(self, retention_days=RETENTION_DAYS, minute_rollups_days=MINUTE_ROLLUPS_DAYS,
+                 batch_size=BATCH_SIZE, interval=INTERVAL, vacuum_pages=None, clock=real_clock):
+        self.retention_days = retention_days
+        self.minute_rollups_days = minute_rollups_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.clock = clock
+        self.last_report = None
+        # Called with the report of each run of the thread
+        self.on_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, first_run_delay=FIRST_RUN_DELAY):
+        if not self._thread:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(first_run_delay,), name="retention",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the thread, after the batch being deleted if it is running"""
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, delay):
+        try:
+            while not self._stop.wait(delay):
+                report = self.run()
+                if self.on_report:
+                    self.on_report(report)
+                delay = self.interval
+        finally:
+            # The connection of the retention thread
+            db.close()
+
+    def run(self):
+        """Delete the old rows, then vacuum the database
+
+        Return: dict {date, duration (in seconds), checks and minute_rollups (the numbers of rows deleted),
+        pages and bytes (freed by the vacuum, None without incremental vacuum)}
+        """
+        start = perf_counter()
+        now = self.clock.time()
+
+        store = storage.check_store
+        nb_checks, nb_minute_rollups = 0, 0
+        # Website by website: the rows to delete are found with the (website, date) indexes
+        websites = Website.select(Website.id, Website.retention_days).tuples()
+        for website_id, retention_days in websites:
+            if self._stop.is_set():
+                break
+            min_date = now - (retention_days or self.retention_days) * DAY
+            if store:
+                nb_checks += store.prune(website_id, min_date)
+            else:
+                nb_checks += delete_in_batches(Check, (Check.website == website_id) & (Check.date < min_date),
+                                               self.batch_size, self._stop)
+            min_date = now - self.minute_rollups_days * DAY
+            nb_minute_rollups += delete_in_batches(
+                MinuteRollup, (MinuteRollup.website == website_id) & (MinuteRollup.date < min_date), self.batch_size,
+                self._stop)
+
+        if store and not self._stop.is_set():
+            # The checks of the deleted websites
+            website_ids = {website_id for website_id, in Website.select(Website.id).tuples()}
+            for website_id in store.website_ids():
+                if website_id not in website_ids:
+                    nb_checks += store.drop(website_id)
+
+        # When stopping, the vacuum is left to the next run
+        pages = incremental_vacuum(self.vacuum_pages) if not self._stop.is_set() else None
+
+        duration = perf_counter() - start
+        retention_duration.observe(duration)
+        deleted_rows.observe(nb_checks + nb_minute_rollups)
+        self.last_report = {"date": now, "duration": duration, "checks": nb_checks,
+                            "minute_rollups": nb_minute_rollups, "pages": pages,
+                            "bytes": pages * db.pragma("page_size") if pages is not None else None}
+        return self.last_report
@@ -0,0 +1,66 @@
+from array import array
+
+
+class RingBuffer:
+    """The last {capacity} samples of a series, in a fixed size typed array
+
+    The samples are stored unboxed (array typecode: "d" for floats, "H" for status codes...) and the oldest one is
+    overwritten once the buffer is full: the memory used is the same whatever the number of samples appended.
+    """
+
+    def __init__(self, typecode, capacity):
+        if capacity <= 0:
+            raise ValueError("The capacity of a ring buffer must be positive")
+        self.capacity = capacity
+        self._data = array(typecode, bytes(capacity * array(typecode).itemsize))
+        self._next = 0  # position of the next sample
+        self._size = 0
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        """The samples from the oldest to the newest"""
+        for view in self.views():
+            yield from view
+
+    def __getitem__(self, index):
+        """The sample at index from the oldest one (negative index: from the newest one)"""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("ring buffer index out of range")
+        return self._data[(self._next - self._size + index) % self.capacity]
+
+    def views(self, n=None):
+        """Return the last n samples (all of them by default) without copying them, from the oldest to the newest:
+        a tuple of memoryviews on the buffer, two when the samples wrap around its end
+
+        The views are on the buffer itself: they change with the next samples appended
+        """
+        n = self._size if n is None else min(max(n, 0), self._size)
+        data = memoryview(self._data)
+        start = (self._next - n) % self.capacity
+        if n == 0:
+            return ()
+        if start < self._next:
+            return (data[start:self._next],)
+        # Wrap around the end of the buffer
+        return tuple(view for view in (data[start:], data[:self._next]) if len(view))
+
+    def to_list(self, n=None):
+        """A copy of the last n samples (all of them by default), from the oldest to the newest"""
+        samples = []
+        for view in self.views(n):
+            samples.extend(view.tolist())
+        return samples
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
@@ -0,0 +1,265 @@
+"""Pre-aggregated checks per minute and per hour (the rollup tables)
+
+The rollups are updated by whoever saves the checks, in the same transaction. The stats over a long timeframe
+then read at most a few rollups per hour instead of all the checks: a day or a month costs about the same as
+ten minutes. They are still exact: the full hours come from the hour rollups, the full minutes around them from
+the minute rollups and only the first seconds of the timeframe from the checks themselves. The percentiles of
+the response times come from the sketches saved in the rollups (see monitor.sketch), within 1%.
+"""
+
+import json
+import math
+
+from peewee import SQL, chunked, fn
+
+from monitor import storage
+from monitor.models import Check, MinuteRollup, HourRollup, bulk_insert
+from monitor.aggregator import Aggregate, PHASES, NO_RESPONSE
+from monitor.sketch import LatencySketch
+
+ROLLUPS = (MinuteRollup, HourRollup)
+# Websites per query: each one is a variable in the query (3 times), SQLite limits their number
+WEBSITES_PER_QUERY = 300
+# The columns of a group of checks having the same status code and outcome
+# (in a SELECT ... GROUP BY status_code, outcome). The response times themselves are concatenated, for their sketches
+GROUP_COLUMNS = [Check.status_code, fn.COUNT(Check.id), SQL("NULL"),
+                 fn.SUM(Check.resp_time), fn.MAX(Check.resp_time),
+                 fn.SUM(Check.full_resp_time), fn.MAX(Check.full_resp_time), SQL("NULL"),
+                 fn.GROUP_CONCAT(Check.resp_time).coerce(False), fn.GROUP_CONCAT(Check.full_resp_time).coerce(False),
+                 Check.outcome, *[fn.SUM(getattr(Check, phase + "_time")) for phase in PHASES]]
+
+
+def to_aggregate(rollup):
+    """Return the Aggregate of a rollup"""
+    aggregate = Aggregate()
+    aggregate.count = rollup.count
+    aggregate.nb_2xx = rollup.nb_2xx
+    aggregate.codes_count = {int(code): nb for code, nb in json.loads(rollup.codes_count).items()}
+    aggregate.sum_rt = rollup.sum_rt
+    aggregate.max_rt = rollup.max_rt
+    aggregate.sum_full_rt = rollup.sum_full_rt
+    aggregate.max_full_rt = rollup.max_full_rt
+    aggregate.sum_phases = [getattr(rollup, "sum_" + phase) for phase in PHASES]
+    aggregate.rt_sketch = LatencySketch.from_bytes(rollup.rt_sketch)
+    aggregate.full_rt_sketch = LatencySketch.from_bytes(rollup.full_rt_sketch)
+    aggregate.failures = json.loads(rollup.failures_count)
+    return aggregate
+
+
+def to_rollup_row(website_id, date, aggregate):
+    """Return the fields of the rollup of an Aggregate"""
+    row = {"website": website_id, "date": date, "count": aggregate.count, "nb_2xx": aggregate.nb_2xx,
+           "sum_rt": aggregate.sum_rt, "max_rt": aggregate.max_rt,
+           "sum_full_rt": aggregate.sum_full_rt, "max_full_rt": aggregate.max_full_rt,
+           "codes_count": json.dumps(aggregate.codes_count),
+           "rt_sketch": aggregate.rt_sketch.to_bytes(), "full_rt_sketch": aggregate.full_rt_sketch.to_bytes(),
+           "failures_count": json.dumps(aggregate.failures)}
+    for phase, total in zip(PHASES, aggregate.sum_phases):
+        row["sum_" + phase] = total
+    return row
+
+
+def save_rollups(model, aggregates):
+    """Insert or replace the rollups {(website id, date): Aggregate}"""
+    bulk_insert(model, [to_rollup_row(website_id, date, aggregate)
+                        for (website_id, date), aggregate in aggregates.items()], replace=True)
+
+
+def update_rollups(rows):
+    """Add checks to the rollups, to call in the transaction saving them
+
+    rows: the dicts of Check fields that are saved
+    """
+    # The skipped checks are not in the stats
+    rows = [row for row in rows if row.get("outcome") != Check.OVERRUN]
+    if not rows:
+        return
+
+    for model in ROLLUPS:
+        resolution = model.RESOLUTION
+
+        # The new checks of each rollup
+        aggregates = {}
+        for row in rows:
+            website = row["website"]
+            key = (getattr(website, "id", website), int(row["date"] // resolution * resolution))
+            if key not in aggregates:
+                aggregates[key] = Aggregate()
+            aggregates[key].add(row["full_resp_time"], row["resp_time"], row["status_code"],
+                                [row.get(phase + "_time", 0) for phase in PHASES], row.get("outcome", Check.ERROR))
+
+        # Added to the checks already in the rollups
+        website_ids = {website_id for website_id, _ in aggregates}
+        dates = [date for _, date in aggregates]
+        query = model.select(model, model.date.cast("INTEGER").alias("start")).where(
+            model.website.in_(website_ids), model.date.between(min(dates), max(dates)))
+        for rollup in query:
+            key = (rollup.website_id, rollup.start)
+            if key in aggregates:
+                aggregate = to_aggregate(rollup)
+                aggregate.merge(aggregates[key])
+                aggregates[key] = aggregate
+
+        save_rollups(model, aggregates)
+
+
+def save_checks(rows):
+    """Save checks (dicts of Check fields) in the Check table or in the check store, and add them to the rollups,
+    to call in a transaction
+    """
+    store = storage.check_store
+    if store:
+        # The rollups first: the checks of a deleted website fail there (IntegrityError), before being appended
+        update_rollups(rows)
+        store.append(rows)
+    else:
+        bulk_insert(Check, rows)
+        update_rollups(rows)
+
+
+def load_checks(website, min_date):
+    """The checks of a website since min_date (without the skipped ones) as tuples
+    (date, full_resp_time, resp_time, status_code, outcome, *phases), for RollingWindow.load
+    """
+    store = storage.check_store
+    if store:
+        return [row for row in store.rows(website.id, min_date) if row[4] != Check.OVERRUN]
+    return (Check.select(Check.date, Check.full_resp_time, Check.resp_time, Check.status_code, Check.outcome,
+                         *[getattr(Check, phase + "_time") for phase in PHASES])
+            .where(Check.website == website, Check.date >= min_date, Check.outcome != Check.OVERRUN).tuples())
+
+
+def backfill_rollups():
+    """Fill the rollups with all the checks already saved, by (website, period, status code) groups"""
+    for model in ROLLUPS:
+        resolution = model.RESOLUTION
+        # Integer division (% is a GLOB for peewee)
+        start = Check.date.cast("INTEGER") / resolution * resolution
+        query = (Check
+                 .select(Check.website, start, *GROUP_COLUMNS)
+                 .where(Check.outcome != Check.OVERRUN)
+                 .group_by(Check.website, start, Check.status_code, Check.outcome)
+                 .order_by(Check.website, start)
+                 .tuples())
+
+        # The groups of a rollup follow each other: save them by chunks to keep the memory low
+        aggregates = {}
+        for website_id, date, *group in query:
+            key = (website_id, date)
+            if key not in aggregates:
+                if len(aggregates) >= 10000:
+                    save_rollups(model, aggregates)
+                    aggregates = {}
+                aggregates[key] = Aggregate()
+            aggregates[key].merge(to_group_aggregate(group))
+
+        save_rollups(model, aggregates)
+
+
+def to_group_aggregate(group):
+    """Return the Aggregate of a row of GROUP_COLUMNS or of rollup_columns: without histogram (codes_count is NULL),
+    the row is the group of the checks having the same status code and outcome
+    """
+    code, count, nb_2xx, sum_rt, max_rt, sum_full_rt, max_full_rt, codes_count, rt_sketch, full_rt_sketch, \
+        failures, *sum_phases = group
+
+    aggregate = Aggregate()
+    aggregate.count = count
+    if codes_count is None:
+        aggregate.codes_count = {code: count}
+        aggregate.nb_2xx = count if 200 <= code <= 299 else 0
+        if code == NO_RESPONSE:
+            # The checks without response have no response time, failures is their outcome
+            aggregate.failures = {failures: count}
+            return aggregate
+        # The response times separated by commas
+        aggregate.rt_sketch = LatencySketch.from_values(map(float, rt_sketch.split(",")))
+        aggregate.full_rt_sketch = LatencySketch.from_values(map(float, full_rt_sketch.split(",")))
+    else:
+        aggregate.codes_count = {int(code): nb for code, nb in json.loads(codes_count).items()}
+        aggregate.nb_2xx = nb_2xx
+        aggregate.rt_sketch = LatencySketch.from_bytes(rt_sketch)
+        aggregate.full_rt_sketch = LatencySketch.from_bytes(full_rt_sketch)
+        aggregate.failures = json.loads(failures)
+    aggregate.sum_rt, aggregate.max_rt = sum_rt, max_rt
+    aggregate.sum_full_rt, aggregate.max_full_rt = sum_full_rt, max_full_rt
+    aggregate.sum_phases = sum_phases
+    return aggregate
+
+
+def rollup_columns(model):
+    """The columns of a rollup in the same order as GROUP_COLUMNS"""
+    return [SQL("NULL"), model.count, model.nb_2xx, model.sum_rt, model.max_rt, model.sum_full_rt, model.max_full_rt,
+            model.codes_count, model.rt_sketch, model.full_rt_sketch, model.failures_count,
+            *[getattr(model, "sum_" + phase) for phase in PHASES]]
+
+
+def checks_query(websites, min_date, max_date=None):
+    """The checks of the websites between min_date (included) and max_date (excluded),
+    grouped by website, status code and outcome (without the skipped ones)
+    """
+    query = Check.select(Check.website, *GROUP_COLUMNS).where(Check.website.in_(websites), Check.date >= min_date,
+                                                              Check.outcome != Check.OVERRUN)
+    if max_date is not None:
+        query = query.where(Check.date < max_date)
+    return query.group_by(Check.website, Check.status_code, Check.outcome)
+
+
+def rollups_query(model, websites, min_date, max_date=None):
+    """The rollups of the websites starting between min_date (included) and max_date (excluded)"""
+    query = model.select(model.website, *rollup_columns(model)).where(model.website.in_(websites),
+                                                                        model.date >= min_date)
+    if max_date is not None:
+        query = query.where(model.date < max_date)
+    return query
+
+
+def to_aggregates(query, websites):
+    """Return {website id: Aggregate} of the rows (website, *GROUP_COLUMNS or rollup_columns) of the query"""
+    aggregates = {getattr(website, "id", website): Aggregate() for website in websites}
+    for website_id, *group in query.tuples():
+        aggregates[website_id].merge(to_group_aggregate(group))
+    return aggregates
+
+
+def get_checks_aggregate(website, min_date, max_date=None):
+    """Aggregate of the checks of a website between min_date (included) and max_date (excluded), in one query"""
+    if storage.check_store:
+        return storage.check_store.get_aggregate(getattr(website, "id", website), min_date, max_date)
+    return to_aggregates(checks_query([website], min_date, max_date), [website]).popitem()[1]
+
+
+def get_history_aggregates(websites, min_date):
+    """Exact Aggregates {website id: Aggregate} of all the saved checks of the websites since min_date,
+    in one query (per {WEBSITES_PER_QUERY} websites)
+
+    - the checks of the first (incomplete) minute
+    - the minute rollups until the first full hour
+    - the hour rollups (the last one is the current hour, still incomplete but up to date)
+    """
+    first_minute = math.ceil(min_date / MinuteRollup.RESOLUTION) * MinuteRollup.RESOLUTION
+    first_hour = math.ceil(min_date / HourRollup.RESOLUTION) * HourRollup.RESOLUTION
+
+    store = storage.check_store
+    aggregates = {}
+    for websites_chunk in chunked(websites, WEBSITES_PER_QUERY):
+        if store:
+            # The checks of the first minute are in the segment files
+            chunk_aggregates = to_aggregates(rollups_query(MinuteRollup, websites_chunk, first_minute, first_hour) +
+                                             rollups_query(HourRollup, websites_chunk, first_hour), websites_chunk)
+            for website_id, aggregate in chunk_aggregates.items():
+                aggregate.merge(store.get_aggregate(website_id, min_date, first_minute))
+            aggregates.update(chunk_aggregates)
+            continue
+
+        # UNION ALL: one round trip to the database
+        aggregates.update(to_aggregates(checks_query(websites_chunk, min_date, first_minute) +
+                                        rollups_query(MinuteRollup, websites_chunk, first_minute, first_hour) +
+                                        rollups_query(HourRollup, websites_chunk, first_hour),
+                                        websites_chunk))
+    return aggregates
+
+
+def get_history_aggregate(website, min_date):
+    """Exact Aggregate of all the saved checks of a website since min_date, in one query"""
+    return get_history_aggregates([website], min_date).popitem()[1]
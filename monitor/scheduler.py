@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import zlib
+
+
+def phase_offset(key, interval):
+    """The offset of a job in its interval, in [0, interval): the same for the same key at each start,
+    and spread over the interval for different keys (so that the jobs of the same interval do not fire together)
+    """
+    return zlib.crc32(str(key).encode()) / 2 ** 32 * interval
+
+
+class LagStats:
+    """How late the jobs started after their deadlines (in seconds)"""
+
+    __slots__ = ("ticks", "skipped", "total", "max", "last")
+
+    def __init__(self):
+        self.ticks = 0
+        self.skipped = 0  # deadlines skipped: missed entirely (a job is never run twice to catch up) or overrun
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, lag):
+        self.ticks += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+        self.last = lag
+
+    def merge(self, other):
+        """Add the ticks of another LagStats (of another scheduler) to this one"""
+        self.ticks += other.ticks
+        self.skipped += other.skipped
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.ticks:
+            self.last = other.last
+
+    def get_stats(self):
+        return {"ticks": self.ticks, "skipped_ticks": self.skipped,
+                "avg_lag": self.total / self.ticks if self.ticks else None,
+                "max_lag": self.max if self.ticks else None, "last_lag": self.last if self.ticks else None}
+
+
+class Scheduler:
+    """The next deadline of each periodic job, in a heap: finding the due jobs is O(log n) per job
+
+    The deadlines are absolute: the next one is the previous deadline plus the interval, whatever the time taken
+    to start or run the job, so the schedule does not drift. The first deadline of a job is at
+    phase_offset(key, interval) in its first interval. The scheduler only keeps the deadlines:
+    the caller gives the current time and runs the jobs returned by pop_due.
+    """
+
+    def __init__(self):
+        self._heap = []  # [deadline, sequence number, job, interval], the removed jobs are None
+        self._entries = {}  # {job: its entry in the heap}
+        self._counter = itertools.count()  # to order the jobs of the same deadline
+        self.lag = LagStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job):
+        return job in self._entries
+
+    def add(self, job, interval, now, key=None):
+        """Schedule the job every interval seconds from now, at the offset of the key in the interval"""
+        if job in self._entries:
+            return
+        deadline = now + phase_offset(job if key is None else key, interval)
+        self._push(job, deadline, interval)
+
+    def _push(self, job, deadline, interval):
+        entry = [deadline, next(self._counter), job, interval]
+        self._entries[job] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, job):
+        entry = self._entries.pop(job, None)
+        if entry:
+            # Removed from the heap when it gets to the top
+            entry[2] = None
+
+    def clear(self):
+        self._heap = []
+        self._entries = {}
+
+    def next_deadline(self):
+        """The earliest deadline, None without job"""
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now):
+        """Return the jobs whose deadline has come, as (job, deadline, number of deadlines missed),
+        and schedule their next deadline
+
+        The deadlines that are already past when the job is rescheduled are skipped (and counted in lag.skipped)
+        """
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, job, interval = heapq.heappop(heap)
+            if job is None:
+                continue
+
+            next_deadline = deadline + interval
+            missed = 0
+            if next_deadline <= now:
+                missed = int((now - next_deadline) // interval) + 1
+                self.lag.skipped += missed
+                next_deadline += missed * interval
+            self._push(job, next_deadline, interval)
+            due.append((job, deadline, missed))
+        return due
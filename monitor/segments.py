@@ -0,0 +1,315 @@
+"""Columnar segment files: a store of the checks outside of SQLite (webmo --check-store segments)
+
+The checks of each website are appended to one segment file per period of {segment_duration} seconds
+(a day by default): {directory}/{website id}/{start of the period}.seg. A segment has a header (the number of
+checks, and whether their dates are in order), then chunks of {chunk_rows} checks. In a chunk, each field is
+a column of fixed-width values, one after the other (see COLUMNS): a check takes ROW_SIZE bytes, against more
+than 100 for a row of the Check table and its index.
+
+The segments are read through a memory map: the columns of a chunk are memoryviews of the map (no copy),
+the checks of a range of dates are found by a binary search of the dates column, and aggregated by going over
+the slices of the columns together. The segments of a website older than the retention are deleted whole.
+
+The writer (the CheckWriter thread) is the only one appending to the segments, the readers only see the checks
+counted in the header, which is written after them. Website, Alert and the rollups stay in the SQLite database.
+"""
+
+import bisect
+import mmap
+import os
+import shutil
+import struct
+import threading
+from array import array
+
+from monitor.models import Check
+from monitor.aggregator import Aggregate, PHASES
+
+# (name of the Check field, array typecode), the widest first so that each column is aligned on its width.
+# The times are float32 (about 7 significant digits), the dates float64
+COLUMNS = (("date", "d"), ("full_resp_time", "f"), ("resp_time", "f"),
+           *[(phase + "_time", "f") for phase in PHASES], ("status_code", "H"), ("outcome", "B"))
+ROW_SIZE = sum(array(typecode).itemsize for _, typecode in COLUMNS)
+
+# The outcomes are saved as their index in Check.OUTCOMES
+OVERRUN_CODE = Check.OUTCOME_CODES[Check.OVERRUN]
+ERROR_CODE = Check.OUTCOME_CODES[Check.ERROR]
+
+# Magic, version, flags, number of checks
+HEADER = struct.Struct("<4sHHI4x")
+MAGIC = b"WMSG"
+VERSION = 1
+# Flag of a segment whose dates are not in order: the ranges of dates are then found by going over all of them
+UNSORTED = 1
+
+DAY = 24 * 3600
+EXTENSION = ".seg"
+
+
+class Segment:
+    """A segment file, opened to append checks (see SegmentStore)"""
+
+    def __init__(self, path, chunk_rows):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.chunk_size = chunk_rows * ROW_SIZE
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b", buffering=0)
+        if exists:
+            _, _, self.flags, self.count = HEADER.unpack(self.file.read(HEADER.size))
+            self.last_date = read_date(self.file, self.count - 1, chunk_rows) if self.count else None
+        else:
+            self.flags, self.count, self.last_date = 0, 0, None
+            self.file.write(HEADER.pack(MAGIC, VERSION, self.flags, self.count))
+
+    def append(self, columns):
+        """Append checks given as {field name: list of the values of the checks}"""
+        dates = columns["date"]
+        nb_rows = len(dates)
+        if self.last_date is not None and dates[0] < self.last_date or dates != sorted(dates):
+            self.flags |= UNSORTED
+        self.last_date = dates[-1] if self.last_date is None else max(self.last_date, dates[-1])
+
+        written = 0
+        while written < nb_rows:
+            chunk, offset = divmod(self.count, self.chunk_rows)
+            nb_chunk_rows = min(nb_rows - written, self.chunk_rows - offset)
+            base = HEADER.size + chunk * self.chunk_size
+            if offset == 0:
+                # The whole chunk at once: the file grows by chunks
+                self.file.truncate(base + self.chunk_size)
+            column_offset = 0
+            for name, typecode in COLUMNS:
+                values = array(typecode, columns[name][written:written + nb_chunk_rows])
+                self.file.seek(base + column_offset + offset * values.itemsize)
+                self.file.write(values.tobytes())
+                column_offset += values.itemsize * self.chunk_rows
+            self.count += nb_chunk_rows
+            written += nb_chunk_rows
+
+        # After the checks: the readers never see a check that is not written yet
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.flags, self.count))
+
+    def close(self):
+        self.file.close()
+
+
+def read_date(file, row, chunk_rows):
+    """The date of a check of a segment file"""
+    chunk, offset = divmod(row, chunk_rows)
+    file.seek(HEADER.size + chunk * chunk_rows * ROW_SIZE + offset * 8)
+    return struct.unpack("<d", file.read(8))[0]
+
+
+def scan(path, chunk_rows, min_date, max_date, function):
+    """Call function(*columns) for each chunk of the segment file having checks between min_date (included)
+    and max_date (excluded, None: no limit), with the memoryview slices of the columns of these checks
+
+    The views are only valid during the call: the map is closed afterwards
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        # Deleted by the retention
+        return
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= HEADER.size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            buffer = memoryview(segment)
+            try:
+                _, _, flags, count = HEADER.unpack_from(buffer)
+                chunk_size = chunk_rows * ROW_SIZE
+                for chunk in range(-(-count // chunk_rows)):
+                    nb_rows = min(chunk_rows, count - chunk * chunk_rows)
+                    base = HEADER.size + chunk * chunk_size
+                    columns = []
+                    for _, typecode in COLUMNS:
+                        width = array(typecode).itemsize
+                        columns.append(buffer[base:base + width * nb_rows].cast(typecode))
+                        base += width * chunk_rows
+
+                    dates = columns[0]
+                    if flags & UNSORTED:
+                        selected = [i for i, date in enumerate(dates)
+                                    if date >= min_date and (max_date is None or date < max_date)]
+                        if selected:
+                            function(*[[column[i] for i in selected] for column in columns])
+                    else:
+                        first = bisect.bisect_left(dates, min_date)
+                        last = nb_rows if max_date is None else bisect.bisect_left(dates, max_date, first)
+                        if first < last:
+                            function(*[column[first:last] for column in columns])
+                    for column in columns:
+                        column.release()
+            finally:
+                buffer.release()
+
+
+class SegmentStore:
+    """The checks of the websites in segment files under directory (see the module)
+
+    - segment_duration: the period of the checks of a segment, in seconds
+    - chunk_rows: the number of checks of a chunk (the segment files grow by chunk_rows * ROW_SIZE bytes)
+    """
+
+    SEGMENT_DURATION = DAY
+    CHUNK_ROWS = 256
+
+    def __init__(self, directory, segment_duration=SEGMENT_DURATION, chunk_rows=CHUNK_ROWS):
+        self.directory = directory
+        self.segment_duration = segment_duration
+        self.chunk_rows = chunk_rows
+        os.makedirs(directory, exist_ok=True)
+        # The last segment of each website opened to append checks {website id: (start, Segment)}
+        self._writers = {}
+        # The starts of the segments of each website, in order (read from the directory once): {website id: tuple}
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def website_directory(self, website_id):
+        return os.path.join(self.directory, str(website_id))
+
+    def segment_starts(self, website_id):
+        """The starts of the periods of the segments of a website, in order"""
+        starts = self._starts.get(website_id)
+        if starts is None:
+            try:
+                names = os.listdir(self.website_directory(website_id))
+            except FileNotFoundError:
+                names = []
+            starts = self._starts[website_id] = tuple(sorted(int(name[:-len(EXTENSION)]) for name in names
+                                                             if name.endswith(EXTENSION)))
+        return starts
+
+    def segment_path(self, website_id, start):
+        return os.path.join(self.website_directory(website_id), "%d%s" % (start, EXTENSION))
+
+    def website_ids(self):
+        return [int(name) for name in os.listdir(self.directory) if name.isdigit()]
+
+    def append(self, rows):
+        """Save checks given as dicts of Check fields (like the rows of the CheckWriter)"""
+        # The checks of each segment, in order of date
+        segments = {}
+        for row in sorted(rows, key=lambda row: row["date"]):
+            website = row["website"]
+            key = (getattr(website, "id", website), int(row["date"] // self.segment_duration * self.segment_duration))
+            segments.setdefault(key, []).append(row)
+
+        with self._lock:
+            for (website_id, start), segment_rows in segments.items():
+                columns = {"date": [float(row["date"]) for row in segment_rows],
+                           "outcome": [Check.OUTCOME_CODES.get(row.get("outcome", Check.OK), ERROR_CODE)
+                                       for row in segment_rows]}
+                for name, _ in COLUMNS:
+                    if name not in columns:
+                        columns[name] = [row.get(name, 0) for row in segment_rows]
+                self._writer(website_id, start).append(columns)
+
+    def _writer(self, website_id, start):
+        current = self._writers.get(website_id)
+        if current and current[0] == start:
+            return current[1]
+        if current:
+            # The checks of a new period: the previous segment is done
+            current[1].close()
+        os.makedirs(self.website_directory(website_id), exist_ok=True)
+        segment = Segment(self.segment_path(website_id, start), self.chunk_rows)
+        self._writers[website_id] = (start, segment)
+        starts = self.segment_starts(website_id)
+        if start not in starts:
+            # A new tuple: the readers go on with the previous one
+            self._starts[website_id] = tuple(sorted(starts + (start,)))
+        return segment
+
+    def scan(self, website_id, min_date, max_date, function):
+        """Call function(*columns) with the columns of the checks of the website between min_date (included)
+        and max_date (excluded, None: no limit), chunk by chunk (see scan)
+        """
+        if max_date is not None and max_date <= min_date:
+            return
+        for start in self.segment_starts(website_id):
+            if start + self.segment_duration <= min_date or (max_date is not None and start >= max_date):
+                continue
+            scan(self.segment_path(website_id, start), self.chunk_rows, min_date, max_date, function)
+
+    def get_aggregate(self, website_id, min_date, max_date=None):
+        """Aggregate of the checks of a website between min_date (included) and max_date (excluded),
+        without the skipped ones (OVERRUN)
+        """
+        aggregate = Aggregate()
+
+        def add(dates, full_resp_times, resp_times, *columns):
+            for full_resp_time, resp_time, *phases, status_code, outcome in zip(full_resp_times, resp_times, *columns):
+                if outcome != OVERRUN_CODE:
+                    aggregate.add(full_resp_time, resp_time, status_code, phases, Check.OUTCOMES[outcome])
+
+        self.scan(website_id, min_date, max_date, add)
+        return aggregate
+
+    def rows(self, website_id, min_date, max_date=None):
+        """The checks of a website between min_date (included) and max_date (excluded) as tuples
+        (date, full_resp_time, resp_time, status_code, outcome, *phases), like the ones RollingWindow.load takes
+        """
+        rows = []
+
+        def add(dates, full_resp_times, resp_times, *columns):
+            for date, full_resp_time, resp_time, *phases, status_code, outcome in zip(dates, full_resp_times,
+                                                                                      resp_times, *columns):
+                rows.append((date, full_resp_time, resp_time, status_code, Check.OUTCOMES[outcome], *phases))
+
+        self.scan(website_id, min_date, max_date, add)
+        return rows
+
+    def count(self, website_id):
+        """The number of checks of a website"""
+        count = 0
+        for start in self.segment_starts(website_id):
+            with open(self.segment_path(website_id, start), "rb") as file:
+                count += HEADER.unpack(file.read(HEADER.size))[3]
+        return count
+
+    def prune(self, website_id, min_date):
+        """Delete the segments of a website whose checks are all older than min_date
+
+        Return: the number of checks deleted
+        """
+        deleted = 0
+        with self._lock:
+            for start in self.segment_starts(website_id):
+                if start + self.segment_duration > min_date:
+                    break
+                current = self._writers.get(website_id)
+                if current and current[0] == start:
+                    # Late checks have been appended to this old segment
+                    del self._writers[website_id]
+                    current[1].close()
+                path = self.segment_path(website_id, start)
+                with open(path, "rb") as file:
+                    deleted += HEADER.unpack(file.read(HEADER.size))[3]
+                os.remove(path)
+                self._starts[website_id] = self._starts[website_id][1:]
+        return deleted
+
+    def drop(self, website_id):
+        """Delete all the checks of a (deleted) website
+
+        Return: the number of checks deleted
+        """
+        deleted = self.count(website_id)
+        with self._lock:
+            current = self._writers.pop(website_id, None)
+            if current:
+                current[1].close()
+            shutil.rmtree(self.website_directory(website_id), ignore_errors=True)
+            self._starts.pop(website_id, None)
+        return deleted
+
+    def close(self):
+        with self._lock:
+            for _, segment in self._writers.values():
+                segment.close()
+            self._writers = {}
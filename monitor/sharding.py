@@ -0,0 +1,317 @@
+"""Sharded probing: the checks of the websites run in several worker processes
+
+One process tops out at a few thousand checks per second (TLS handshakes and the parsing of the responses hold
+the GIL). In sharded mode, the websites are split between {nb_shards} worker processes, each one running its own
+CheckEngine that only probes (see website_monitor.probe): the workers have no database. They stream the results
+back to the coordinator, the main process, which owns the WebsiteMonitor instances: the checks are saved, added to
+the stats and the alerts there, as if they had been run by its own CheckEngine.
+
+The websites are assigned to the shards by rendezvous hashing on their id: adding or deleting a website never
+moves the others, and changing the number of shards only moves the websites of the added or removed shards,
+so most websites keep their warm connections in their worker.
+
+Each pipe has a single direction:
+- commands, to the worker: ("add", ShardWebsite), ("remove", website id), ("stop", None), pickled
+- results, to the coordinator: the results of the checks packed in batches of RESULT structs,
+  and the status of the worker from time to time (pickled): the lag stats of its engine, its instruments
+  (merged with the ones of the coordinator, see instrumentation) and its number of checks in flight
+"""
+
+import hashlib
+import multiprocessing
+import pickle
+import signal
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.connection import wait
+from struct import Struct
+
+from monitor.check_engine import CheckEngine
+from monitor.http_pool import session_pool
+from monitor.models import Check
+from monitor.scheduler import LagStats
+from monitor.instrumentation import instruments, Histogram
+from monitor.website_monitor import probe, overrun
+
+# What a worker knows of a website
+ShardWebsite = namedtuple("ShardWebsite", ("id", "url", "check_interval", "timing"))
+
+# A check result: website id, date, full_resp_time, resp_time, status_code, outcome (its code in
+# Check.OUTCOME_CODES), then the 5 phases (75 bytes)
+RESULT = Struct("<qdddHB5d")
+
+# The first byte of the messages sent to the coordinator
+RESULTS = b"r"
+STATUS = b"s"
+
+
+def shard_website(website):
+    return ShardWebsite(website.id, website.url, website.check_interval, website.timing)
+
+
+def shard_of(website_id, nb_shards):
+    """The shard of a website: the one with the highest hash of (website id, shard) (rendezvous hashing)"""
+    def weight(shard):
+        return hashlib.blake2b(b"%d:%d" % (website_id, shard), digest_size=8).digest()
+
+    return max(range(nb_shards), key=weight)
+
+
+def encode_result(website_id, result):
+    """Pack a result of probe (or overrun) for the results pipe"""
+    date, full_rt, rt, status_code, outcome = result[:5]
+    return RESULT.pack(website_id, date, full_rt, rt, status_code, Check.OUTCOME_CODES[outcome], *result[5:])
+
+
+def decode_results(data):
+    """Unpack a batch of results: iterator of (website id, result tuple like the ones of probe)"""
+    for website_id, date, full_rt, rt, status_code, outcome, *phases in RESULT.iter_unpack(data):
+        yield website_id, (date, full_rt, rt, status_code, Check.OUTCOMES[outcome], *phases)
+
+
+class ResultChannel:
+    """The results side of a worker: the results of the checks (put by the threads of the engine) are sent
+    in batches by the main thread of the worker (flush)
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def put(self, website_id, result):
+        data = encode_result(website_id, result)
+        with self._lock:
+            self._buffer += data
+
+    def flush(self):
+        with self._lock:
+            data = self._buffer
+            self._buffer = bytearray()
+        if data:
+            self.connection.send_bytes(RESULTS + data)
+
+    def send_status(self, engine):
+        status = (engine.scheduler.lag, instruments.get_states(), engine.nb_in_flight())
+        self.connection.send_bytes(STATUS + pickle.dumps(status))
+
+
+class ShardProbe:
+    """The stand-in of a WebsiteMonitor in a worker: scheduled by the engine of the worker,
+    it probes the website and puts the results in the channel
+    """
+
+    __slots__ = ("website", "channel")
+
+    def __init__(self, website, channel):
+        self.website = website
+        self.channel = channel
+
+    def check(self):
+        self.channel.put(self.website.id, probe(self.website, session_pool))
+
+    def record_overrun(self):
+        self.channel.put(self.website.id, overrun(time.time()))
+
+
+def run_shard(commands, results, max_concurrency, flush_interval, status_interval):
+    """The main function of a worker process"""
+    # The coordinator stops the workers: Ctrl+C in the terminal is sent to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    channel = ResultChannel(results)
+    engine = CheckEngine(max_concurrency)
+    engine.start()
+    probes = {}
+    status_date = time.monotonic()
+
+    try:
+        while True:
+            if commands.poll(flush_interval):
+                command, argument = commands.recv()
+                if command == "add":
+                    if argument.id not in probes:
+                        probes[argument.id] = ShardProbe(argument, channel)
+                        engine.add(probes[argument.id])
+                elif command == "remove":
+                    if argument in probes:
+                        engine.remove(probes.pop(argument))
+                else:
+                    break
+
+            channel.flush()
+            if time.monotonic() - status_date >= status_interval:
+                channel.send_status(engine)
+                status_date = time.monotonic()
+    except EOFError:
+        # The coordinator is gone
+        pass
+    finally:
+        # The running checks are finished and sent
+        engine.stop()
+        try:
+            channel.flush()
+            channel.send_status(engine)
+        except OSError:
+            pass
+        results.close()
+
+
+class ShardedEngine:
+    """Run the checks of the monitors in {nb_shards} worker processes, with the same interface as CheckEngine
+
+    The results are received by one thread of the coordinator, which records them with their WebsiteMonitor
+    (saved with its writer, added to its stats and alerts).
+
+    - max_concurrency: the maximum number of checks running at the same time in each worker
+    """
+
+    FLUSH_INTERVAL = 0.1  # in seconds, how long a worker keeps the results before sending them
+    STATUS_INTERVAL = 5  # in seconds, how often a worker sends its status
+
+    def __init__(self, nb_shards, max_concurrency=CheckEngine.MAX_CONCURRENCY):
+        self.nb_shards = nb_shards
+        self.max_concurrency = max_concurrency
+        self.is_running = False  # Flag to avoid starting several time the same engine
+
+        self._monitors = {}  # {website id: WebsiteMonitor}
+        self._sent = {}  # {website id: the ShardWebsite sent to its shard}
+        self._status = {}  # {shard: (LagStats of its engine, states of its instruments, checks in flight)}
+        self._processes = []
+        self._commands = []
+        self._results = []
+        self._receiver = None
+        self._lock = threading.Lock()  # for the command pipes (used by several threads) and _monitors
+
+    def start(self, monitors=()):
+        """Start the worker processes and the receiving thread, and send them the monitors"""
+        if self.is_running:
+            return
+
+        # Not forked: the coordinator has running threads (urwid, writer...)
+        context = multiprocessing.get_context("spawn")
+        self._processes, self._commands, self._results = [], [], []
+        self._status = {}
+        for shard in range(self.nb_shards):
+            commands_reader, commands_writer = context.Pipe(duplex=False)
+            results_reader, results_writer = context.Pipe(duplex=False)
+            process = context.Process(target=run_shard, name="shard-%d" % shard, daemon=True,
+                                      args=(commands_reader, results_writer, self.max_concurrency,
+                                            self.FLUSH_INTERVAL, self.STATUS_INTERVAL))
+            process.start()
+            # The worker ends of the pipes are only used by the worker (the results pipe is closed at its end)
+            commands_reader.close()
+            results_writer.close()
+            self._processes.append(process)
+            self._commands.append(commands_writer)
+            self._results.append(results_reader)
+
+        self._receiver = threading.Thread(target=self._receive, name="shard-receiver", daemon=True)
+        self._receiver.start()
+        self.is_running = True
+        # The last status of the workers stays in the instruments after the stop, until the next start
+        instruments.sources["shards"] = self.get_shard_histograms
+        instruments.gauge("checks_in_flight", self.nb_in_flight, "Checks waiting for a slot or running")
+
+        self.update(monitors)
+
+    def add(self, monitor):
+        """Send a monitor to its shard (thread safe)"""
+        with self._lock:
+            self._monitors[monitor.website.id] = monitor
+            self._add(shard_website(monitor.website))
+
+    def remove(self, monitor):
+        """Stop checking the website of a monitor (thread safe)"""
+        with self._lock:
+            self._monitors.pop(monitor.website.id, None)
+            self._remove(monitor.website.id)
+
+    def update(self, monitors):
+        """Replace the monitors of the running engine (thread safe): only the websites that have been added,
+        deleted or changed are sent to their shard, the others keep being checked (on their warm connections)
+        """
+        with self._lock:
+            self._monitors = {monitor.website.id: monitor for monitor in monitors}
+            websites = {website_id: shard_website(monitor.website) for website_id, monitor in self._monitors.items()}
+            for website_id, sent in list(self._sent.items()):
+                if websites.get(website_id) != sent:
+                    self._remove(website_id)
+            for website_id, website in websites.items():
+                if website_id not in self._sent:
+                    self._add(website)
+
+    def _add(self, website):
+        self._sent[website.id] = website
+        self._send(shard_of(website.id, self.nb_shards), ("add", website))
+
+    def _remove(self, website_id):
+        if self._sent.pop(website_id, None):
+            self._send(shard_of(website_id, self.nb_shards), ("remove", website_id))
+
+    def _send(self, shard, command):
+        try:
+            self._commands[shard].send(command)
+        except OSError:
+            # The worker is gone, its websites are no longer checked
+            pass
+
+    def _receive(self):
+        shards = {results: shard for shard, results in enumerate(self._results)}
+        while shards:
+            for results in wait(list(shards)):
+                try:
+                    data = results.recv_bytes()
+                except (EOFError, OSError):
+                    # The worker has stopped
+                    del shards[results]
+                    continue
+
+                if data[:1] == STATUS:
+                    self._status[shards[results]] = pickle.loads(data[1:])
+                    continue
+                for website_id, result in decode_results(data[1:]):
+                    monitor = self._monitors.get(website_id)
+                    # None: the website has been removed after its check
+                    if monitor:
+                        monitor.record(result)
+
+    def get_lag_stats(self):
+        """The lag stats of all the workers (see CheckEngine.get_lag_stats), as last sent by them"""
+        lag = LagStats()
+        for shard_lag, _, _ in list(self._status.values()):
+            lag.merge(shard_lag)
+        return lag.get_stats()
+
+    def get_shard_histograms(self):
+        """The instruments of all the workers {name: Histogram}, as last sent by them"""
+        histograms = {}
+        for _, states, _ in list(self._status.values()):
+            for name, state in states.items():
+                histograms.setdefault(name, Histogram()).merge(Histogram.from_state(state))
+        return histograms
+
+    def nb_in_flight(self):
+        """The number of checks waiting for a slot or running in the workers, as last sent by them"""
+        return sum(in_flight for _, _, in_flight in list(self._status.values()))
+
+    def stop(self, timeout=30):
+        """Stop the workers once their running checks are finished and recorded"""
+        if not self.is_running:
+            return
+
+        with self._lock:
+            for shard in range(self.nb_shards):
+                self._send(shard, ("stop", None))
+        # Everything sent by the workers has been recorded when all their results pipes are closed
+        self._receiver.join(timeout)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for connection in self._commands + self._results:
+            connection.close()
+        self._monitors.clear()
+        self._sent.clear()
+        self.is_running = False
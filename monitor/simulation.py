@@ -0,0 +1,172 @@
+"""Fast-forward simulation of the monitoring
+
+A Simulation replays synthetic checks through the real WebsiteMonitor instances: each result is recorded (saved,
+added to the rolling window, checked for the alerts) as if it had been probed, at the date of a VirtualClock.
+The checks are scheduled by the Scheduler of the CheckEngine, and the clock jumps from one deadline to the next:
+hours of monitoring are replayed in seconds, for the tests and the benchmarks of the alerts and of the stats.
+
+The behaviour of each website is a SiteModel: its response times, its errors and failures, and its outages.
+"""
+
+import math
+import random
+from collections import namedtuple
+from time import perf_counter
+
+from monitor.aggregator import NO_RESPONSE
+from monitor.check_writer import CheckWriter
+from monitor.clock import VirtualClock
+from monitor.models import Check
+from monitor.scheduler import Scheduler
+from monitor.website_monitor import WebsiteMonitor, DEADLINE_RATIO, get_monitors_stats
+
+# From start to end (in seconds from the start of the simulation), the checks of a website get the status code,
+# or fail with the outcome when the status code is NO_RESPONSE (a timeout lasts the whole deadline of the check)
+Outage = namedtuple("Outage", ("start", "end", "status_code", "outcome"))
+Outage.__new__.__defaults__ = (503, Check.OK)
+
+
+class SiteModel:
+    """The synthetic behaviour of a website
+
+    - latency: the median response time (until the headers), in seconds. The response times follow
+      a log-normal distribution: most of them are close to the median, some are {spread} times longer or more
+    - body_time: the median transfer time of the content, in seconds
+    - status_code: the status code of the responses
+    - error_rate: the part of the checks answering 500 instead
+    - failure_rate: the part of the checks timing out instead
+    - outages: the Outage periods of the website
+    """
+
+    def __init__(self, latency=0.1, body_time=0.05, spread=0.5, status_code=200, error_rate=0.0, failure_rate=0.0,
+                 outages=()):
+        self.latency = latency
+        self.body_time = body_time
+        self.spread = spread
+        self.status_code = status_code
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.outages = outages
+
+    def result(self, date, elapsed, interval, rand):
+        """The result of a check (like the ones of website_monitor.probe) at the date,
+        elapsed seconds after the start of the simulation
+        """
+        status_code, outcome = self.status_code, Check.OK
+        for outage in self.outages:
+            if outage.start <= elapsed < outage.end:
+                status_code, outcome = outage.status_code, outage.outcome
+                break
+        else:
+            draw = rand.random()
+            if draw < self.failure_rate:
+                status_code, outcome = NO_RESPONSE, Check.TIMEOUT
+            elif draw < self.failure_rate + self.error_rate:
+                status_code = 500
+
+        if status_code == NO_RESPONSE:
+            # The time until the failure
+            full_rt = interval * DEADLINE_RATIO if outcome == Check.TIMEOUT else self.latency
+            return date, full_rt, 0, NO_RESPONSE, outcome, 0, 0, 0, 0, 0
+
+        rt = self.latency * math.exp(rand.gauss(0, self.spread))
+        body = self.body_time * math.exp(rand.gauss(0, self.spread))
+        # The connection takes the first part of the response time, then the server answers
+        return date, rt + body, rt, status_code, outcome, 0.1 * rt, 0.15 * rt, 0.15 * rt, 0.6 * rt, body
+
+
+class SimulationWriter(CheckWriter):
+    """Save the checks in batches in the thread of the simulation (the writer thread is not started)"""
+
+    def __init__(self, batch_size=CheckWriter.BATCH_SIZE):
+        super().__init__(batch_size)
+        self.batch = []
+
+    def put(self, monitor, row):
+        self.batch.append((monitor, row))
+        if len(self.batch) >= self.batch_size:
+            self.drain()
+
+    def drain(self):
+        """Save the waiting checks"""
+        if self.batch:
+            self.flush(self.batch)
+            self.batch = []
+
+
+class Simulation:
+    """Replay the checks of the websites (saved Website instances) with their SiteModel
+
+    - models: dict {website id: SiteModel}, it can be changed between two runs
+    - start: the date of the start of the simulation (the current date by default)
+    - stats_interval: the stats are calculated every stats_interval seconds (like the TUI does), over each of
+      the timeframes (in min), and given to on_stats(date, timeframe, stats) (None: no stats)
+    - seed: of the random results
+
+    The Simulation is the controller of the monitors: the alerts are kept in alerts.
+    """
+
+    def __init__(self, websites, models, start=None, stats_interval=None, timeframes=(10,), on_stats=None,
+                 seed=0, batch_size=CheckWriter.BATCH_SIZE):
+        self.models = models
+        self.clock = VirtualClock(start)
+        self.start = self.clock.time()
+        self.stats_interval = stats_interval
+        self.timeframes = timeframes
+        self.on_stats = on_stats
+        self.random = random.Random(seed)
+        self.alerts = []
+
+        self.writer = SimulationWriter(batch_size)
+        self.monitors = [WebsiteMonitor(website, self, writer=self.writer, clock=self.clock) for website in websites]
+        self.scheduler = Scheduler()
+        for monitor in self.monitors:
+            self.scheduler.add(monitor, monitor.website.check_interval, self.start, key=monitor.website.id)
+        self._next_stats = self.start + stats_interval if stats_interval else None
+
+    def update_alert_history(self, alert):
+        self.alerts.append(alert)
+
+    def run(self, duration):
+        """Replay the next {duration} seconds of checks (the simulation goes on at each run)
+
+        return: dict {checks, alerts, stats: the number of checks, alerts and stats of the run,
+        wall_time: how long the run took, in seconds}
+        """
+        wall_start = perf_counter()
+        end = self.clock.time() + duration
+        nb_checks, nb_alerts, nb_stats = 0, len(self.alerts), 0
+
+        while True:
+            deadline = self.scheduler.next_deadline()
+            if deadline is None or deadline > end:
+                break
+            while self._next_stats is not None and self._next_stats < deadline:
+                self._stats(self._next_stats)
+                nb_stats += 1
+
+            self.clock.set(deadline)
+            for monitor, date, _ in self.scheduler.pop_due(deadline):
+                website = monitor.website
+                monitor.record(self.models[website.id].result(date, date - self.start, website.check_interval,
+                                                              self.random))
+                nb_checks += 1
+
+        while self._next_stats is not None and self._next_stats <= end:
+            self._stats(self._next_stats)
+            nb_stats += 1
+        self.clock.set(end)
+        self.writer.drain()
+
+        return {"checks": nb_checks, "alerts": len(self.alerts) - nb_alerts, "stats": nb_stats,
+                "wall_time": perf_counter() - wall_start}
+
+    def _stats(self, date):
+        self.clock.set(date)
+        # The stats older than the rolling windows come from the saved checks
+        self.writer.drain()
+        for timeframe in self.timeframes:
+            stats = get_monitors_stats(self.monitors, timeframe, date)
+            if self.on_stats:
+                self.on_stats(date, timeframe, stats)
+        self._next_stats = date + self.stats_interval
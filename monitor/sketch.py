@@ -0,0 +1,77 @@
+"""Mergeable quantile sketches of the response times
+
+A LatencySketch counts the durations in logarithmic bins, like an HDR histogram: each bin covers durations whose
+ratio is at most GAMMA, so a quantile is known within RELATIVE_ACCURACY (1%) of its real value whatever the
+duration. Two sketches merge by adding the counts of their bins: the percentiles of a timeframe come from the
+sketches of its buckets or rollups, not from the checks. The size of a sketch is bounded by the number of bins
+between the shortest and the longest durations (about 350 bins from 10 ms to 10 s), not by the number of checks.
+"""
+
+import math
+from array import array
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Shorter durations (in seconds) are counted as this one
+MIN_VALUE = 1e-5
+
+
+class LatencySketch:
+    """The distribution of durations (in seconds): the number of durations in each logarithmic bin"""
+
+    __slots__ = ("bins", "count")
+
+    def __init__(self):
+        self.bins = {}  # {bin index: number of durations}, the bin i is ]GAMMA ** (i - 1), GAMMA ** i]
+        self.count = 0
+
+    def add(self, value):
+        index = math.ceil(math.log(max(value, MIN_VALUE)) / LOG_GAMMA)
+        self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        """Add the durations of another sketch to this one"""
+        bins = self.bins
+        for index, nb in other.bins.items():
+            bins[index] = bins.get(index, 0) + nb
+        self.count += other.count
+
+    def quantile(self, q):
+        """The duration below which are the part q (between 0 and 1) of the durations, None without duration"""
+        if not self.count:
+            return None
+        rank = round(q * (self.count - 1))
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                break
+        # The middle of the bin, at RELATIVE_ACCURACY of both its ends
+        return 2 * GAMMA ** index / (GAMMA + 1)
+
+    def to_bytes(self):
+        """The bins as a compact blob: the pairs (index, number), to save the sketch in the rollups"""
+        pairs = array("i")
+        for index, nb in self.bins.items():
+            pairs.append(index)
+            pairs.append(nb)
+        return pairs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        if data:
+            pairs = array("i")
+            pairs.frombytes(data)
+            sketch.bins = dict(zip(pairs[::2], pairs[1::2]))
+            sketch.count = sum(sketch.bins.values())
+        return sketch
+
+    @classmethod
+    def from_values(cls, values):
+        sketch = cls()
+        for value in values:
+            sketch.add(value)
+        return sketch
@@ -0,0 +1,124 @@
+"""The storage of WebMo: where the SQLite database is, and how its connections are tuned (StorageProfile)
+
+With the WAL journal (the default profile), the readers (the stats of the TUI, the metrics of the headless mode)
+and the writer (the CheckWriter) do not block each other: a reader sees the database as it was when its
+transaction began, while the writer appends to the WAL. The WAL is copied back into the database by the
+checkpoints: automatically after a commit once it is larger than wal_autocheckpoint pages, and by the CheckWriter
+every checkpoint_interval seconds and when it stops (see checkpoint).
+
+Each thread has its own connection (thread_safe: the connections of peewee are thread-local), opened at its first
+query: a connection is never shared between threads. The threads doing queries close theirs when they end.
+
+The database is website_monitor.db in the current directory, unless another path is given with --db
+or in the WEBMO_DB environment variable. The checks can also be saved outside of the database, in the columnar
+segment files of a SegmentStore (see monitor.segments and set_check_store).
+"""
+
+import os
+
+from peewee import SqliteDatabase
+
+from monitor.instrumentation import instruments
+
+DEFAULT_PATH = os.environ.get("WEBMO_DB", "website_monitor.db")
+
+# Modes of the checkpoints, from the one that never waits to the one that also empties the WAL file
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+checkpoint_duration = instruments.histogram("db_checkpoint_seconds", "Duration of the checkpoints of the WAL")
+
+
+class StorageProfile:
+    """The settings of the database connections
+
+    - journal_mode: "wal" (the readers do not block the writer), or "delete" (the rollback journal of SQLite)
+    - synchronous: "normal": in WAL mode, the commits are not synced to the disk, only the checkpoints are:
+      a power loss can lose the last commits but does not corrupt the database. "full" syncs each commit
+    - cache_size: the page cache of each connection, in KB
+    - mmap_size: the part of the database read through a memory map instead of read calls, in bytes (0: none)
+    - busy_timeout: how long a query waits for a lock held by another connection before failing, in seconds
+    - wal_autocheckpoint: the size of the WAL (in pages) after which a commit checkpoints it (0: never)
+    - checkpoint_interval: the CheckWriter checkpoints the WAL every checkpoint_interval seconds
+      (None: only the automatic checkpoints)
+    - auto_vacuum: "incremental": the pages freed by the retention job can be given back to the file system
+      (see monitor.retention). Only applied to a new database, or by a full vacuum
+    """
+
+    def __init__(self, journal_mode="wal", synchronous="normal", cache_size=64 * 1024, mmap_size=256 * 2 ** 20,
+                 busy_timeout=5, wal_autocheckpoint=1000, checkpoint_interval=60, auto_vacuum="incremental"):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.auto_vacuum = auto_vacuum
+
+    def pragmas(self):
+        """The pragmas run on each new connection"""
+        return [
+            # Only effective on a new database (before its first table is created), or by a full vacuum
+            ("auto_vacuum", self.auto_vacuum),
+            ("journal_mode", self.journal_mode),
+            ("synchronous", self.synchronous),
+            # Negative: in KB instead of pages
+            ("cache_size", -self.cache_size),
+            ("mmap_size", self.mmap_size),
+            ("wal_autocheckpoint", self.wal_autocheckpoint),
+            # The on_delete of the foreign keys has a real effect on the SQLite db
+            ("foreign_keys", "on"),
+        ]
+
+
+PROFILES = {
+    "fast": StorageProfile(),
+    # Each commit is on the disk when it returns
+    "durable": StorageProfile(synchronous="full"),
+    # The settings of the previous versions: rollback journal, default cache, no memory map
+    "compat": StorageProfile(journal_mode="delete", synchronous="full", cache_size=2000, mmap_size=0,
+                             checkpoint_interval=None, auto_vacuum="none"),
+}
+DEFAULT_PROFILE = "fast"
+
+# The profile the database is configured with (see configure_storage)
+profile = PROFILES[DEFAULT_PROFILE]
+
+db = SqliteDatabase(DEFAULT_PATH, thread_safe=True, pragmas=profile.pragmas(), timeout=profile.busy_timeout)
+
+# Where the checks are saved and read: a SegmentStore, or None for the Check table of the database
+check_store = None
+
+
+def configure_storage(path=None, storage_profile=None):
+    """Use the database at path (the current one by default) with the StorageProfile (the current one by default),
+    before any query (the connection of the current thread is closed)
+    """
+    global profile
+    if storage_profile:
+        profile = storage_profile
+    db.init(path or db.database, pragmas=profile.pragmas(), timeout=profile.busy_timeout)
+
+
+def set_check_store(store):
+    """Save and read the checks in the store (a SegmentStore), or in the Check table with None"""
+    global check_store
+    check_store = store
+
+
+def segments_directory(path):
+    """The default directory of the segment files of the database at path"""
+    return os.path.splitext(path)[0] + "_segments"
+
+
+def checkpoint(mode="PASSIVE"):
+    """Copy the WAL into the database (see CHECKPOINT_MODES)
+
+    PASSIVE copies what it can without waiting for the readers, TRUNCATE waits for them and empties the WAL file.
+    Return (1 if it was blocked by another connection else 0, pages in the WAL, pages copied)
+    (-1 for the pages when the database is not in WAL mode)
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError("Unknown checkpoint mode: %s" % mode)
+    with checkpoint_duration.time():
+        return tuple(db.execute_sql("PRAGMA wal_checkpoint(%s)" % mode).fetchone())
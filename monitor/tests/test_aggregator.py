@@ -0,0 +1,81 @@
+import unittest
+
+from monitor.aggregator import RollingWindow
+
+
+class RollingWindowTest(unittest.TestCase):
+    """Test case on the in-memory stats of the last checks"""
+
+    def setUp(self):
+        self.window = RollingWindow(duration=3600, bucket_duration=5)
+        self.now = 1000000
+
+    def test_empty(self):
+        stats = self.window.get_stats(10, self.now)
+        self.assertEqual(stats["availability"], 0)
+        self.assertIsNone(stats["max_rt"])
+        self.assertIsNone(stats["p95_rt"])
+        self.assertEqual(stats["codes_count"], {})
+
+    def test_stats(self):
+        for i in range(10):
+            self.window.add(self.now - i * 10, 0.3, 0.1 + i / 100, 200 if i < 8 else 500,
+                            (0.01, 0.02, 0, 0.07 + i / 100, 0.2))
+
+        stats = self.window.get_stats(10, self.now)
+        self.assertEqual(stats["availability"], 80)
+        self.assertEqual(stats["codes_count"], {200: 8, 500: 2})
+        self.assertAlmostEqual(stats["max_rt"], 0.19)
+        self.assertAlmostEqual(stats["avg_rt"], 0.145)
+        self.assertAlmostEqual(stats["avg_full_rt"], 0.3)
+        self.assertAlmostEqual(stats["avg_connect"], 0.02)
+        # Within 1%
+        self.assertAlmostEqual(stats["p50_rt"], 0.14, delta=0.0015)
+        self.assertAlmostEqual(stats["p99_rt"], 0.19, delta=0.002)
+        self.assertAlmostEqual(stats["p95_full_rt"], 0.3, delta=0.003)
+
+    def test_timeframe(self):
+        """Only the checks of the timeframe are counted, rounded to the buckets"""
+        self.window.add(self.now - 30, 0.3, 0.1, 500)
+        self.window.add(self.now - 90, 0.3, 0.1, 200)
+        self.window.add(self.now - 600, 0.3, 0.1, 200)
+
+        self.assertEqual(self.window.get_availability(1, self.now), 0)
+        self.assertEqual(self.window.get_availability(2, self.now), 50)
+        self.assertEqual(self.window.get_availability(11, self.now), 66)
+
+    def test_old_buckets_reused(self):
+        """A check of more than one hour ago is forgotten when its bucket is reused"""
+        self.window.add(self.now - 3600 - 60, 0.3, 0.1, 500)
+        self.window.add(self.now, 0.3, 0.1, 200)
+        self.assertEqual(self.window.get_availability(60, self.now), 100)
+
+        later = self.now + 3600
+        self.window.add(later, 0.3, 0.1, 200)
+        # Too old for the buckets: ignored
+        self.window.add(self.now - 10, 0.3, 0.1, 500)
+        self.assertEqual(self.window.get_stats(60, later)["codes_count"], {200: 2})
+
+    def test_load(self):
+        self.window.load([(self.now - 10, 0.3, 0.1, 200, "ok", 0, 0, 0, 0.1, 0.2),
+                          (self.now - 20, 0.3, 0.1, 404, "ok", 0, 0, 0, 0.1, 0.2),
+                          (self.now - 30, 2, 0, 0, "dns", 0, 0, 0, 0, 0)])
+        self.assertEqual(self.window.get_availability(2, self.now), 33)
+
+    def test_failures(self):
+        """The checks without response are unavailable, without response time"""
+        self.window.add(self.now - 10, 0.3, 0.1, 200)
+        self.window.add(self.now - 20, 0.8, 0, 0, outcome="timeout")
+        self.window.add(self.now - 30, 0.01, 0, 0, outcome="dns")
+        self.window.add(self.now - 40, 0.01, 0, 0, outcome="dns")
+
+        stats = self.window.get_stats(2, self.now)
+        self.assertEqual(stats["availability"], 25)
+        self.assertEqual(stats["failures"], {"timeout": 1, "dns": 2})
+        self.assertEqual(stats["codes_count"], {200: 1, 0: 3})
+        self.assertAlmostEqual(stats["max_full_rt"], 0.3)
+        self.assertAlmostEqual(stats["avg_rt"], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
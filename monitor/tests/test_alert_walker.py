@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+
+from peewee import chunked
+
+from monitor.models import db, Website, Alert
+from monitor.monitor import db_init
+from monitor.monitor_tui import AlertWalker, ExtendedListBox, SelectableText
+
+
+class AlertWalkerTest(unittest.TestCase):
+    """Test case on the alert history: read by pages from the Alert table"""
+
+    SIZE = (60, 10)
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db.init(self.path)
+        db_init()
+
+        self.website = Website.create(url="http://localhost/")
+        # 1000 alerts, some of them at the same date
+        with db.atomic():
+            for rows in chunked([{"website": self.website, "date": 1000000 + i // 3, "availability": i % 100}
+                                 for i in range(1000)], 100):
+                Alert.insert_many(rows).execute()
+
+        self.walker = AlertWalker(lambda alert: SelectableText(str(alert.id)), SelectableText("Beginning"))
+        self.list_box = ExtendedListBox(self.walker)
+
+    def ids(self):
+        return [int(self.walker[position].get_text()[0]) for position in range(len(self.walker) - 1)]
+
+    def visible_text(self):
+        return b"\n".join(self.list_box.render(self.SIZE, focus=True).text).decode()
+
+    def test_pages(self):
+        self.assertEqual(len(self.walker), 1001)
+        self.list_box.render(self.SIZE, focus=True)
+        # Only the first page has been read
+        self.assertEqual(list(self.walker._pages), [0])
+
+        # The same order as one query
+        expected = [alert.id for alert in Alert.select().order_by(Alert.date.desc(), Alert.id.desc())]
+        self.assertEqual(self.ids(), expected)
+        self.assertLessEqual(len(self.walker._pages), AlertWalker.CACHE_PAGES)
+        self.assertLessEqual(len(self.walker._widgets), AlertWalker.CACHE_SIZE)
+
+    def test_bottom(self):
+        self.list_box.keypress(self.SIZE, "b")
+        text = self.visible_text()
+        self.assertIn("Beginning", text)
+        self.assertIn("\n1 ", text)
+        # The last page read from the end, not all the pages before it
+        self.assertLessEqual(len(self.walker._pages), 3)
+
+        # Going up reads the previous page from the last one
+        for _ in range(3):
+            self.list_box.keypress(self.SIZE, "u")
+        self.assertEqual(self.ids()[-100:], list(range(100, 0, -1)))
+
+    def test_add(self):
+        self.list_box.keypress(self.SIZE, "d")
+        focus = self.list_box.focus.get_text()[0]
+
+        alert = Alert.create(website=self.website, date=2000000, availability=50)
+        self.walker.add(alert)
+        self.walker.add(Alert.get_by_id(10))
+
+        self.assertEqual(len(self.walker), 1002)
+        self.assertEqual(self.ids()[0], alert.id)
+        # The focus stays on the same alert
+        self.assertEqual(self.list_box.focus.get_text()[0], focus)
+
+    def test_deleted_website(self):
+        """The alerts deleted with their website are not read past the end of the pages"""
+        other = Website.create(url="http://other/")
+        Alert.insert_many([{"website": other, "date": 900000 + i, "availability": 50} for i in range(20)]).execute()
+        walker = AlertWalker(lambda alert: SelectableText(str(alert.id)), SelectableText("Beginning"))
+        self.assertEqual(len(walker), 1021)
+
+        other.delete_instance()
+        # Scrolled to the bottom: the last page is short
+        position = 0
+        while walker[position] is not walker.end_widget:
+            position = walker.next_position(position)
+        self.assertEqual(position, 1000)
+        self.assertEqual(len(walker), 1001)
+
+        self.website.delete_instance()
+        walker.reload()
+        self.assertEqual(len(walker), 1)
+        self.assertIs(walker[0], walker.end_widget)
+
+    def tearDown(self):
+        db.close()
+        db.init(self.database)
+        os.remove(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
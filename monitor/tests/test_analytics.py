@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from monitor import storage
+from monitor.models import db, Website
+from monitor.monitor import db_init
+from monitor.aggregator import PERCENTILES, NO_RESPONSE
+from monitor.analytics import np, get_raw_stats, load_check_arrays, compute_stats
+from monitor.check_writer import CheckWriter
+from monitor.clock import VirtualClock
+from monitor.segments import SegmentStore
+from monitor.website_monitor import WebsiteMonitor, get_monitors_stats
+from monitor.tests.test_segments import random_rows, rows_aggregate
+
+
+def exact_percentile(rows, name, q):
+    values = sorted(row[name] for row in rows if row["status_code"] != NO_RESPONSE)
+    return values[round(q * (len(values) - 1))] if values else None
+
+
+class RawStatsTest(unittest.TestCase):
+    """Test case on the stats computed from the saved checks: the same as the ones of an Aggregate,
+    with the exact percentiles
+    """
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        self.directory = tempfile.TemporaryDirectory()
+        db.init(os.path.join(self.directory.name, "webmo.db"))
+        db_init()
+
+        self.websites = [Website.create(url="http://site%d/" % i, check_interval=10) for i in range(3)]
+        self.now = 1000000 * 3600 + 1234
+        self.rows = []
+        # Websites with different numbers of checks, the last one without check
+        for seed, (website, step) in enumerate(zip(self.websites[:2], (7, 13))):
+            self.rows.extend(random_rows(website.id, self.now - 2 * 3600, self.now, step, seed))
+
+    def save(self):
+        CheckWriter().flush([(None, row) for row in self.rows])
+
+    def assertSameStats(self, stats, min_date):
+        for website in self.websites:
+            rows = [row for row in self.rows if row["website"] == website.id and min_date <= row["date"] < self.now
+                    and row["outcome"] != "overrun"]
+            expected = rows_aggregate(rows, min_date, self.now).get_stats()
+            website_stats = stats[website.id]
+            for name in ("codes_count", "failures", "availability"):
+                self.assertEqual(website_stats[name], expected[name])
+            for name in ("max_rt", "avg_rt", "max_full_rt", "avg_full_rt", "avg_dns", "avg_ttfb", "avg_body"):
+                if expected[name] is None:
+                    self.assertIsNone(website_stats[name])
+                else:
+                    # The times of the segment files are float32
+                    self.assertAlmostEqual(website_stats[name], expected[name], places=6)
+            for percentile in PERCENTILES:
+                for name, column in (("rt", "resp_time"), ("full_rt", "full_resp_time")):
+                    value = exact_percentile(rows, column, percentile / 100)
+                    if value is None:
+                        self.assertIsNone(website_stats["p%d_%s" % (percentile, name)])
+                    else:
+                        self.assertAlmostEqual(website_stats["p%d_%s" % (percentile, name)], value, places=6)
+
+    def test_python(self):
+        self.save()
+        for min_date in (self.now - 2 * 3600, self.now - 600 + 3):
+            self.assertSameStats(get_raw_stats(self.websites, min_date, use_numpy=False), min_date)
+        # Only the checks of the timeframe
+        self.assertEqual(len(load_check_arrays(self.websites, self.now - 600, self.now - 300, use_numpy=False)),
+                         len([row for row in self.rows if self.now - 600 <= row["date"] < self.now - 300
+                              and row["outcome"] != "overrun"]))
+
+    @unittest.skipUnless(np, "NumPy is not installed")
+    def test_numpy(self):
+        self.save()
+        for min_date in (self.now - 2 * 3600, self.now - 600 + 3):
+            stats = get_raw_stats(self.websites, min_date)
+            self.assertSameStats(stats, min_date)
+            python_stats = get_raw_stats(self.websites, min_date, use_numpy=False)
+            for website_id, website_stats in stats.items():
+                self.assertEqual(website_stats.keys(), python_stats[website_id].keys())
+
+    def test_no_checks(self):
+        stats = compute_stats(load_check_arrays(self.websites, self.now), [website.id for website in self.websites])
+        self.assertEqual(stats[self.websites[0].id]["availability"], 0)
+        self.assertIsNone(stats[self.websites[0].id]["p99_rt"])
+
+    def test_segments(self):
+        store = SegmentStore(os.path.join(self.directory.name, "segments"), segment_duration=3600, chunk_rows=64)
+        storage.set_check_store(store)
+        try:
+            self.save()
+            min_date = self.now - 2 * 3600 + 100
+            self.assertSameStats(get_raw_stats(self.websites, min_date, use_numpy=False), min_date)
+            if np is not None:
+                self.assertSameStats(get_raw_stats(self.websites, min_date), min_date)
+        finally:
+            storage.set_check_store(None)
+            store.close()
+
+    def test_monitors(self):
+        self.save()
+        clock = VirtualClock(self.now)
+        monitors = [WebsiteMonitor(website, None, clock=clock) for website in self.websites]
+        stats = get_monitors_stats(monitors, 60, self.now, raw=True)
+        self.assertSameStats(stats, self.now - 3600)
+        self.assertEqual(monitors[0].get_stats(60, raw=True), stats[self.websites[0].id])
+        # The same counts as the rolling windows
+        self.assertEqual(stats[self.websites[1].id]["codes_count"],
+                         monitors[1].get_stats(60)["codes_count"])
+
+    def tearDown(self):
+        db.close()
+        db.init(self.database)
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class BenchmarksTest(unittest.TestCase):
+    """Test case on the benchmarks: they still run with the current schema (on a few checks)"""
+
+    def run_benchmark(self, module, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            # Their temporary databases, and the WEBMO_DB of the ones using the default one
+            env = dict(os.environ, TMPDIR=directory, WEBMO_DB=os.path.join(directory, "webmo.db"))
+            result = subprocess.run([sys.executable, "-m", module, *args], cwd=ROOT, env=env,
+                                    capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_check_index(self):
+        output = self.run_benchmark("benchmarks.bench_check_index", "--rows", "2000", "--websites", "10",
+                                    "--days", "1", "--sample", "2", "--repeat", "1")
+        self.assertIn("checks of 10 min", output)
+
+    def test_simulation(self):
+        self.run_benchmark("benchmarks.bench_simulation", "--sites", "2", "--days", "0.05")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from monitor.models import Website, Check
+from monitor.website_monitor import WebsiteMonitor
+from monitor.monitor import db_init
+from monitor.http_pool import SessionPool
+
+
+class TricklingHandler(BaseHTTPRequestHandler):
+    """Answer 200 at once, then send the content one byte every 0.1 s (for 3 s) on /slow,
+    or send the headers themselves one byte every 0.1 s on /slow-headers
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/slow-headers":
+            try:
+                for byte in b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nX-Padding: xxxxxxxxxxxxxxxxxxxx\r\n\r\nok":
+                    self.wfile.write(bytes((byte,)))
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        slow = self.path == "/slow"
+        content = b"x" * (30 if slow else 100)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        try:
+            for byte in content:
+                self.wfile.write(bytes((byte,)))
+                self.wfile.flush()
+                if slow:
+                    time.sleep(0.1)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class DumbController():
+    def update_alert_history(self, alert):
+        pass
+
+
+class CheckDeadlineTest(unittest.TestCase):
+    """Test case on the deadline of a whole check, on a local server"""
+
+    def setUp(self):
+        db_init()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), TricklingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.website = Website.create(url="http://127.0.0.1:%d/slow" % self.server.server_address[1],
+                                      check_interval=1)
+        self.monitor = WebsiteMonitor(self.website, DumbController(), session_pool=SessionPool())
+
+    def last_check(self):
+        return Check.select().where(Check.website == self.website).order_by(Check.id.desc()).get()
+
+    def assertTimeout(self):
+        start = time.monotonic()
+        self.monitor.check()
+        # The deadline is 0.8 s (the read timeouts were 0.33 s each, for 3 s of content)
+        self.assertLess(time.monotonic() - start, 1)
+
+        check = self.last_check()
+        self.assertEqual(check.outcome, Check.TIMEOUT)
+        self.assertEqual(check.status_code, 0)
+        self.assertAlmostEqual(check.full_resp_time, 0.8, delta=0.15)
+        self.assertEqual(self.monitor.get_availability(2), 0)
+        self.assertIsNone(self.monitor.get_stats(2)["avg_rt"])
+
+    def test_cold_trickling_content(self):
+        self.assertTimeout()
+
+    def test_warm_trickling_content(self):
+        self.website.timing = Website.WARM
+        self.assertTimeout()
+
+    def test_trickling_headers(self):
+        self.website.url = self.website.url.replace("/slow", "/slow-headers")
+        self.assertTimeout()
+
+    def test_slow_dns(self):
+        """The DNS lookup is abandoned at the deadline"""
+        getaddrinfo = socket.getaddrinfo
+
+        def slow_getaddrinfo(host, *args):
+            if host == "slow-dns.test":
+                time.sleep(2)
+                host = "127.0.0.1"
+            return getaddrinfo(host, *args)
+
+        self.website.url = self.website.url.replace("127.0.0.1", "slow-dns.test")
+        with mock.patch("socket.getaddrinfo", slow_getaddrinfo):
+            self.assertTimeout()
+
+    def test_complete_content(self):
+        self.website.url = self.website.url.replace("/slow", "/")
+        self.monitor.check()
+
+        check = self.last_check()
+        self.assertEqual(check.outcome, Check.OK)
+        self.assertEqual(check.status_code, 200)
+        self.assertEqual(self.monitor.get_availability(2), 100)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.website.delete_instance()
+
+
+if __name__ == '__main__':
+    unittest.main()
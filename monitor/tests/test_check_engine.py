@@ -0,0 +1,145 @@
+import threading
+import unittest
+from time import sleep, time
+
+from monitor.check_engine import CheckEngine
+from monitor.scheduler import phase_offset
+
+
+class FakeWebsite():
+    def __init__(self, check_interval, id):
+        self.check_interval = check_interval
+        self.id = id
+
+
+class FakeMonitor():
+    """Count its checks, and how many checks (of all the fake monitors) are running at the same time"""
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def __init__(self, check_interval=1, duration=0.3, id=1):
+        self.website = FakeWebsite(check_interval, id)
+        self.duration = duration
+        self.nb_checks = 0
+        self.check_times = []
+        self.nb_overruns = 0
+        self.overrun_threads = set()
+
+    def check(self):
+        self.check_times.append(time())
+        with FakeMonitor.lock:
+            FakeMonitor.running += 1
+            FakeMonitor.max_running = max(FakeMonitor.max_running, FakeMonitor.running)
+        sleep(self.duration)
+        with FakeMonitor.lock:
+            FakeMonitor.running -= 1
+            self.nb_checks += 1
+
+    def record_overrun(self):
+        self.nb_overruns += 1
+        self.overrun_threads.add(threading.current_thread().name)
+
+
+def wait_for(condition, timeout=10):
+    """Wait until the condition is true, at most timeout seconds (a loaded machine runs the checks late)"""
+    end = time() + timeout
+    while not condition() and time() < end:
+        sleep(0.01)
+
+
+class CheckEngineTest(unittest.TestCase):
+    """Test case on the scheduling of the checks by the asyncio engine
+
+    The engine runs in real time: the tests only check the order of the events and lower bounds on the delays,
+    the exact deadlines and lags are tested through the Scheduler (see test_scheduler)
+    """
+
+    def setUp(self):
+        FakeMonitor.running = 0
+        FakeMonitor.max_running = 0
+
+    def test_checks_every_interval(self):
+        """The checks of a website start at its offset in the interval, then every interval, never earlier"""
+        monitors = [FakeMonitor(id=id) for id in range(1, 4)]
+        engine = CheckEngine(max_concurrency=10)
+        start = time()
+        engine.start(monitors)
+        wait_for(lambda: all(monitor.nb_checks >= 3 for monitor in monitors))
+        engine.stop()
+
+        for monitor in monitors:
+            self.assertGreaterEqual(monitor.nb_checks, 3)
+            for i, check_time in enumerate(monitor.check_times):
+                self.assertGreater(check_time - start, phase_offset(monitor.website.id, 1) + i - 0.01)
+        # Spread over the interval: the first checks in the order of the offsets
+        first_checks = sorted(monitors, key=lambda monitor: monitor.check_times[0])
+        self.assertEqual(first_checks, sorted(monitors, key=lambda monitor: phase_offset(monitor.website.id, 1)))
+
+        stats = engine.get_lag_stats()
+        self.assertGreaterEqual(stats["ticks"], 9)
+        self.assertGreaterEqual(stats["max_lag"], 0)
+
+    def test_concurrency_limit(self):
+        """Ten checks at the same time (the same id, so the same offset) but only two slots:
+        they never run more than two by two
+        """
+        monitors = [FakeMonitor(duration=0.1) for _ in range(10)]
+        engine = CheckEngine(max_concurrency=2)
+        engine.start(monitors)
+        wait_for(lambda: sum(monitor.nb_checks for monitor in monitors) >= 10)
+        engine.stop()
+
+        self.assertEqual(FakeMonitor.max_running, 2)
+        self.assertEqual(sum(monitor.nb_checks for monitor in monitors), 10)
+        # The last two waited for the four pairs before them
+        self.assertGreaterEqual(engine.get_lag_stats()["max_lag"], 0.35)
+
+    def test_skip_in_flight(self):
+        """A check longer than the interval: the next ones are skipped, never run at the same time"""
+        monitor = FakeMonitor(check_interval=0.2, duration=0.5)
+        engine = CheckEngine()
+        engine.start([monitor])
+        wait_for(lambda: monitor.nb_checks >= 3)
+        engine.stop()
+
+        self.assertEqual(FakeMonitor.max_running, 1)
+        for previous, check_time in zip(monitor.check_times, monitor.check_times[1:]):
+            self.assertGreaterEqual(check_time - previous, 0.5)
+        # The deadlines during a check are overruns, and skipped
+        self.assertGreaterEqual(monitor.nb_overruns, 1)
+        self.assertGreaterEqual(engine.get_lag_stats()["skipped_ticks"], monitor.nb_overruns)
+        # Not in the thread of the event loop
+        self.assertNotIn("check-engine", monitor.overrun_threads)
+
+    def test_late_loop(self):
+        """The deadlines missed while the event loop is blocked are skipped, but they are not overruns:
+        no check was running
+        """
+        monitor = FakeMonitor(check_interval=0.1, duration=0)
+        engine = CheckEngine()
+        engine.start([monitor])
+        # Blocked before the first deadline (at 0.05)
+        engine.loop.call_soon_threadsafe(sleep, 0.6)
+        wait_for(lambda: monitor.nb_checks >= 2)
+        engine.stop()
+
+        self.assertGreaterEqual(engine.get_lag_stats()["skipped_ticks"], 3)
+        self.assertEqual(monitor.nb_overruns, 0)
+
+    def test_stop_and_restart(self):
+        monitor = FakeMonitor()
+        engine = CheckEngine()
+        engine.start([monitor])
+        engine.stop()
+        self.assertFalse(engine.is_running)
+
+        engine.start([monitor])
+        wait_for(lambda: monitor.nb_checks >= 1)
+        engine.stop()
+        self.assertEqual(monitor.nb_checks, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import socket
+import threading
+import unittest
+
+from monitor.models import Website, Check
+from monitor.website_monitor import WebsiteMonitor
+from monitor.monitor import db_init
+from monitor.http_pool import SessionPool
+
+
+class DumbController():
+    def __init__(self):
+        self.alerts = []
+
+    def update_alert_history(self, alert):
+        self.alerts.append(alert)
+
+
+class ClosingServer:
+    """Accept the connections and close them at once, with a reset (no response, or only the answer bytes)"""
+
+    def __init__(self, answer=b""):
+        self.answer = answer
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            connection.recv(1024)
+            connection.sendall(self.answer)
+            # RST instead of FIN
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\1\0\0\0\0\0\0\0")
+            connection.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class CheckFailuresTest(unittest.TestCase):
+    """Test case on the checks without response: saved with their failure, and unavailable"""
+
+    def setUp(self):
+        db_init()
+        self.server = ClosingServer()
+        # Not TLS
+        self.plain_server = ClosingServer(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+        self.controller = DumbController()
+        self.website = Website.create(url="http://localhost/", check_interval=2)
+        self.monitor = WebsiteMonitor(self.website, self.controller, session_pool=SessionPool())
+
+    def check(self, url):
+        self.website.url = url
+        self.monitor.check()
+        return Check.select().where(Check.website == self.website).order_by(Check.id.desc()).get()
+
+    def test_outcomes(self):
+        for url, outcome in (("http://nonexistent-host.invalid/", Check.DNS_ERROR),
+                             ("http://127.0.0.1:1/", Check.CONNECT_ERROR),
+                             ("http://127.0.0.1:%d/" % self.server.port, Check.RESET),
+                             ("https://127.0.0.1:%d/" % self.plain_server.port, Check.TLS_ERROR)):
+            check = self.check(url)
+            self.assertEqual(check.outcome, outcome, url)
+            self.assertEqual(check.status_code, 0)
+
+        stats = self.monitor.get_stats(2)
+        self.assertEqual(stats["availability"], 0)
+        self.assertEqual(stats["failures"], {"dns": 1, "connect": 1, "reset": 1, "tls": 1})
+        self.assertIsNone(stats["avg_full_rt"])
+
+    def test_alert(self):
+        """A website that does not answer at all is down"""
+        self.check("http://127.0.0.1:1/")
+        self.assertTrue(self.monitor.on_alert)
+        self.assertEqual(len(self.controller.alerts), 1)
+        self.assertEqual(self.controller.alerts[0].availability, 0)
+
+    def tearDown(self):
+        self.server.close()
+        self.plain_server.close()
+        self.website.delete_instance()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import time
+import unittest
+from time import sleep
+from unittest import mock
+
+from peewee import OperationalError
+
+from monitor.models import db, Website, Check
+from monitor.check_writer import CheckWriter
+from monitor.storage import StorageProfile
+from monitor.monitor import db_init
+
+
+class FakeMonitor():
+    pass
+
+
+class CheckWriterTest(unittest.TestCase):
+    """Test case on the batched saving of the checks"""
+
+    def setUp(self):
+        db_init()
+        self.website = Website.create(url="http://localhost/", check_interval=3)
+        self.monitor = FakeMonitor()
+
+    def row(self):
+        return {"website": self.website, "date": time.time(), "full_resp_time": 0.2, "resp_time": 0.1,
+                "status_code": 200}
+
+    def nb_checks(self):
+        return Check.select().where(Check.website == self.website).count()
+
+    def test_stop_saves_everything(self):
+        writer = CheckWriter(batch_size=1000, flush_interval=60)
+        writer.start()
+        for _ in range(250):
+            writer.put(self.monitor, self.row())
+        writer.stop()
+
+        self.assertEqual(self.nb_checks(), 250)
+
+    def test_flush_on_size(self):
+        writer = CheckWriter(batch_size=10, flush_interval=60)
+        writer.start()
+        for _ in range(25):
+            writer.put(self.monitor, self.row())
+        sleep(0.5)
+
+        self.assertEqual(self.nb_checks(), 20)
+        writer.stop()
+        self.assertEqual(self.nb_checks(), 25)
+
+    def test_flush_on_time(self):
+        writer = CheckWriter(batch_size=1000, flush_interval=0.2)
+        writer.start()
+        writer.put(self.monitor, self.row())
+        sleep(0.6)
+
+        self.assertEqual(self.nb_checks(), 1)
+        writer.stop()
+
+    def test_deleted_website(self):
+        """The checks of a deleted website are dropped, not the others of the batch"""
+        deleted = Website.create(url="http://deleted/", check_interval=3)
+        deleted_row = dict(self.row(), website=deleted.id)
+        deleted.delete_instance()
+
+        writer = CheckWriter()
+        writer.start()
+        writer.put(self.monitor, self.row())
+        writer.put(self.monitor, deleted_row)
+        writer.stop()
+
+        self.assertEqual(self.nb_checks(), 1)
+
+    def test_failed_flush(self):
+        """A batch that cannot be saved is tried again, then dropped: the writer goes on with the next ones"""
+        writer = CheckWriter(batch_size=5, flush_interval=60)
+        writer.RETRY_DELAY = 0
+        writer.start()
+        with mock.patch("monitor.check_writer.save_checks", side_effect=OperationalError("database is locked")), \
+                self.assertLogs("monitor.check_writer", "ERROR"):
+            for _ in range(5):
+                writer.put(self.monitor, self.row())
+            sleep(0.3)
+        self.assertEqual(writer.dropped, 5)
+
+        for _ in range(5):
+            writer.put(self.monitor, self.row())
+        writer.stop()
+        self.assertEqual(self.nb_checks(), 5)
+
+    def test_retried_flush(self):
+        writer = CheckWriter()
+        writer.RETRY_DELAY = 0
+        with mock.patch("monitor.check_writer.db.atomic", side_effect=[OperationalError("disk I/O error"),
+                                                                     db.atomic()]), \
+                self.assertLogs("monitor.check_writer", "WARNING"):
+            writer.flush([(self.monitor, self.row())])
+        self.assertEqual(self.nb_checks(), 1)
+        self.assertEqual(writer.dropped, 0)
+
+    def test_full_queue(self):
+        writer = CheckWriter(max_queued=2)
+        for _ in range(3):
+            writer.put(self.monitor, self.row())
+        self.assertEqual(writer.dropped, 1)
+        writer.start()
+        writer.stop()
+        self.assertEqual(self.nb_checks(), 2)
+
+    def test_checkpoints(self):
+        """The WAL is checkpointed at the interval of the profile, and emptied when the writer stops"""
+        with mock.patch("monitor.storage.profile", StorageProfile(checkpoint_interval=0.2)), \
+                mock.patch("monitor.storage.checkpoint") as checkpoint:
+            writer = CheckWriter(batch_size=1000, flush_interval=0.1)
+            writer.start()
+            writer.put(self.monitor, self.row())
+            sleep(0.5)
+            self.assertIn(mock.call("PASSIVE"), checkpoint.call_args_list)
+            writer.stop()
+            self.assertEqual(checkpoint.call_args, mock.call("TRUNCATE"))
+
+        writer = CheckWriter()
+        writer.start()
+        writer.put(self.monitor, self.row())
+        writer.stop()
+        self.assertEqual(os.path.getsize(db.database + "-wal"), 0)
+
+    def tearDown(self):
+        self.website.delete_instance()
+
+
+if __name__ == '__main__':
+    unittest.main()
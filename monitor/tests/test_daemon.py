@@ -0,0 +1,89 @@
+import subprocess
+import sys
+import unittest
+
+import requests
+
+from monitor.aggregator import RollingWindow
+from monitor.daemon import MetricsServer, format_metrics
+from monitor.models import Website
+
+
+class FakeMonitor:
+
+    def __init__(self, website_id, url, on_alert=False):
+        self.website = Website(id=website_id, url=url)
+        self.window = RollingWindow()
+        self.on_alert = on_alert
+
+
+class MetricsTest(unittest.TestCase):
+    """Test case on the metrics of the headless mode"""
+
+    def setUp(self):
+        self.now = 1000000
+        self.up = FakeMonitor(1, "http://up.com/")
+        for i in range(4):
+            self.up.window.add(self.now - i * 10, 0.3, 0.1, 200, (0.01, 0.02, 0, 0.07, 0.2))
+        self.down = FakeMonitor(2, 'http://down.com/"quoted"', on_alert=True)
+        self.down.window.add(self.now - 10, 0.3, 0.1, 500)
+        self.down.window.add(self.now - 20, 0.8, 0, 0, outcome="timeout")
+
+    def test_format(self):
+        metrics = format_metrics([self.up, self.down], 10, self.now,
+                                 {"ticks": 6, "skipped_ticks": 1, "avg_lag": 0.002, "max_lag": 0.01,
+                                  "last_lag": 0.001})
+        lines = metrics.splitlines()
+
+        self.assertIn('webmo_alert{website_id="1",url="http://up.com/"} 0', lines)
+        self.assertIn('webmo_alert{website_id="2",url="http://down.com/\\"quoted\\""} 1', lines)
+        self.assertIn('webmo_availability_ratio{website_id="1",url="http://up.com/"} 1.0', lines)
+        self.assertIn('webmo_checks{code="0",website_id="2",url="http://down.com/\\"quoted\\""} 1', lines)
+        self.assertIn('webmo_failures{outcome="timeout",website_id="2",url="http://down.com/\\"quoted\\""} 1',
+                      lines)
+        self.assertIn('webmo_response_time_seconds_count{website_id="1",url="http://up.com/"} 4', lines)
+        self.assertIn("webmo_check_skipped_ticks_total 1", lines)
+        # One HELP and TYPE per metric, before its samples
+        self.assertEqual(lines.count("# TYPE webmo_response_time_seconds summary"), 1)
+        self.assertLess(lines.index("# TYPE webmo_alert gauge"), lines.index('webmo_alert{website_id="1",'
+                                                                             'url="http://up.com/"} 0'))
+        quantile = [line for line in lines if line.startswith('webmo_response_time_seconds{quantile="0.5"')]
+        self.assertEqual(len(quantile), 2)
+        self.assertAlmostEqual(float(quantile[0].split()[-1]), 0.1, delta=0.001)
+
+    def test_raw_stats(self):
+        """The quantiles are the exact ones of the raw stats when they are given"""
+        raw_stats = {1: {"p50_rt": 0.125, "p95_rt": 0.25, "p99_rt": 0.5, "p50_full_rt": 1.0, "p95_full_rt": 2.0,
+                         "p99_full_rt": 3.0}}
+        lines = format_metrics([self.up], 10, self.now, websites_stats=raw_stats).splitlines()
+        self.assertIn('webmo_response_time_seconds{quantile="0.5",website_id="1",url="http://up.com/"} 0.125', lines)
+        self.assertIn('webmo_full_response_time_seconds{quantile="0.99",website_id="1",url="http://up.com/"} 3.0',
+                      lines)
+
+    def test_no_checks(self):
+        """The stats without value are left out"""
+        metrics = format_metrics([FakeMonitor(3, "http://new.com/")], 10, self.now)
+        self.assertNotIn("webmo_availability_ratio{", metrics)
+        self.assertNotIn("quantile", metrics)
+        self.assertIn('webmo_response_time_seconds_count{website_id="3",url="http://new.com/"} 0', metrics)
+
+    def test_server(self):
+        server = MetricsServer(("127.0.0.1", 0), lambda: format_metrics([self.up], 10, self.now))
+        server.start()
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            response = requests.get(url + "/metrics")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+            self.assertIn("webmo_alert", response.text)
+            self.assertEqual(requests.get(url + "/").status_code, 404)
+        finally:
+            server.stop()
+
+    def test_no_urwid(self):
+        code = "import sys, monitor.daemon; sys.exit('urwid' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", code]).returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
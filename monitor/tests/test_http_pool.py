@@ -0,0 +1,36 @@
+import unittest
+
+from monitor.http_pool import SessionPool, get_origin
+
+
+class SessionPoolTest(unittest.TestCase):
+    """Test case on the keep-alive sessions shared by the monitors"""
+
+    def test_origin(self):
+        self.assertEqual(get_origin("https://www.google.fr/search"), "https://www.google.fr:443")
+        self.assertEqual(get_origin("http://localhost:8080/"), "http://localhost:8080")
+
+    def test_same_origin_same_session(self):
+        pool = SessionPool()
+        self.assertIs(pool.get("https://www.google.fr/a"), pool.get("https://www.google.fr:443/b"))
+        self.assertIsNot(pool.get("https://www.google.fr/"), pool.get("http://www.google.fr/"))
+        self.assertEqual(len(pool), 2)
+
+    def test_least_recently_used_evicted(self):
+        pool = SessionPool(max_origins=2)
+        first = pool.get("http://a.com/")
+        pool.get("http://b.com/")
+        pool.get("http://a.com/")  # a.com is now the most recently used
+        pool.get("http://c.com/")
+
+        self.assertEqual(len(pool), 2)
+        self.assertIs(pool.get("http://a.com/"), first)
+
+    def test_host_pool_sizes(self):
+        pool = SessionPool(pool_size=2, host_pool_sizes={"big.com": 10})
+        self.assertEqual(pool.get_pool_size("https://big.com/"), 10)
+        self.assertEqual(pool.get_pool_size("https://small.com/"), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from monitor.instrumentation import Histogram, Instruments
+
+
+class HistogramTest(unittest.TestCase):
+    """Test case on the histograms of the instruments"""
+
+    def test_stats(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.get_stats()["count"], 0)
+        self.assertIsNone(histogram.get_stats()["p50"])
+
+        for i in range(1, 101):
+            histogram.observe(i / 1000)
+        stats = histogram.get_stats()
+        self.assertEqual(stats["count"], 100)
+        self.assertAlmostEqual(stats["avg"], 0.0505)
+        self.assertAlmostEqual(stats["max"], 0.1)
+        # Within 1%
+        self.assertAlmostEqual(stats["p50"], 0.051, delta=0.0006)
+        self.assertAlmostEqual(stats["p99"], 0.099, delta=0.001)
+
+    def test_time(self):
+        histogram = Histogram()
+        with histogram.time():
+            time.sleep(0.01)
+        self.assertEqual(histogram.count, 1)
+        self.assertGreaterEqual(histogram.max, 0.01)
+
+    def test_state(self):
+        """A histogram sent by a shard is merged with the local one"""
+        local, remote = Histogram(), Histogram()
+        local.observe(0.1)
+        remote.observe(0.3)
+        remote.observe(0.5)
+
+        local.merge(Histogram.from_state(remote.to_state()))
+        stats = local.get_stats()
+        self.assertEqual(stats["count"], 3)
+        self.assertAlmostEqual(stats["sum"], 0.9)
+        self.assertAlmostEqual(stats["max"], 0.5)
+
+
+class InstrumentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.instruments = Instruments()
+        self.instruments.histogram("db_seconds", "Database").observe(0.02)
+        self.instruments.gauge("queue_depth", lambda: 3, "Queue")
+
+    def test_get_stats(self):
+        self.assertIs(self.instruments.histogram("db_seconds"), self.instruments.histogram("db_seconds"))
+
+        remote = Histogram()
+        remote.observe(0.04)
+        self.instruments.sources["shards"] = lambda: {"db_seconds": remote, "probe_seconds": remote}
+        self.instruments.gauge("stopped", lambda: 1 / 0)
+
+        stats = self.instruments.get_stats()
+        self.assertEqual(stats["histograms"]["db_seconds"]["count"], 2)
+        self.assertEqual(stats["histograms"]["probe_seconds"]["count"], 1)
+        self.assertEqual(stats["gauges"], {"queue_depth": 3, "stopped": None})
+        # The local histogram is not changed by the merge
+        self.assertEqual(self.instruments.histograms["db_seconds"].count, 1)
+
+    def test_reset(self):
+        histogram = self.instruments.histogram("db_seconds")
+        self.instruments.reset()
+        self.assertIs(self.instruments.histogram("db_seconds"), histogram)
+        self.assertEqual(histogram.get_stats()["count"], 0)
+        self.assertEqual(histogram.max, 0)
+
+    def test_prometheus(self):
+        lines = self.instruments.to_prometheus().splitlines()
+        self.assertIn("# HELP webmo_db_seconds Database", lines)
+        self.assertIn("# TYPE webmo_db_seconds summary", lines)
+        self.assertIn("webmo_db_seconds_count 1", lines)
+        self.assertIn("# TYPE webmo_queue_depth gauge", lines)
+        self.assertIn("webmo_queue_depth 3", lines)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "instruments.json")
+            self.instruments.export(path)
+            with open(path) as file:
+                exported = json.load(file)
+        self.assertEqual(exported["gauges"], {"queue_depth": 3})
+        self.assertEqual(exported["histograms"]["db_seconds"]["count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+from monitor.models import db, Website, Check, MinuteRollup
+from monitor.check_writer import CheckWriter
+from monitor.migrations import migrate_schema, get_schema_version, SCHEMA_VERSION, MIGRATIONS, add_rollup_sketches
+from monitor.monitor import db_init
+
+# The schema of the first version of the program
+FIRST_SCHEMA = [
+    'CREATE TABLE "website" ("id" INTEGER NOT NULL PRIMARY KEY, "url" VARCHAR(255) NOT NULL, '
+    '"check_interval" INTEGER NOT NULL, "display" INTEGER NOT NULL)',
+    'CREATE TABLE "check" ("id" INTEGER NOT NULL PRIMARY KEY, "website_id" INTEGER NOT NULL, '
+    '"date" INTEGER NOT NULL, "full_resp_time" REAL NOT NULL, "resp_time" REAL NOT NULL, '
+    '"status_code" SMALLINT NOT NULL, FOREIGN KEY ("website_id") REFERENCES "website" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX "check_website_id" ON "check" ("website_id")',
+    'CREATE TABLE "alert" ("id" INTEGER NOT NULL PRIMARY KEY, "website_id" INTEGER NOT NULL, '
+    '"date" INTEGER NOT NULL, "availability" SMALLINT NOT NULL, '
+    'FOREIGN KEY ("website_id") REFERENCES "website" ("id") ON DELETE CASCADE)',
+    'CREATE INDEX "alert_website_id" ON "alert" ("website_id")',
+]
+
+
+class MigrationsTest(unittest.TestCase):
+    """Test case on the upgrade of the schema of an existing database file"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db.init(self.path)
+
+    def index_names(self, table):
+        return {index.name for index in db.get_indexes(table)}
+
+    def test_upgrade_first_schema(self):
+        for sql in FIRST_SCHEMA:
+            db.execute_sql(sql)
+        db.execute_sql('INSERT INTO "website" VALUES (1, "http://localhost/", 10, 1)')
+        db.execute_sql('INSERT INTO "check" VALUES (1, 1, 1000, 0.2, 0.1, 200)')
+
+        db_init()
+
+        self.assertEqual(get_schema_version(), SCHEMA_VERSION)
+        self.assertIn("check_website_id_date", self.index_names("check"))
+        self.assertNotIn("check_website_id", self.index_names("check"))
+        self.assertIn("alert_website_id_date", self.index_names("alert"))
+
+        # The existing rows have the default values of the new columns
+        self.assertEqual(Website.get_by_id(1).timing, Website.COLD)
+        self.assertEqual(Check.get_by_id(1).dns_time, 0)
+
+        # The stats use the index
+        plan = db.execute_sql('EXPLAIN QUERY PLAN SELECT COUNT(*) FROM "check" WHERE website_id = 1 AND date >= 0')
+        self.assertIn("check_website_id_date", " ".join(str(row) for row in plan))
+
+    def test_new_database(self):
+        db_init()
+        self.assertEqual(get_schema_version(), SCHEMA_VERSION)
+        self.assertEqual(self.index_names("check"), {"check_website_id_date"})
+        # Nothing more to apply
+        self.assertEqual(migrate_schema(), [])
+
+    def test_rollup_sketches(self):
+        """The sketches of the rollups saved before them are computed from the checks"""
+        db_init()
+        website = Website.create(url="http://localhost/")
+        CheckWriter().flush([(None, {"website": website, "date": 1000 + i, "full_resp_time": 0.2 + i / 100,
+                                     "resp_time": 0.1, "status_code": 200}) for i in range(100)])
+        MinuteRollup.update(rt_sketch=None, full_rt_sketch=None).execute()
+        db.pragma("user_version", MIGRATIONS.index(add_rollup_sketches))
+
+        self.assertEqual(migrate_schema()[0], "add_rollup_sketches")
+        rollup = MinuteRollup.select().order_by(MinuteRollup.date).first()
+        self.assertIsNotNone(rollup.full_rt_sketch)
+
+    def tearDown(self):
+        db.close()
+        db.init(self.database)
+        os.remove(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,51 +1,48 @@
 import unittest
-from time import sleep
 
 from monitor.models import Website
-from monitor.website_monitor import WebsiteMonitor
 from monitor.monitor import db_init
-
-
-class DumbController():
-    """Necessary for the availability tests"""
-    def update_alert_history(self):
-        pass
+from monitor.simulation import Simulation, SiteModel
 
 
 class MonitoringTest(unittest.TestCase):
     """Test case on functions concerning the monitoring of websites
 
-    Problem: launch the test with "python3 -m unittest" in the website_monitor directory
-    But it creates tge db inside this directory, while the real db is located at the root of the project
+    The checks are simulated (see monitor.simulation): the website answers what its SiteModel says,
+    and the clock of the monitor jumps from one check to the next instead of waiting for them
     """
 
     def setUp(self):
-        """Save a website in the db for the cuurent test and instantiate a monitor
+        """Save a website in the db for the current test and instantiate a simulated monitor
         Executed before each test method
         """
 
         # As it is not the real db, it has to be initiated
         db_init()
-        # Urls that will imitate a problem with the server
-        self.available_url = "https://www.google.fr"
-        self.down_url = "https://www.google.fr/dsf,sdkflj"
+        # Models that will imitate a problem with the server
+        self.available = SiteModel(status_code=200)
+        self.down = SiteModel(status_code=404)
 
         self.website = Website()
-        self.website.url = self.available_url
+        self.website.url = "https://www.google.fr"
         self.website.check_interval = 3
         self.website.save()
 
-        self.monitor = WebsiteMonitor(self.website, DumbController())
+        self.simulation = Simulation([self.website], {self.website.id: self.available})
+        self.monitor = self.simulation.monitors[0]
+
+    def run_checks(self, model, nb_checks):
+        """Simulate {nb_checks} checks of the website answering like the model"""
+        self.simulation.models[self.website.id] = model
+        report = self.simulation.run(nb_checks * self.website.check_interval)
+        self.assertEqual(report["checks"], nb_checks)
 
     def test_url(self):
         """Dumb test"""
         self.assertEqual(self.website.url, "https://www.google.fr")
 
     def test_success_availability(self):
-        """If this one does not work, change for a website that is not down and is fast"""
-        self.monitor.run()
-        sleep(self.website.check_interval + 1)
-        self.monitor.stop()
+        self.run_checks(self.available, 1)
 
         # As the current website instance is always deleted in tearDown, it should be equal to 0 or 100
         self.assertEqual(self.monitor.get_availability(2), 100)
@@ -54,25 +51,19 @@ class MonitoringTest(unittest.TestCase):
         """Test if an alert has been triggerd after that the server shut down
 
         Do one check on a server that is not down (the availability is then set to 100%.
-        Then one check on a server that is down. To imitate that we just change the website url to one
-        that will respond nothing or an error
+        Then one check on a server that is down.
         Check if the availability goes below 80% (50%)
         """
 
-        self.monitor.run()
-        sleep(self.website.check_interval + 1)
-        self.monitor.stop()
-
-        self.website.url = self.down_url
-        self.monitor.run()
-        sleep(self.website.check_interval + 1)
-        self.monitor.stop()
+        self.run_checks(self.available, 1)
+        self.run_checks(self.down, 1)
 
         # If the alert has been triggered, it is the only one in the db for the current website
         down_alert = self.monitor.get_last_alert()
 
         self.assertIsNotNone(down_alert)
         self.assertTrue(down_alert.availability < 80)
+        self.assertEqual(self.simulation.alerts, [down_alert])
 
     def test_resumed_alert(self):
         """Going to cross the threshold of 80% slowly
@@ -82,25 +73,18 @@ class MonitoringTest(unittest.TestCase):
         100*a/(d+a) >= 80 <=> a >= 4*d
         So we need 4 times more a thant d to have an availability superior or equal to 80%
         """
-        self.monitor.run()
-        sleep(self.website.check_interval + 1)
-        self.monitor.stop()
-
-        self.website.url = self.down_url
-        self.monitor.run()
-        sleep(2*self.website.check_interval + 1)
-        self.monitor.stop()
+        self.run_checks(self.available, 1)
+        self.run_checks(self.down, 2)
 
         # Try with 7 more available checks
-        self.website.url = self.available_url
-        self.monitor.run()
-        sleep(7*self.website.check_interval + 1)
-        self.monitor.stop()
+        self.run_checks(self.available, 7)
 
         # Normally the last alert that has been triggered is to alert that the server has resumed
         resumed_alert = self.monitor.get_last_alert()
         self.assertIsNotNone(resumed_alert)
         self.assertTrue(resumed_alert.availability >= 80)
+        # Down at the first check of the down server, then resumed
+        self.assertEqual(len(self.simulation.alerts), 2)
 
     def tearDown(self):
         """Delete the test website from the db
@@ -0,0 +1,126 @@
+import socket
+import threading
+import unittest
+from time import sleep
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from monitor.models import Website, Check
+from monitor.website_monitor import WebsiteMonitor
+from monitor.monitor import db_init
+from monitor.http_pool import SessionPool
+from monitor.phase_timing import resolve, DNS_LOOKUP_WORKERS
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    """Answer 200 with a small content, on a kept alive connection"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        content = b"ok" * 512
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class DumbController():
+    def update_alert_history(self, alert):
+        pass
+
+
+class PhaseTimingTest(unittest.TestCase):
+    """Test case on the phases breakdown of the checks, on a local server"""
+
+    def setUp(self):
+        db_init()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.website = Website()
+        self.website.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+        self.website.check_interval = 3
+        self.website.save()
+
+        self.monitor = WebsiteMonitor(self.website, DumbController(), session_pool=SessionPool())
+
+    def last_check(self):
+        return Check.select().where(Check.website == self.website).order_by(Check.id.desc()).get()
+
+    def test_cold_timing_opens_a_connection(self):
+        self.monitor.check()
+        self.monitor.check()
+        check = self.last_check()
+
+        self.assertEqual(check.status_code, 200)
+        self.assertGreater(check.connect_time, 0)
+        self.assertEqual(check.tls_time, 0)
+        self.assertAlmostEqual(check.dns_time + check.connect_time + check.ttfb_time, check.resp_time, places=6)
+
+    def test_warm_timing_reuses_the_connection(self):
+        self.website.timing = Website.WARM
+        self.monitor.check()
+        self.assertGreater(self.last_check().connect_time, 0)
+
+        self.monitor.check()
+        check = self.last_check()
+        self.assertEqual(check.dns_time, 0)
+        self.assertEqual(check.connect_time, 0)
+        self.assertGreater(check.ttfb_time, 0)
+
+    def test_next_address(self):
+        """The connection falls back on the next resolved address when the first one refuses it
+        (the server only listens on 127.0.0.1)
+        """
+        self.website.url = "http://dual-stack.test:%d/" % self.server.server_address[1]
+        with mock.patch("monitor.phase_timing.resolve", return_value=["127.0.0.2", "127.0.0.1"]):
+            self.monitor.check()
+
+        check = self.last_check()
+        self.assertEqual(check.outcome, Check.OK)
+        self.assertEqual(check.status_code, 200)
+
+    def test_stalled_resolver(self):
+        """The lookups abandoned at the deadline never take more than the threads of the lookups,
+        the next ones then fail at once
+        """
+        getaddrinfo = socket.getaddrinfo
+        answer = threading.Event()
+
+        def stalled_getaddrinfo(host, *args):
+            if host == "stalled.test":
+                answer.wait(10)
+            return getaddrinfo(host, *args)
+
+        failures = []
+        with mock.patch("socket.getaddrinfo", stalled_getaddrinfo):
+            try:
+                for _ in range(DNS_LOOKUP_WORKERS + 10):
+                    try:
+                        resolve("stalled.test", 80, timeout=0.01)
+                    except (socket.timeout, socket.gaierror) as e:
+                        failures.append(type(e))
+                nb_threads = len([thread for thread in threading.enumerate()
+                                  if thread.name.startswith("dns-lookup")])
+            finally:
+                answer.set()
+
+        self.assertLessEqual(nb_threads, DNS_LOOKUP_WORKERS)
+        self.assertEqual(failures.count(socket.timeout), DNS_LOOKUP_WORKERS)
+        self.assertEqual(failures.count(socket.gaierror), 10)
+
+        # The threads are free again once the resolver answers
+        sleep(0.2)
+        self.assertTrue(resolve("localhost", 80, timeout=1))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.website.delete_instance()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from monitor.models import db, Website, Check, MinuteRollup, HourRollup
+from monitor.monitor import db_init
+from monitor.check_writer import CheckWriter
+from monitor.clock import VirtualClock
+from monitor.rollups import get_history_aggregate
+from monitor.retention import RetentionJob, DAY, delete_in_batches
+from monitor.storage import checkpoint
+
+
+class StopAfter:
+    """A stop event that is set after {batches} batches"""
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def is_set(self):
+        self.batches -= 1
+        return self.batches < 0
+
+
+class RetentionTest(unittest.TestCase):
+    """Test case on the deletion of the old checks"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "webmo.db")
+        db.init(self.path)
+        db_init()
+
+        self.now = 1000000 * 3600
+        self.default_website = Website.create(url="http://default/", check_interval=60)
+        self.short_website = Website.create(url="http://short/", check_interval=60, retention_days=2)
+        # 10 days of checks, every 5 minutes
+        writer = CheckWriter()
+        for website in (self.default_website, self.short_website):
+            writer.flush([(None, {"website": website, "date": date, "full_resp_time": 0.2, "resp_time": 0.1,
+                                  "status_code": 200})
+                          for date in range(self.now - 10 * DAY, self.now, 300)])
+        self.job = RetentionJob(retention_days=5, minute_rollups_days=7, batch_size=100, clock=VirtualClock(self.now))
+
+    def nb_checks(self, website, days):
+        return Check.select().where(Check.website == website, Check.date >= self.now - days * DAY).count()
+
+    def test_run(self):
+        # The checks are in the database file, not in the WAL
+        checkpoint("TRUNCATE")
+        size = os.path.getsize(self.path)
+        report = self.job.run()
+
+        self.assertEqual(self.nb_checks(self.default_website, 10), 5 * 288)
+        self.assertEqual(self.nb_checks(self.default_website, 5), 5 * 288)
+        self.assertEqual(self.nb_checks(self.short_website, 10), 2 * 288)
+        self.assertEqual(report["checks"], 5 * 288 + 8 * 288)
+        self.assertEqual(report["minute_rollups"], 2 * 3 * 288)
+        self.assertEqual(MinuteRollup.select().count(), 2 * 7 * 288)
+        self.assertGreaterEqual(report["duration"], 0)
+
+        # The older stats come from the hour rollups
+        self.assertEqual(HourRollup.select().count(), 2 * 10 * 24)
+        self.assertEqual(get_history_aggregate(self.short_website, self.now - 10 * DAY).count, 10 * 288)
+
+        # The space is given back to the file system
+        self.assertGreater(report["pages"], 0)
+        self.assertEqual(report["bytes"], report["pages"] * db.pragma("page_size"))
+        checkpoint("TRUNCATE")
+        self.assertLess(os.path.getsize(self.path), size)
+
+        # Nothing more to delete
+        report = self.job.run()
+        self.assertEqual((report["checks"], report["minute_rollups"]), (0, 0))
+
+    def test_thread(self):
+        reports = []
+        done = threading.Event()
+        self.job.on_report = lambda report: (reports.append(report), done.set())
+        self.job.start(first_run_delay=0)
+        done.wait(10)
+        self.job.stop()
+
+        self.assertEqual(reports[0]["checks"], 5 * 288 + 8 * 288)
+        self.assertIs(self.job.last_report, reports[0])
+
+    def test_stop_between_batches(self):
+        """Stopping does not wait for the end of the deletion of the checks of a website"""
+        self.assertEqual(delete_in_batches(Check, Check.website == self.default_website, 100, StopAfter(2)), 200)
+
+        self.job._stop.set()
+        report = self.job.run()
+        self.assertEqual((report["checks"], report["minute_rollups"], report["pages"]), (0, 0, None))
+
+    def tearDown(self):
+        db.close()
+        db.init(self.database)
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
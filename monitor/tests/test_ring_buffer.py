@@ -0,0 +1,53 @@
+import unittest
+
+from monitor.ring_buffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+    """Test case on the fixed size buffers of the last samples of a monitor"""
+
+    def test_keeps_the_last_samples(self):
+        buffer = RingBuffer("d", 4)
+        for i in range(10):
+            buffer.append(i / 10)
+
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(list(buffer), [0.6, 0.7, 0.8, 0.9])
+        self.assertEqual(buffer[0], 0.6)
+        self.assertEqual(buffer[-1], 0.9)
+        self.assertRaises(IndexError, buffer.__getitem__, 4)
+
+    def test_constant_memory(self):
+        buffer = RingBuffer("H", 100)
+        size = buffer._data.buffer_info()
+        for i in range(10000):
+            buffer.append(200 + i % 300)
+
+        self.assertEqual(buffer._data.buffer_info(), size)
+        self.assertEqual(len(buffer), 100)
+
+    def test_views(self):
+        buffer = RingBuffer("H", 5)
+        self.assertEqual(buffer.views(), ())
+        for code in (200, 201, 404):
+            buffer.append(code)
+        self.assertEqual(buffer.to_list(), [200, 201, 404])
+        self.assertEqual(buffer.to_list(2), [201, 404])
+
+        # Wrapping around the end of the buffer: two views
+        for code in (500, 502, 503):
+            buffer.append(code)
+        views = buffer.views()
+        self.assertEqual(len(views), 2)
+        self.assertEqual([code for view in views for code in view], [201, 404, 500, 502, 503])
+        self.assertEqual(buffer.to_list(2), [502, 503])
+        self.assertEqual(buffer.to_list(0), [])
+
+        # The views are not copies: 301 replaces 201, the oldest sample
+        buffer.append(301)
+        self.assertEqual(views[0].tolist(), [301, 404, 500, 502])
+        self.assertEqual(buffer.to_list(), [404, 500, 502, 503, 301])
+
+
+if __name__ == '__main__':
+    unittest.main()
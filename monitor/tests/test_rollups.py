@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import unittest
+
+from peewee import chunked
+
+from monitor.models import db, Website, Check, MinuteRollup, HourRollup
+from monitor.check_writer import CheckWriter
+from monitor.rollups import get_checks_aggregate, get_history_aggregate, get_history_aggregates, backfill_rollups
+from monitor.monitor import db_init
+
+
+class RollupsTest(unittest.TestCase):
+    """Test case on the minute and hour rollups: the stats from the rollups are the same as from the checks"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db.init(self.path)
+        db_init()
+
+        self.website = Website.create(url="http://localhost/", check_interval=10)
+        self.now = 1000000 * 3600 + 1234
+        random.seed(4)
+        # 5 hours of checks, every 7 seconds
+        self.rows = [{"website": self.website, "date": date, "full_resp_time": random.uniform(0.2, 0.4),
+                      "resp_time": random.uniform(0, 0.2), "status_code": random.choice((200, 200, 200, 404, 500)),
+                      "ttfb_time": 0.1} for date in range(self.now - 5 * 3600, self.now, 7)]
+
+    def assertSameStats(self, aggregate, expected):
+        stats, expected = aggregate.get_stats(), expected.get_stats()
+        self.assertEqual(stats["codes_count"], expected["codes_count"])
+        self.assertEqual(stats["availability"], expected["availability"])
+        for name in ("max_rt", "avg_rt", "max_full_rt", "avg_full_rt", "avg_ttfb", "p50_rt", "p99_full_rt"):
+            self.assertAlmostEqual(stats[name], expected[name])
+
+    def test_incremental_rollups(self):
+        writer = CheckWriter(batch_size=100)
+        writer.start()
+        for row in self.rows:
+            writer.put(None, row)
+        writer.stop()
+
+        # 5 hours starting in the middle of an hour
+        self.assertEqual(HourRollup.select().count(), 6)
+        for min_date in (self.now - 4 * 3600 - 1, self.now - 90 * 60 + 17, self.now - 61 * 60):
+            self.assertSameStats(get_history_aggregate(self.website, min_date),
+                                 get_checks_aggregate(self.website, min_date))
+
+    def test_backfill(self):
+        # Save the checks without the rollups
+        with db.atomic():
+            for rows_chunk in chunked(self.rows, 100):
+                Check.insert_many(rows_chunk).execute()
+        self.assertEqual(MinuteRollup.select().count(), 0)
+
+        backfill_rollups()
+
+        # One rollup per minute and per hour
+        self.assertEqual(MinuteRollup.select().count(), len({row["date"] // 60 for row in self.rows}))
+        self.assertEqual(HourRollup.select().count(), 6)
+        min_date = self.now - 3 * 3600 - 31
+        self.assertSameStats(get_history_aggregate(self.website, min_date),
+                             get_checks_aggregate(self.website, min_date))
+
+    def test_several_websites(self):
+        """The stats of several websites in one query are the same as one by one"""
+        other = Website.create(url="http://other/", check_interval=10)
+        rows = self.rows + [dict(row, website=other, status_code=200) for row in self.rows[::3]]
+        with db.atomic():
+            CheckWriter().flush([(None, row) for row in rows])
+
+        min_date = self.now - 2 * 3600 - 42
+        aggregates = get_history_aggregates([self.website, other], min_date)
+        self.assertEqual(set(aggregates), {self.website.id, other.id})
+        self.assertEqual(aggregates[other.id].get_availability(), 100)
+        for website in (self.website, other):
+            self.assertSameStats(aggregates[website.id], get_checks_aggregate(website, min_date))
+
+    def test_failures_and_overruns(self):
+        """The checks without response count for the availability only, the skipped ones are not counted"""
+        rows = self.rows[-600:]
+        rows += [dict(row, status_code=0, outcome=Check.TIMEOUT, full_resp_time=8, resp_time=0) for row in rows[::2]]
+        rows += [dict(row, status_code=0, outcome=Check.OVERRUN, full_resp_time=0, resp_time=0) for row in rows[::3]]
+        with db.atomic():
+            CheckWriter().flush([(None, row) for row in rows])
+
+        min_date = rows[0]["date"] - 1
+        aggregate = get_history_aggregate(self.website, min_date)
+        self.assertSameStats(aggregate, get_checks_aggregate(self.website, min_date))
+        self.assertEqual(aggregate.codes_count[0], len(rows[:600:2]))
+        self.assertLess(aggregate.get_stats()["max_full_rt"], 1)
+
+        # The same from the backfill
+        MinuteRollup.delete().execute()
+        HourRollup.delete().execute()
+        backfill_rollups()
+        self.assertSameStats(get_history_aggregate(self.website, min_date), aggregate)
+
+    def tearDown(self):
+        db.close()
+        db.init(self.database)
+        os.remove(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
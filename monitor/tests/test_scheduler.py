@@ -0,0 +1,89 @@
+import unittest
+
+from monitor.clock import VirtualClock
+from monitor.scheduler import Scheduler, phase_offset
+
+
+class SchedulerTest(unittest.TestCase):
+    """Test case on the deadlines of the periodic jobs"""
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def run_until(self, end, step=0.25):
+        """The (job, deadline) due at each step of time until end"""
+        due = []
+        now = 0
+        while now <= end:
+            due.extend(self.scheduler.pop_due(now))
+            now += step
+        return due
+
+    def test_absolute_deadlines(self):
+        self.scheduler.add("a", 2, 0, key=1)
+        self.scheduler.add("b", 3, 0, key=2)
+
+        due = self.run_until(12)
+        for job, interval, key in (("a", 2, 1), ("b", 3, 2)):
+            deadlines = [deadline for name, deadline, _ in due if name == job]
+            offset = phase_offset(key, interval)
+            self.assertEqual(deadlines, [offset + i * interval for i in range(len(deadlines))])
+            self.assertEqual(len(deadlines), len(range(int(12 - offset) // interval + 1)))
+
+    def test_spread(self):
+        """The jobs of the same interval are spread over it, the same way at each start"""
+        for key in range(1000):
+            self.scheduler.add(key, 10, 0)
+            self.assertEqual(phase_offset(key, 10), phase_offset(key, 10))
+
+        slots = [0] * 10
+        for _, deadline, _ in self.scheduler.pop_due(10):
+            slots[int(deadline)] += 1
+        self.assertEqual(sum(slots), 1000)
+        for nb in slots:
+            self.assertTrue(50 < nb < 150)
+
+    def test_skipped(self):
+        """A late job is run once, and its next deadline stays on the schedule"""
+        self.scheduler.add("a", 1, 0, key=1)
+        offset = phase_offset(1, 1)
+
+        self.assertEqual(self.scheduler.pop_due(offset + 3.5), [("a", offset, 3)])
+        self.assertEqual(self.scheduler.lag.skipped, 3)
+        self.assertEqual(self.scheduler.next_deadline(), offset + 4)
+
+    def test_lag(self):
+        """A caller late at each deadline (driven by a VirtualClock): the lag is measured from the deadline,
+        and the next deadlines do not drift
+        """
+        clock = VirtualClock(0)
+        self.scheduler.add("a", 1, clock.time(), key=1)
+        offset = phase_offset(1, 1)
+
+        deadlines = []
+        for lag in (0.1, 0.3, 0.2, 2.5, 0.1):
+            clock.set(self.scheduler.next_deadline() + lag)
+            for _, deadline, _ in self.scheduler.pop_due(clock.time()):
+                self.scheduler.lag.add(clock.time() - deadline)
+                deadlines.append(deadline)
+
+        self.assertEqual(deadlines, [offset + i for i in (0, 1, 2, 3, 6)])
+        stats = self.scheduler.lag.get_stats()
+        self.assertEqual((stats["ticks"], stats["skipped_ticks"]), (5, 2))
+        self.assertAlmostEqual(stats["max_lag"], 2.5)
+        self.assertAlmostEqual(stats["avg_lag"], 3.2 / 5)
+        self.assertAlmostEqual(stats["last_lag"], 0.1)
+
+    def test_remove(self):
+        self.scheduler.add("a", 1, 0)
+        self.scheduler.add("b", 1, 0)
+        self.scheduler.remove("a")
+        self.assertNotIn("a", self.scheduler)
+        self.assertEqual({job for job, _, _ in self.run_until(3)}, {"b"})
+
+        self.scheduler.remove("b")
+        self.assertIsNone(self.scheduler.next_deadline())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import math
+import os
+import random
+import tempfile
+import unittest
+
+from monitor import storage
+from monitor.models import db, Website, Check
+from monitor.monitor import db_init
+from monitor.aggregator import Aggregate, NO_RESPONSE
+from monitor.check_writer import CheckWriter
+from monitor.clock import VirtualClock
+from monitor.retention import RetentionJob
+from monitor.rollups import get_history_aggregate
+from monitor.segments import SegmentStore, DAY
+from monitor.website_monitor import WebsiteMonitor
+
+
+def random_rows(website_id, start, end, step, seed=0):
+    rand = random.Random(seed)
+    rows = []
+    for date in range(start, end, step):
+        status_code = rand.choice((200, 200, 200, 404, 500, NO_RESPONSE))
+        outcome = rand.choice((Check.TIMEOUT, Check.RESET)) if status_code == NO_RESPONSE else Check.OK
+        rows.append({"website": website_id, "date": date, "full_resp_time": rand.uniform(0.2, 0.4),
+                     "resp_time": rand.uniform(0.05, 0.2), "status_code": status_code, "outcome": outcome,
+                     "dns_time": 0.01, "ttfb_time": 0.05, "body_time": 0.1})
+    rows.append({"website": website_id, "date": end - 1, "full_resp_time": 0, "resp_time": 0,
+                 "status_code": NO_RESPONSE, "outcome": Check.OVERRUN})
+    return rows
+
+
+def rows_aggregate(rows, min_date, max_date):
+    aggregate = Aggregate()
+    for row in rows:
+        if min_date <= row["date"] < max_date and row["outcome"] != Check.OVERRUN:
+            aggregate.add(row["full_resp_time"], row["resp_time"], row["status_code"],
+                          [row.get(phase, 0) for phase in ("dns_time", "connect_time", "tls_time", "ttfb_time",
+                                                            "body_time")], row["outcome"])
+    return aggregate
+
+
+class SegmentStoreTest(unittest.TestCase):
+    """Test case on the columnar segment files of the checks"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # Small chunks: the ranges of dates go over several chunks and segments
+        self.store = SegmentStore(self.directory.name, segment_duration=3600, chunk_rows=64)
+        self.start = 1000 * 3600
+        self.rows = random_rows(1, self.start, self.start + 3 * 3600, 7)
+
+    def assertSameAggregate(self, aggregate, expected):
+        stats, expected = aggregate.get_stats(), expected.get_stats()
+        self.assertEqual(stats["codes_count"], expected["codes_count"])
+        self.assertEqual(stats["failures"], expected["failures"])
+        for name in ("availability", "max_rt", "avg_rt", "avg_full_rt", "avg_ttfb", "p50_rt", "p99_full_rt"):
+            # The times are float32
+            self.assertAlmostEqual(stats[name], expected[name], places=5)
+
+    def test_aggregate(self):
+        # In several batches
+        for i in range(0, len(self.rows), 100):
+            self.store.append(self.rows[i:i + 100])
+        self.assertEqual(self.store.count(1), len(self.rows))
+        self.assertEqual(self.store.segment_starts(1), (self.start, self.start + 3600, self.start + 7200))
+
+        for min_date, max_date in ((self.start, self.start + 3 * 3600), (self.start + 1000, self.start + 1060),
+                                   (self.start + 3000, self.start + 9000), (self.start + 5000, None)):
+            self.assertSameAggregate(self.store.get_aggregate(1, min_date, max_date),
+                                     rows_aggregate(self.rows, min_date, max_date or self.start + 4 * 3600))
+        self.assertEqual(self.store.get_aggregate(2, self.start).count, 0)
+
+        rows = self.store.rows(1, self.start + 70, self.start + 84)
+        self.assertEqual([row[0] for row in rows], [self.start + 70, self.start + 77])
+        self.assertEqual(rows[0][3:5], (self.rows[10]["status_code"], self.rows[10]["outcome"]))
+        self.assertAlmostEqual(rows[0][2], self.rows[10]["resp_time"], places=6)
+
+    def test_late_checks(self):
+        """Checks older than the last ones of their segment, and a segment opened again by another store"""
+        self.store.append(self.rows[200:])
+        self.store.append(self.rows[:200])
+        self.store.close()
+        store = SegmentStore(self.directory.name, segment_duration=3600, chunk_rows=64)
+        store.append([dict(self.rows[0], date=self.start + 3)])
+
+        self.assertEqual(store.count(1), len(self.rows) + 1)
+        self.assertSameAggregate(store.get_aggregate(1, self.start + 500, self.start + 4000),
+                                 rows_aggregate(self.rows, self.start + 500, self.start + 4000))
+        self.assertEqual(store.get_aggregate(1, self.start, self.start + 7).count, 2)
+
+    def test_prune(self):
+        self.store.append(self.rows)
+        first_hour = len([row for row in self.rows if row["date"] < self.start + 3600])
+        self.assertEqual(self.store.prune(1, self.start + 5000), first_hour)
+        self.assertEqual(self.store.segment_starts(1), (self.start + 3600, self.start + 7200))
+        self.assertEqual(self.store.drop(1), len(self.rows) - first_hour)
+        self.assertEqual(self.store.website_ids(), [])
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+
+class SegmentBackendTest(unittest.TestCase):
+    """Test case on the monitoring with the checks in segment files: the stats are the same as with the Check table"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        self.directory = tempfile.TemporaryDirectory()
+        db.init(os.path.join(self.directory.name, "webmo.db"))
+        db_init()
+        self.store = SegmentStore(os.path.join(self.directory.name, "segments"))
+        storage.set_check_store(self.store)
+
+        self.website = Website.create(url="http://localhost/", check_interval=10)
+        self.now = 1000000 * 3600 + 1234
+        self.rows = random_rows(self.website.id, self.now - 3 * DAY, self.now, 10)
+
+    def test_backend(self):
+        writer = CheckWriter()
+        writer.flush([(None, row) for row in self.rows])
+
+        self.assertEqual(Check.select().count(), 0)
+        self.assertEqual(self.store.count(self.website.id), len(self.rows))
+        for min_date in (self.now - 2 * DAY - 17, self.now - 3600 + 5):
+            self.assertEqual(get_history_aggregate(self.website, min_date).count,
+                             rows_aggregate(self.rows, min_date, self.now).count)
+
+        # The window of a new monitor is filled from the segment files
+        monitor = WebsiteMonitor(self.website, None, clock=VirtualClock(self.now))
+        stats = monitor.get_stats(10)
+        self.assertEqual(stats["codes_count"], rows_aggregate(self.rows, self.now - 600, self.now).codes_count)
+
+        # The old segments are deleted whole
+        report = RetentionJob(retention_days=1, clock=VirtualClock(self.now)).run()
+        self.assertEqual(report["checks"], len([row for row in self.rows if row["date"] < self.now // DAY * DAY - DAY]))
+        # The stats still come from the rollups, without the checks of the first minute
+        min_date = self.now - 2 * DAY - 17
+        self.assertEqual(get_history_aggregate(self.website, min_date).count,
+                         rows_aggregate(self.rows, math.ceil(min_date / 60) * 60, self.now).count)
+
+    def test_deleted_website(self):
+        deleted = Website.create(url="http://deleted/", check_interval=10)
+        deleted_row = dict(self.rows[0], website=deleted.id)
+        deleted.delete_instance()
+
+        CheckWriter().flush([(None, self.rows[0]), (None, deleted_row)])
+        self.assertEqual(self.store.website_ids(), [self.website.id])
+
+    def tearDown(self):
+        storage.set_check_store(None)
+        self.store.close()
+        db.close()
+        db.init(self.database)
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+from collections import defaultdict
+from http.server import ThreadingHTTPServer
+
+from monitor.models import Website, Check
+from monitor.sharding import ShardedEngine, ShardWebsite, shard_of, encode_result, decode_results
+from monitor.tests.test_phase_timing import OkHandler
+
+
+class FakeMonitor:
+    """Only record the results received by the coordinator"""
+
+    def __init__(self, website):
+        self.website = website
+        self.results = []
+
+    def record(self, result):
+        self.results.append(result)
+
+
+class ShardOfTest(unittest.TestCase):
+    """Test case on the assignment of the websites to the shards"""
+
+    def test_spread(self):
+        counts = defaultdict(int)
+        for website_id in range(1, 4001):
+            counts[shard_of(website_id, 4)] += 1
+        self.assertEqual(sorted(counts), [0, 1, 2, 3])
+        for count in counts.values():
+            self.assertAlmostEqual(count, 1000, delta=150)
+
+    def test_stable_with_a_new_shard(self):
+        """Only the websites moving to the new shard move"""
+        moved = 0
+        for website_id in range(1, 4001):
+            shard = shard_of(website_id, 5)
+            if shard != shard_of(website_id, 4):
+                self.assertEqual(shard, 4)
+                moved += 1
+        self.assertAlmostEqual(moved, 800, delta=150)
+
+
+class ResultEncodingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        results = [(1700000000.25, 0.5, 0.2, 200, Check.OK, 0.01, 0.02, 0.03, 0.14, 0.3),
+                   (1700000001.5, 0.8, 0, 0, Check.TIMEOUT, 0.01, 0.02, 0, 0, 0)]
+        data = encode_result(3, results[0]) + encode_result(12, results[1])
+        self.assertEqual(list(decode_results(data)), [(3, results[0]), (12, results[1])])
+
+
+class ShardedEngineTest(unittest.TestCase):
+    """Test case on the checks run by the worker processes, on a local server"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.monitors = [FakeMonitor(ShardWebsite(website_id, url, 1, Website.WARM)) for website_id in range(1, 5)]
+        self.engine = ShardedEngine(2, max_concurrency=4)
+
+    def test_results_recorded(self):
+        self.engine.start(self.monitors)
+        time.sleep(4)
+        self.engine.stop()
+
+        for monitor in self.monitors:
+            self.assertGreaterEqual(len(monitor.results), 2)
+            for result in monitor.results:
+                self.assertEqual(result[3:5], (200, Check.OK))
+        self.assertGreaterEqual(self.engine.get_lag_stats()["ticks"], 8)
+
+    def test_update(self):
+        """The removed websites are no longer checked, the others keep being checked"""
+        self.engine.start(self.monitors)
+        time.sleep(2)
+        kept, removed = self.monitors[:2], self.monitors[2:]
+        self.engine.update(kept)
+        # The checks already running are still recorded
+        time.sleep(1)
+        nb_results = [len(monitor.results) for monitor in removed]
+        time.sleep(2)
+        self.engine.stop()
+
+        self.assertEqual([len(monitor.results) for monitor in removed], nb_results)
+        for monitor in kept:
+            self.assertGreaterEqual(len(monitor.results), 3)
+
+    def tearDown(self):
+        self.engine.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import random
+import statistics
+import tempfile
+import unittest
+
+from monitor.models import db, Website, Check, Alert
+from monitor.monitor import db_init
+from monitor.aggregator import NO_RESPONSE
+from monitor.clock import VirtualClock
+from monitor.simulation import Simulation, SiteModel, Outage
+
+HOUR = 3600
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    def test_clock(self):
+        clock = VirtualClock(1000)
+        clock.sleep(5)
+        self.assertEqual(clock.time(), 1005)
+        clock.set(1100)
+        clock.set(1050)
+        self.assertEqual(clock.time(), 1100)
+
+
+class SiteModelTest(unittest.TestCase):
+
+    def test_results(self):
+        rand = random.Random(1)
+        model = SiteModel(latency=0.2, error_rate=0.1, failure_rate=0.05, outages=[Outage(100, 200, 503)])
+        results = [model.result(date, date, 10, rand) for date in range(1000, 11000)]
+        codes = [result[3] for result in results]
+        self.assertAlmostEqual(codes.count(500) / len(codes), 0.1, delta=0.01)
+        self.assertAlmostEqual(codes.count(NO_RESPONSE) / len(codes), 0.05, delta=0.01)
+        self.assertAlmostEqual(statistics.median(result[2] for result in results if result[3] == 200), 0.2,
+                               delta=0.01)
+
+        date, full_rt, rt, status_code, outcome = model.result(1000, 150, 10, rand)[:5]
+        self.assertEqual((status_code, outcome), (503, Check.OK))
+        date, full_rt, rt, status_code, outcome = SiteModel(failure_rate=1).result(1000, 150, 10, rand)[:5]
+        self.assertEqual((status_code, outcome), (NO_RESPONSE, Check.TIMEOUT))
+        self.assertGreater(full_rt, 5)
+
+
+class SimulationTest(unittest.TestCase):
+    """Test case on hours of simulated monitoring: the alerts and the stats of the outages"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database = db.database
+        db.close()
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db.init(self.path)
+        db_init()
+
+        self.websites = [Website.create(url="http://site%d.test/" % i, check_interval=10) for i in range(3)]
+        healthy, unavailable, hanging = self.websites
+        self.models = {
+            healthy.id: SiteModel(latency=0.05),
+            # Down for 30 min after the first hour
+            unavailable.id: SiteModel(latency=0.2, outages=[Outage(HOUR, HOUR + 1800, 503)]),
+            # Timing out for 10 min after 2 hours
+            hanging.id: SiteModel(latency=0.1, error_rate=0.01,
+                                  outages=[Outage(2 * HOUR, 2 * HOUR + 600, NO_RESPONSE, Check.TIMEOUT)]),
+        }
+        self.stats = []
+        self.simulation = Simulation(self.websites, self.models, start=1000 * HOUR, stats_interval=60,
+                                     timeframes=(10, 120), on_stats=self.on_stats)
+
+    def on_stats(self, date, timeframe, stats):
+        self.stats.append((date - self.simulation.start, timeframe, stats))
+
+    def test_outages(self):
+        report = self.simulation.run(6 * HOUR)
+        healthy, unavailable, hanging = self.websites
+
+        self.assertEqual(report["checks"], 3 * 6 * 360)
+        self.assertEqual(Check.select().count(), 3 * 6 * 360)
+        self.assertEqual(report["stats"], 6 * 60)
+        self.assertEqual(len(self.stats), 2 * 6 * 60)
+        # Hours of monitoring in seconds
+        self.assertLess(report["wall_time"], 60)
+
+        def alerts(website):
+            return [(alert.date.timestamp() - self.simulation.start, alert.availability) for alert in
+                    Alert.select().where(Alert.website == website).order_by(Alert.date)]
+
+        self.assertEqual(alerts(healthy), [])
+        for website, start, end in ((unavailable, HOUR, HOUR + 1800), (hanging, 2 * HOUR, 2 * HOUR + 600)):
+            (down_date, down_availability), (resumed_date, resumed_availability) = alerts(website)
+            self.assertTrue(start <= down_date <= start + 60)
+            self.assertLess(down_availability, 80)
+            self.assertTrue(end <= resumed_date <= end + 120)
+            self.assertGreaterEqual(resumed_availability, 80)
+        self.assertEqual(report["alerts"], len(self.simulation.alerts), 4)
+
+        self.assertEqual(Check.select().where(Check.website == hanging, Check.outcome == Check.TIMEOUT).count(), 60)
+
+        # The stats displayed in the middle of the outage, and 2 hours after it
+        for elapsed, timeframe, stats in self.stats:
+            if elapsed == HOUR + 1200 and timeframe == 10:
+                self.assertEqual(stats[unavailable.id]["availability"], 0)
+                self.assertEqual(stats[healthy.id]["availability"], 100)
+                self.assertAlmostEqual(stats[healthy.id]["p50_rt"], 0.05, delta=0.01)
+            if elapsed == HOUR + 1800 + 2 * HOUR and timeframe == 120:
+                self.assertEqual(stats[unavailable.id]["availability"], 100)
+                self.assertLess(stats[hanging.id]["availability"], 100)
+
+    def test_runs(self):
+        """The simulation goes on at each run, with the models of the run"""
+        healthy = self.websites[0]
+        self.simulation.run(1800)
+        self.models[healthy.id] = SiteModel(status_code=500)
+        report = self.simulation.run(600)
+        self.assertEqual(report["checks"], 3 * 60)
+        self.assertEqual([alert.website.id for alert in self.simulation.alerts], [healthy.id])
+        self.assertEqual(self.simulation.monitors[0].get_stats(10)["availability"], 0)
+
+    def tearDown(self):
+        db.close()
+        os.remove(self.path)
+        db.init(self.database)
+
+
+if __name__ == '__main__':
+    unittest.main()
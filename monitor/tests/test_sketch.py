@@ -0,0 +1,47 @@
+import random
+import unittest
+
+from monitor.sketch import LatencySketch, RELATIVE_ACCURACY
+
+
+class LatencySketchTest(unittest.TestCase):
+    """Test case on the quantile sketches of the response times"""
+
+    def setUp(self):
+        random.seed(11)
+        # A long tail: most responses in about 100 ms, a few in more than a second
+        self.values = ([random.gauss(0.1, 0.01) for _ in range(9000)] +
+                       [random.uniform(0.2, 3) for _ in range(1000)])
+
+    def assertQuantiles(self, sketch, values):
+        values = sorted(values)
+        for q in (0.5, 0.95, 0.99):
+            exact = values[round(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * RELATIVE_ACCURACY * 1.01)
+
+    def test_quantiles(self):
+        sketch = LatencySketch.from_values(self.values)
+        self.assertEqual(sketch.count, len(self.values))
+        self.assertQuantiles(sketch, self.values)
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+    def test_merge(self):
+        """Merged sketches give the quantiles of all their durations"""
+        random.shuffle(self.values)
+        sketch = LatencySketch()
+        for i in range(0, len(self.values), 100):
+            sketch.merge(LatencySketch.from_values(self.values[i:i + 100]))
+
+        self.assertQuantiles(sketch, self.values)
+        self.assertEqual(sketch.bins, LatencySketch.from_values(self.values).bins)
+
+    def test_bytes(self):
+        sketch = LatencySketch.from_values(self.values)
+        copy = LatencySketch.from_bytes(sketch.to_bytes())
+        self.assertEqual(copy.bins, sketch.bins)
+        self.assertEqual(copy.count, sketch.count)
+        self.assertEqual(LatencySketch.from_bytes(None).count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+import urwid
+
+from monitor.aggregator import Aggregate
+from monitor.monitor_tui import (ExtendedListBox, MainView, SelectableText, StatsSnapshot, StatsWalker,
+                                 stats_widgets_duration)
+
+
+class StatsWalkerTest(unittest.TestCase):
+    """Test case on the rows of the stats panel: bounded, and built only when displayed"""
+
+    SIZE = (40, 10)
+
+    def setUp(self):
+        self.built = []
+        self.walker = StatsWalker(self.make_widgets, 100, SelectableText("Beginning"))
+        self.list_box = ExtendedListBox(self.walker)
+
+    def make_widgets(self, snapshot):
+        self.built.append(snapshot)
+        return (SelectableText("At %d" % snapshot.date),
+                urwid.Pile([urwid.Text(url) for url, _ in snapshot.websites_stats]))
+
+    def add(self, date):
+        self.walker.add(StatsSnapshot(date, 10, [("http://localhost/", {}), ("http://other/", {})]))
+
+    def visible_text(self):
+        return b"\n".join(self.list_box.render(self.SIZE, focus=True).text).decode()
+
+    def test_retention(self):
+        for date in range(10000):
+            self.add(date)
+            if date % 100 == 0:
+                self.list_box.render(self.SIZE, focus=True)
+
+        self.assertEqual(len(self.walker.snapshots), 100)
+        self.assertEqual(len(self.walker), 201)
+        # Only the snapshots displayed have been built
+        self.assertLess(len(self.built), 1000)
+        self.assertLessEqual(len(self.walker._widgets), StatsWalker.CACHE_SIZE)
+        self.assertIn("At 9999", self.visible_text())
+
+    def test_navigation(self):
+        for date in range(50):
+            self.add(date)
+
+        self.list_box.keypress(self.SIZE, "b")
+        self.assertIn("Beginning", self.visible_text())
+        self.assertIn("At 0", self.visible_text())
+        # Not the snapshots in between
+        self.assertLess(len(self.built), 20)
+
+        self.list_box.keypress(self.SIZE, "u")
+        self.assertNotIn("Beginning", self.visible_text())
+
+        self.list_box.keypress(self.SIZE, "t")
+        self.assertEqual(self.list_box.focus_position, 0)
+        self.assertIn("At 49", self.visible_text())
+
+    def test_focus_kept_on_previous_stats(self):
+        for date in range(5):
+            self.add(date)
+        self.list_box.set_focus(4)
+        self.add(5)
+        # The focus stays on the same stats
+        self.assertEqual(self.list_box.focus_position, 6)
+        self.assertIs(self.list_box.focus, self.walker[6])
+        self.assertEqual(self.walker.snapshots[3].date, 2)
+
+    def test_render_timed(self):
+        """The widgets of the stats are timed when urwid draws them, not when the stats are added"""
+        view = MainView.__new__(MainView)  # stats_widgets only needs the class
+        walker = StatsWalker(view.stats_widgets, 100, SelectableText("Beginning"))
+        list_box = ExtendedListBox(walker)
+        count = stats_widgets_duration.count
+
+        for date in range(10):
+            walker.add(StatsSnapshot(date, 10, [("http://localhost/", Aggregate().get_stats())]))
+        self.assertEqual(stats_widgets_duration.count, count)
+        list_box.render((100, 20), focus=True)
+        self.assertGreater(stats_widgets_duration.count, count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from monitor.models import db, Website
+from monitor.monitor import db_init
+from monitor import storage
+from monitor.storage import StorageProfile, PROFILES, configure_storage, checkpoint
+
+
+class StorageTest(unittest.TestCase):
+    """Test case on the settings of the database connections"""
+
+    def setUp(self):
+        # Work on a temporary database file instead of the real one
+        self.database, self.profile = db.database, storage.profile
+        db.close()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "webmo.db")
+
+    def test_profile(self):
+        configure_storage(self.path, StorageProfile(cache_size=1024, mmap_size=2 ** 20))
+        db_init()
+        self.assertEqual(db.database, self.path)
+        self.assertEqual(db.pragma("journal_mode"), "wal")
+        self.assertEqual(db.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(db.pragma("cache_size"), -1024)
+        self.assertEqual(db.pragma("mmap_size"), 2 ** 20)
+        self.assertEqual(db.pragma("foreign_keys"), 1)
+
+        # The path stays the same with another profile
+        configure_storage(storage_profile=PROFILES["compat"])
+        self.assertEqual(db.database, self.path)
+        self.assertEqual(db.pragma("journal_mode"), "delete")
+        self.assertEqual(checkpoint(), (0, -1, -1))
+
+    def test_concurrent_read(self):
+        """A reader in the middle of a transaction does not block the writer, and sees the database
+        as it was when its transaction began
+        """
+        configure_storage(self.path, PROFILES["fast"])
+        db_init()
+        Website.create(url="http://before/")
+
+        reading, written = threading.Event(), threading.Event()
+        counts = []
+
+        def read():
+            with db.atomic():
+                counts.append(Website.select().count())
+                reading.set()
+                written.wait(5)
+                counts.append(Website.select().count())
+            counts.append(Website.select().count())
+            db.close()
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reading.wait(5)
+        with db.atomic():
+            Website.create(url="http://after/")
+        written.set()
+        reader.join()
+        self.assertEqual(counts, [1, 1, 2])
+
+        busy, wal_pages, copied = checkpoint("TRUNCATE")
+        self.assertEqual((busy, wal_pages, copied), (0, 0, 0))
+        self.assertEqual(os.path.getsize(self.path + "-wal"), 0)
+        with self.assertRaises(ValueError):
+            checkpoint("NOW")
+
+    def tearDown(self):
+        db.close()
+        configure_storage(self.database, self.profile)
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
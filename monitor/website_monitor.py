@@ -1,10 +1,139 @@
 import requests
 import time
+import urllib3
 from urllib.parse import urlparse
-from peewee import fn
 
-from monitor.repeated_timer import RepeatedTimer
-from monitor.models import Website, Check, Alert
+from monitor.models import db, Website, Check, Alert
+from monitor.http_pool import session_pool, new_session
+from monitor.phase_timing import start_timing
+from monitor.aggregator import RollingWindow, PHASES, NO_RESPONSE
+from monitor.ring_buffer import RingBuffer
+from monitor.rollups import save_checks, load_checks, get_history_aggregate, get_history_aggregates
+from monitor.analytics import get_raw_stats
+from monitor.check_engine import CheckEngine
+from monitor.clock import real_clock
+from monitor.instrumentation import instruments
+
+check_insert = instruments.histogram("check_insert_seconds", "Duration of the insertion of a check without writer")
+stats_query = instruments.histogram("stats_query_seconds", "Duration of the stats queries of the saved checks")
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The response has not been entirely read before the deadline of the check"""
+
+
+def read_body(response, deadline, chunk_size=64 * 1024):
+    """Read the whole content of a streamed response before the deadline (a time.monotonic() date)
+
+    The content is read as it comes, each read of the socket waiting at most the time left: a server sending its
+    content slowly cannot hold the check after the deadline. Raise DeadlineExceeded when it is reached
+    """
+    with response:
+        raw = response.raw
+        sock = getattr(raw.connection, "sock", None)
+        try:
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise DeadlineExceeded("The content has not been read before the deadline of the check")
+                if sock is not None:
+                    sock.settimeout(left)
+                # What has arrived (the content is then released to the pool, or closed in cold timing)
+                if not raw.read1(chunk_size):
+                    return
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise DeadlineExceeded(e) from e
+        except urllib3.exceptions.HTTPError as e:
+            # Like requests does for the content
+            raise requests.exceptions.ConnectionError(e) from e
+
+
+# Part of the check interval a check has to get the whole response: connection, headers and content
+DEADLINE_RATIO = 0.8
+
+
+def failure_outcome(error):
+    """The Check outcome of a request that got no response (error: the requests exception)"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return Check.TIMEOUT
+    if isinstance(error, requests.exceptions.SSLError):
+        return Check.TLS_ERROR
+    if isinstance(error, requests.exceptions.ChunkedEncodingError):
+        return Check.RESET
+
+    # The urllib3 error behind the requests one (inside a MaxRetryError for the connection errors)
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    if isinstance(reason, urllib3.exceptions.NameResolutionError):
+        return Check.DNS_ERROR
+    if isinstance(reason, urllib3.exceptions.NewConnectionError):
+        return Check.CONNECT_ERROR
+    if isinstance(reason, (urllib3.exceptions.ProtocolError, ConnectionError)):
+        # The server closed or reset the connection before the end of the response
+        return Check.RESET
+    return Check.ERROR
+
+
+def probe(website, session_pool=session_pool):
+    """Check the website once, without saving anything (the shard workers probe without database):
+    - full response time in seconds (when the content is loaded)
+    - response time in seconds (just after that the response headers have been parsed)
+    - response code, and the outcome of the check
+    - the duration of each phase: DNS lookup, TCP connection, TLS handshake, wait for the headers, content
+
+    The whole response has to be read in DEADLINE_RATIO of the check interval, from the DNS lookup to the end
+    of the content (see monitor.phase_timing), otherwise the check gets
+    the TIMEOUT outcome and no response (status code NO_RESPONSE). The other failures (DNS, connection, TLS...)
+    get their outcome the same way.
+    return: the tuple (date, full_resp_time, resp_time, status_code, outcome, dns, connect, tls, ttfb, body),
+    like the checks loaded in a RollingWindow
+    """
+
+    # To get the entire (when the content is entirely loaded) response time
+    start = time.time()
+    deadline = time.monotonic() + website.check_interval * DEADLINE_RATIO
+    timings = start_timing(deadline)
+    try:
+        r = fetch(website.url, website.timing, deadline, session_pool)
+        full_rt = time.time() - start
+    except requests.exceptions.RequestException as e:
+        # No (complete) response: the website does not exist, is down, too slow...
+        # The full response time is the time until the failure
+        return (start, time.time() - start, 0, NO_RESPONSE, failure_outcome(e),
+                timings.dns, timings.connect, timings.tls, 0, 0)
+
+    # elapsed measures the time taken between sending the first byte of the request
+    # and finishing parsing the headers
+    rt = r.elapsed.total_seconds()
+
+    # elapsed includes the opening of the connection (if it is a new one): what is left is the time
+    # waiting for the server to answer. The rest of the full response time is the transfer of the content
+    ttfb = max(rt - timings.connection_time(), 0)
+    body = max(full_rt - rt, 0)
+
+    return start, full_rt, rt, r.status_code, Check.OK, timings.dns, timings.connect, timings.tls, ttfb, body
+
+
+def overrun(date):
+    """The result of a check that has been skipped: the previous one was still running when it was due"""
+    return date, 0, 0, NO_RESPONSE, Check.OVERRUN, 0, 0, 0, 0, 0
+
+
+def fetch(url, timing, deadline, session_pool=session_pool):
+    """Send a GET request to the url, on a new connection or on a kept alive one depending on the timing mode,
+    and read the whole response before the deadline (a time.monotonic() date)
+    """
+    timeout = max(deadline - time.monotonic(), 0.001)
+    if timing == Website.WARM:
+        response = session_pool.get(url).get(url, timeout=timeout, stream=True)
+        read_body(response, deadline)
+        return response
+
+    # Cold timing: a new connection that is closed just after the check
+    with new_session() as session:
+        response = session.get(url, timeout=timeout, headers={"Connection": "close"}, stream=True)
+        read_body(response, deadline)
+        return response
 
 
 class WebsiteMonitor:
@@ -12,20 +141,34 @@ class WebsiteMonitor:
 
     - url: the website url (with http or https scheme)
     - check_interval: interval of time between each check
-    - repeated_timer: the scheduler for the check jobs
-    - full_resp_times: list of the full response times (when the entire content is loaded)
-    - resp_times: list of the response times (just after that the response headers have been parsed)
+    - engine: the CheckEngine running the check jobs of the monitor alone (see run), the TerminalController
+      schedules all the monitors on its own engine instead
+    - full_resp_times: the last full response times (when the entire content is loaded)
+    - resp_times: the last response times (just after that the response headers have been parsed)
+    - status_codes: the last status codes
+      (ring buffers of {samples_capacity} samples: the memory of a monitor does not grow with its uptime)
+    - session_pool: the keep-alive sessions shared by the monitors, used when the website timing is "warm"
+    - writer: the CheckWriter saving the checks in batches. Without writer, each check is saved right away
+    - window: the stats of the last hour of checks, kept in memory for the alerts and the displayed stats
+    - clock: the date of the checks recorded without date (overruns), of the alerts and of the stats
+      (a VirtualClock in the simulations)
     """
 
     # Schemes for the url property
     CORRECT_SCHEMES = ["http", "https"]
     # Availability threshold for alerts
     THRESHOLD = 80
+    # Number of samples kept in full_resp_times, resp_times and status_codes
+    SAMPLES_CAPACITY = 1024
 
-    def __init__(self, website, controller):
-        self.repeated_timer = None
+    def __init__(self, website, controller, session_pool=session_pool, writer=None,
+                 samples_capacity=SAMPLES_CAPACITY, clock=real_clock):
+        self.engine = None
+        self.clock = clock
         self.website = website
         self.controller = controller
+        self.session_pool = session_pool
+        self.writer = writer
 
         # Check the last alert (if it exists) of the website to see if it was down
         self.on_alert = False
@@ -33,70 +176,77 @@ class WebsiteMonitor:
         if last_alert and last_alert.availability < 80:
             self.on_alert = True
 
-        self.full_resp_times = []
-        self.resp_times = []
-        self.status_codes = []
+        self.full_resp_times = RingBuffer("d", samples_capacity)
+        self.resp_times = RingBuffer("d", samples_capacity)
+        self.status_codes = RingBuffer("H", samples_capacity)
+
+        # Start with the checks already saved, the database is then only read for older stats
+        self.window = RollingWindow()
+        min_date = self.clock.time() - self.window.duration
+        self.window.load(load_checks(self.website, min_date))
 
     def run(self):
         """Start the scheduled monitoring check jobs for the website"""
-        self.repeated_timer = RepeatedTimer(self.website.check_interval, self.check)
+        if not self.engine:
+            self.engine = CheckEngine(max_concurrency=1)
+        self.engine.start([self])
 
     def stop(self):
-        if self.repeated_timer:
-            self.repeated_timer.stop()
+        if self.engine:
+            self.engine.stop()
 
     def check(self):
-        """Gather the information needed for the monitoring:
-        - availability (if the response code is equal to 200)
-        - full response time in seconds (when the content is loaded)
-        - response time in seconds
-        - response code
-        """
-
-        # TODO: check if check_interval is not too short
-        # but normally it is just one thread, so it is just décalé ?
-        # ou mettre un timeout égale à la moitié du check_interval
-        try:
-            # To get the entire (when the content is entirely loaded) response time
-            start = time.time()
-            r = requests.get(self.website.url,
-                             timeout=(self.website.check_interval / 3))  # Send a GET requests with the requests library
-            full_rt = time.time() - start
-        except requests.exceptions.ConnectionError:  # from urllib3.exceptions.MaxRetryError:
-            # The website does not exist, urllib3 tried 3 times
-            return
-        except requests.exceptions.ReadTimeout:
-            # The request took more time than the timeout
+        """Probe the website (see probe) and record the result"""
+        self.record(probe(self.website, self.session_pool))
+
+    def record(self, result):
+        """Save the result of a check (a tuple returned by probe), and add it to the stats and the alerts"""
+        date, full_rt, rt, status_code, outcome = result[:5]
+        phases = result[5:]
+        # A new Check associated to the current Website
+        row = {"website": self.website, "date": date, "full_resp_time": full_rt, "resp_time": rt,
+               "status_code": status_code, "outcome": outcome}
+        for phase, duration in zip(PHASES, phases):
+            row[phase + "_time"] = duration
+        self.save(row)
+
+        if outcome == Check.OVERRUN:
+            # Not counted in the stats
             return
 
-        # print(self.url + ": " + str(r.status_code) + " for " + str(r.elapsed))
-        self.status_codes.append(r.status_code)
-
-        self.full_resp_times.append(full_rt)
-
-        # elapsed measures the time taken between sending the first byte of the request
-        # and finishing parsing the headers
-        self.resp_times.append(r.elapsed.total_seconds())
-
-        # Create a new Check associated to the current Website
-        Check.create(website=self.website, date=start, full_resp_time=full_rt,
-                     resp_time=r.elapsed.total_seconds(), status_code=r.status_code)
+        self.status_codes.append(status_code)
+        if status_code != NO_RESPONSE:
+            self.full_resp_times.append(full_rt)
+            self.resp_times.append(rt)
+        self.window.add(date, full_rt, rt, status_code, phases, outcome=outcome)
 
         # Check the new availability
         self.check_availability()
 
+    def record_overrun(self):
+        """Save that a check has been skipped: the previous one was still running when it was due"""
+        self.record(overrun(self.clock.time()))
+
+    def save(self, row):
+        """Save a check (a dict of Check fields), with the writer if there is one"""
+        if self.writer:
+            self.writer.put(self, row)
+        else:
+            with check_insert.time(), db.atomic():
+                save_checks([row])
+
     def check_availability(self):
         availability = self.get_availability(2)
 
         if not self.on_alert and availability < WebsiteMonitor.THRESHOLD:
             self.on_alert = True
-            Alert.create(website=self.website, date=time.time(), availability=availability)
-            self.controller.update_alert_history()
+            alert = Alert.create(website=self.website, date=self.clock.time(), availability=availability)
+            self.controller.update_alert_history(alert)
 
         elif self.on_alert and availability >= WebsiteMonitor.THRESHOLD:
             self.on_alert = False
-            Alert.create(website=self.website, date=time.time(), availability=availability)
-            self.controller.update_alert_history()
+            alert = Alert.create(website=self.website, date=self.clock.time(), availability=availability)
+            self.controller.update_alert_history(alert)
 
     def get_availability(self, timeframe=2):
         """Return the availability for the website
@@ -107,21 +257,11 @@ class WebsiteMonitor:
         Return: availability over the timeframe {timeframe} in percentage
 
         """
+        # Only the counts of the buckets are needed: checked after each check
+        if self.window.covers(timeframe):
+            return self.window.get_availability(timeframe, self.clock.time())
 
-        min_date = time.time() - timeframe * 60
-
-        # Take only the success status codes
-        nb_2xx_codes = Check.select(fn.Count(Check.status_code)).where(Check.website == self.website,
-                                                                       Check.status_code >= 200,
-                                                                       Check.status_code <= 299,
-                                                                       Check.date >= min_date).scalar()
-        # Take all the status codes
-        nb_codes = Check.select(fn.Count(Check.status_code)).where(Check.website == self.website,
-                                                                   Check.date >= min_date).scalar()
-
-        # TODO: HERE code counting ?
-
-        return 100 * nb_2xx_codes // nb_codes if nb_codes > 0 else 0
+        return self.get_aggregate(timeframe).get_availability()
 
     def get_codes_stats(self, timeframe=10):
         """Return the number of each found status codes and the availability for the website
@@ -129,50 +269,33 @@ class WebsiteMonitor:
         Parameter: timeframe (in min)
         """
 
-        min_date = time.time() - timeframe * 60
-        codes_count = {}
-        nb_2xx_codes = 0
-        nb_codes = 0
-
-        query = Check.select().where(Check.website == self.website,
-                                                      Check.date >= min_date)
-        if query.exists():
-            for check in query:
-                code = check.status_code
-                if code not in codes_count:
-                    codes_count[code] = 1
-                else:
-                    codes_count[code] += 1
-
-                if 200 <= code <= 299:
-                    nb_2xx_codes += 1
-                nb_codes += 1
+        aggregate = self.get_aggregate(timeframe)
 
-        # Availability over the timeframe {timeframe} in percentage
-        availability = 100 * nb_2xx_codes // nb_codes if nb_codes > 0 else 0
+        return dict(aggregate.codes_count), aggregate.get_availability()
 
-        return codes_count, availability
-
-    def get_stats(self, timeframe=10):
+    def get_stats(self, timeframe=10, raw=False):
         """Gather the stats of the website over the timeframe {timeframe}
 
         parameter: timeframe (in min): the timeframe of each stat
+        raw: compute the stats from the saved checks, with the exact percentiles (see monitor.analytics)
         return: dict of stats
         """
-        # for check in Check.select().where(Check.website == self._website).order_by(Check.date.desc()):
-        #     print(check.date.strftime("%A %d %B %Y %H:%M:%S") + " : " + str(check.status_code) +
-        #           " in " + str(check.full_resp_time) + " s")
-
-        min_date = time.time() - timeframe * 60
+        if raw:
+            with stats_query.time():
+                return get_raw_stats([self.website], self.clock.time() - timeframe * 60)[self.website.id]
 
-        (max_rt, avg_rt, max_full_rt, avg_full_rt) = Check.select(
-            fn.Max(Check.resp_time), fn.Avg(Check.resp_time), fn.Max(Check.full_resp_time), fn.Avg(Check.full_resp_time)
-        ).where(Check.website == self.website, Check.date >= min_date).scalar(as_tuple=True)
+        return self.get_aggregate(timeframe).get_stats()
 
-        codes_count, availability = self.get_codes_stats(timeframe)
+    def get_aggregate(self, timeframe):
+        """Return the Aggregate of the checks over the timeframe (in min):
+        from the rolling window if it covers the timeframe, otherwise from the rollups of the saved checks
+        """
+        now = self.clock.time()
+        if self.window.covers(timeframe):
+            return self.window.get_aggregate(timeframe, now)
 
-        return {"max_rt": max_rt, "avg_rt": avg_rt, "max_full_rt": max_full_rt, "avg_full_rt": avg_full_rt,
-                "availability": availability, "codes_count": codes_count}
+        with stats_query.time():
+            return get_history_aggregate(self.website, now - timeframe * 60)
 
     def get_last_alert(self):
         last_alert = None
@@ -182,3 +305,36 @@ class WebsiteMonitor:
             pass
 
         return last_alert
+
+
+def get_monitors_stats(monitors, timeframe=10, now=None, raw=False):
+    """Gather the stats of several websites at once over the timeframe {timeframe} (in min) until now
+    (the current date by default)
+
+    The monitors whose rolling window covers the timeframe do not need the database,
+    the saved checks of all the others are aggregated by one query.
+    With raw, the stats of all the monitors are computed from their saved checks, loaded at once
+    (exact percentiles, see monitor.analytics): the checks still queued in the writer are not in them
+    return: dict {website id: dict of stats (the same as WebsiteMonitor.get_stats)}
+    """
+    if now is None:
+        now = time.time()
+    if raw:
+        with stats_query.time():
+            return get_raw_stats([monitor.website for monitor in monitors], now - timeframe * 60)
+    stats = {}
+    history_websites = []
+
+    for monitor in monitors:
+        if monitor.window.covers(timeframe):
+            stats[monitor.website.id] = monitor.window.get_aggregate(timeframe, now).get_stats()
+        else:
+            history_websites.append(monitor.website)
+
+    if history_websites:
+        with stats_query.time():
+            aggregates = get_history_aggregates(history_websites, now - timeframe * 60)
+        for website_id, aggregate in aggregates.items():
+            stats[website_id] = aggregate.get_stats()
+
+    return stats
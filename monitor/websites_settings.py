@@ -1,6 +1,7 @@
 import urwid
 from urllib.parse import urlparse
 
+from . import storage
 from .models import Website
 from .website_monitor import WebsiteMonitor
 
@@ -26,6 +27,12 @@ class WebsiteForm(urwid.WidgetWrap):
         # The inputs of the form:
         self.input_website = urwid.Edit("Your website url: ", self.website.url)
         self.input_check_interval = urwid.IntEdit("Check interval (in seconds): ", self.website.check_interval)
+        # Cold timing by default: a new connection for each check, like a first visitor
+        self.input_warm_timing = urwid.CheckBox("Warm timing (reuse a kept alive connection between checks)",
+                                                state=self.website.timing == Website.WARM)
+        # 0: the default retention of the checks
+        self.input_retention_days = urwid.IntEdit("Retention of the checks (in days, 0 for the default): ",
+                                                  self.website.retention_days or 0)
         # Put vertically the different inputs and labels
         pile = urwid.Pile([
             urwid.Text(description),
@@ -34,6 +41,10 @@ class WebsiteForm(urwid.WidgetWrap):
             blank,
             urwid.AttrMap(self.input_check_interval, 'input', 'input_f'),
             blank,
+            urwid.AttrMap(self.input_warm_timing, 'check_box', 'check_box_f'),
+            blank,
+            urwid.AttrMap(self.input_retention_days, 'input', 'input_f'),
+            blank,
             urwid.AttrMap(urwid.Padding(
                 urwid.Button("Submit", self.submit_press),
                 width=10), 'button', 'button_f'),
@@ -63,6 +74,8 @@ class WebsiteForm(urwid.WidgetWrap):
             # Then save the website in the db
             self.website.url = url
             self.website.check_interval = check_interval
+            self.website.timing = Website.WARM if self.input_warm_timing.get_state() else Website.COLD
+            self.website.retention_days = self.input_retention_days.value() or None
             self.confirmation.set_text("The website " + self.website.url + " has been saved")
             self.website.save()
 
@@ -145,6 +158,9 @@ class SettingsMenu(urwid.WidgetWrap):
 
         # TODO: a confirmation message before
         cur_website.delete_instance()
+        # The checks in the Check table are deleted with the website (CASCADE), not the ones in segment files
+        if storage.check_store:
+            storage.check_store.drop(cur_website.id)
         # Go back to the main menu with the websites list updated
         self._emit('reload')
 
@@ -156,8 +172,9 @@ class SettingsMenu(urwid.WidgetWrap):
 
         # To calculate the margin between boxes/menus
         MAX_BOX_LEVELS = 3
-        # Height of the box just above the return and exit buttons
-        BOX_HEIGHT = 10
+        # Height of the box just above the return and exit buttons: the rows of the WebsiteForm, with its
+        # confirmation message
+        BOX_HEIGHT = 14
 
         def __init__(self, box):
             super().__init__(urwid.AttrMap(urwid.SolidFill(u'/'), 'main_shadow'))
@@ -10,6 +10,10 @@ setup(
         "peewee",
         "urwid",
     ],
+    extras_require={
+        # Vectorized raw stats (webmo --raw-stats)
+        "numpy": ["numpy"],
+    },
     packages=find_packages(),
     entry_points={
         'console_scripts': [